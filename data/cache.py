@@ -0,0 +1,282 @@
+"""
+Persistent columnar cache for raw input files.
+
+Raw sources (compressed CSV, plain CSV, XLSX, shape files) are converted once into
+one NumPy file per column, geometries as concatenated WKB buffers. Later runs,
+also from other working directories, load these files memory-mapped instead of
+decompressing, parsing and reprojecting the source again. The
+cache is enabled by setting the `raw_cache_path` config option to a directory and
+entries are keyed by the absolute path, size and modification time of the source
+file, by a variant describing how the source has been parsed (e.g. the requested
+columns and their types) and by a version of the reader.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import uuid
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.wkb
+
+CACHE_VERSION = 3
+
+# Helper modules used by the readers, their source is part of the reader version
+READER_MODULES = ["data.constants", "data.utils", "data.codebook", "data.spatial.utils"]
+
+
+def configure(context):
+    context.config("raw_cache_path", default=None)
+
+
+def hash_code(hash, code):
+    """ Adds the byte code of a function, including nested functions, to a hash. """
+    hash.update(code.co_code)
+    hash.update(repr(code.co_names).encode("utf-8"))
+
+    for value in code.co_consts:
+        if hasattr(value, "co_code"):
+            hash_code(hash, value)
+        elif isinstance(value, frozenset):  # The order of sets depends on the hash seed
+            hash.update(repr(sorted(repr(item) for item in value)).encode("utf-8"))
+        else:
+            hash.update(repr(value).encode("utf-8"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_module_version(name):
+    """ Returns a digest of the source file of a module, or None if it has no source file. """
+    path = getattr(sys.modules.get(name), "__file__", None)
+
+    if path is None or not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_reader_version(reader):
+    """
+        Describes a reader, such that cache entries are invalidated when its code
+        changes. Functions are described by their byte code, other callables by name.
+        Additionally, the source files of the module of the reader and of the helper
+        modules in READER_MODULES are hashed.
+
+        Code that a reader calls in other modules is not tracked. If such code changes
+        the parsed tables, it must be added to READER_MODULES or CACHE_VERSION must be
+        increased.
+    """
+    hash = hashlib.sha1()
+    hash.update(repr((pd.__version__, np.__version__)).encode("utf-8"))
+
+    code = getattr(reader, "__code__", None)
+
+    if code is None:
+        name = "%s.%s" % (getattr(reader, "__module__", None), getattr(reader, "__qualname__", type(reader).__name__))
+        hash.update(name.encode("utf-8"))
+    else:
+        hash_code(hash, code)
+
+    for name in [getattr(reader, "__module__", None)] + READER_MODULES:
+        hash.update(repr(get_module_version(name)).encode("utf-8"))
+
+    return hash.hexdigest()
+
+
+def get_key(path, variant="", reader=None):
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+
+    version = None if reader is None else get_reader_version(reader)
+
+    hash = hashlib.sha1()
+    hash.update(repr((CACHE_VERSION, path, stat.st_size, stat.st_mtime_ns, variant, version)).encode("utf-8"))
+
+    return "%s.%s" % (os.path.basename(path), hash.hexdigest())
+
+
+def get_directory(context, path, variant="", reader=None):
+    cache_path = context.config("raw_cache_path")
+
+    if cache_path is None:
+        return None
+
+    return "%s/%s" % (cache_path, get_key(path, variant, reader))
+
+
+def to_wkb(geometries):
+    if hasattr(shapely, "to_wkb"):  # Shapely 2
+        return shapely.to_wkb(np.asarray(geometries, dtype=object))
+
+    return [None if geometry is None else geometry.wkb for geometry in geometries]
+
+
+def from_wkb(values):
+    if hasattr(shapely, "from_wkb"):  # Shapely 2
+        return shapely.from_wkb(np.asarray(values, dtype=object))
+
+    return [None if value is None else shapely.wkb.loads(value) for value in values]
+
+
+def write_geometry(prefix, geometries):
+    values = to_wkb(geometries)
+    lengths = np.array([0 if value is None else len(value) for value in values], dtype=np.int64)
+
+    offsets = np.zeros((len(values) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+
+    buffer = np.frombuffer(b"".join(value for value in values if value is not None), dtype=np.uint8)
+
+    np.save("%s.npy" % prefix, buffer, allow_pickle=False)
+    np.save("%s.offsets.npy" % prefix, offsets, allow_pickle=False)
+
+
+def load_geometry(prefix):
+    buffer = np.load("%s.npy" % prefix, mmap_mode="r", allow_pickle=False)
+    offsets = np.load("%s.offsets.npy" % prefix, allow_pickle=False)
+
+    values = [
+        None if start == end else bytes(buffer[start:end])
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+    return from_wkb(values)
+
+
+def write(directory, df):
+    """ Writes a data frame column by column into a new cache directory. """
+    temporary_directory = "%s.%s.tmp" % (directory, uuid.uuid4().hex)
+    os.makedirs(temporary_directory)
+
+    columns = []
+
+    for index, column in enumerate(df.columns):
+        values = df[column]
+
+        if isinstance(values, gpd.GeoSeries):
+            write_geometry("%s/%d" % (temporary_directory, index), values.values)
+            columns.append((column, "geometry", None))
+            continue
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            kind, categories = "categorical", values.cat.categories
+            values = values.cat.codes.values
+        elif values.dtype.kind not in "biufcmM":
+            kind = "object"
+            values, categories = pd.factorize(values, sort=False)
+        else:
+            kind, categories = "plain", None
+            values = values.values
+
+        np.save("%s/%d.npy" % (temporary_directory, index), np.ascontiguousarray(values), allow_pickle=False)
+        columns.append((column, kind, categories))
+
+    index = None if isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1 else df.index
+
+    with open("%s/meta.p" % temporary_directory, "wb") as f:
+        pickle.dump(dict(
+            columns=columns, index=index, length=len(df),
+            geometry=df.geometry.name if isinstance(df, gpd.GeoDataFrame) else None,
+            crs=df.crs if isinstance(df, gpd.GeoDataFrame) else None
+        ), f)
+
+    try:
+        os.rename(temporary_directory, directory)
+    except OSError:
+        # Another process has written the same entry in the meantime
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+
+
+def load(directory):
+    """
+        Loads a data frame from a cache directory, numeric columns are memory-mapped
+        (copy-on-write). The frame is assembled column by column, since constructing it
+        from a dictionary would consolidate the columns of one type into a copied block.
+    """
+    with open("%s/meta.p" % directory, "rb") as f:
+        meta = pickle.load(f)
+
+    index = pd.RangeIndex(meta["length"]) if meta["index"] is None else meta["index"]
+    series = []
+
+    for position, (column, kind, categories) in enumerate(meta["columns"]):
+        if kind == "geometry":
+            series.append(gpd.GeoSeries(load_geometry("%s/%d" % (directory, position)), index=index))
+            continue
+
+        values = np.load("%s/%d.npy" % (directory, position), mmap_mode="c", allow_pickle=False)
+
+        if kind == "categorical":
+            values = pd.Categorical.from_codes(values, categories=categories)
+        elif kind == "object":
+            codes = values
+            values = np.empty((len(codes),), dtype=object)
+            values[:] = np.nan
+
+            f = codes >= 0
+            values[f] = np.asarray(categories, dtype=object)[codes[f]]
+
+        series.append(pd.Series(values, index=index, copy=False))
+
+    if len(series) == 0:
+        df = pd.DataFrame(index=index)
+    else:
+        df = pd.concat(series, axis=1, copy=False)
+        df.columns = pd.Index([column for column, _, _ in meta["columns"]])
+
+    if meta["geometry"] is not None:
+        df = gpd.GeoDataFrame(df, geometry=meta["geometry"], crs=meta["crs"])
+
+    return df
+
+
+def hash_values(values):
+    """ Returns a digest of an array of values, e.g. to describe a filter by the ids it keeps. """
+    values = np.ascontiguousarray(np.sort(np.asarray(values)))
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def read(context, path, reader, variant="", filter=None, filter_variant=None):
+    """
+        Reads a raw source through the persistent cache.
+
+        The `reader` is called with the path of the source file if no cache entry
+        exists (or if caching is disabled) and must return a data frame. The `variant`
+        must describe everything that changes the output of the reader for the same
+        source file, for instance the requested fields and their types. The entries
+        are also keyed by the byte code of the reader and the pandas and NumPy
+        versions (see get_reader_version), such that changed readers do not obtain
+        stale tables.
+
+        If a `filter` is given, the reader is called with it as a second argument and is
+        expected to apply it while parsing (the filter returns a boolean mask for a data
+        frame). Only the filtered table is cached, under an entry that is additionally
+        keyed by the byte code of the filter and by `filter_variant`, which must describe
+        the values the filter closes over (see hash_values).
+    """
+    if filter is not None:
+        if filter_variant is None and getattr(filter, "__closure__", None):
+            raise RuntimeError("A filter_variant must be given to read %s with a filter that closes over values" % path)
+
+        variant = (variant, get_reader_version(filter), filter_variant)
+
+    directory = get_directory(context, path, variant, reader)
+
+    if directory is None:
+        return reader(path) if filter is None else reader(path, filter)
+
+    if not os.path.exists(directory):
+        df = reader(path) if filter is None else reader(path, filter)
+
+        print("Writing raw cache for %s ..." % path)
+        write(directory, df)
+    else:
+        print("Loading raw cache for %s ..." % path)
+        df = load(directory)
+
+    return df
@@ -0,0 +1,185 @@
+"""
+Code books for the survey and census variables that are recoded in the pipeline.
+
+Each code book maps raw codes to labels and is applied in one vectorized pass with
+`recode`, instead of one masked assignment per code. Codes that are not part of a
+code book become NaN, which is what the masked assignments produced before. String
+labels are returned as categoricals with the declared categories.
+"""
+
+import numpy as np
+import pandas as pd
+
+import data.constants as c
+
+
+# Microcensus: main mode of a trip (wmittel)
+MZ_MODE = {
+    -99: "unknown",  # Pseudo stage
+    1: "pt",  # Plane
+    2: "pt",  # Train
+    3: "pt",  # Postauto
+    4: "pt",  # Ship
+    5: "pt",  # Tram
+    6: "pt",  # Bus
+    7: "pt",  # other PT
+    8: "pt",  # Reisecar -> I think this is a coach in Swiss German?
+    9: "car",  # Car
+    10: "car",  # Truck
+    11: "pt",  # Taxi
+    12: "car",  # Motorbike
+    13: "car",  # Mofa
+    14: "bike",  # Biciycle / E-bike
+    15: "walk",  # Walking
+    16: "car",  # "Machines similar to a vehicle"
+    17: "unknown",  # Other / don't know
+}
+
+MZ_MODE_DETAILED = dict(MZ_MODE)
+MZ_MODE_DETAILED[1] = "plane"
+MZ_MODE_DETAILED[11] = "taxi"
+
+MZ_MODE_CATEGORIES = c.MODE_CATEGORIES
+MZ_MODE_DETAILED_CATEGORIES = c.MODE_DETAILED_CATEGORIES
+
+# Microcensus: purpose of a trip (wzweck1)
+MZ_PURPOSE = {
+    -99: "unknown",  # Pseudo stage
+    -98: "unknown",  # No answer
+    -97: "unknown",  # Don't know
+    1: "interaction",  # Transfer, change of mode, park car
+    2: "work",  # Work
+    3: "education",  # Education
+    4: "shop",  # Shopping
+    5: "other",  # Chores, use of public services
+    6: "work",  # Business activity
+    7: "work",  # Business trip
+    8: "leisure",  # Leisure
+    9: "other",  # Bring children
+    10: "other",  # Bring others (disabled, ...)
+    11: "home",  # Return home
+    12: "unknown",  # Other
+    13: "border",  # Going out of country
+}
+
+MZ_PURPOSE_CATEGORIES = c.PURPOSE_CATEGORIES
+
+# Microcensus: marital status (zivil)
+MZ_MARITAL_STATUS = {
+    1: c.MARITAL_STATUS_SINGLE,
+    2: c.MARITAL_STATUS_MARRIED,
+    3: c.MARITAL_STATUS_SEPARATE,
+    4: c.MARITAL_STATUS_SEPARATE,
+    5: c.MARITAL_STATUS_SINGLE,
+    6: c.MARITAL_STATUS_MARRIED,
+    7: c.MARITAL_STATUS_SEPARATE,
+}
+
+# STATPOP: marital status, this mapping comes from KM
+STATPOP_MARITAL_STATUS = {
+    1: c.MARITAL_STATUS_SINGLE,
+    2: c.MARITAL_STATUS_MARRIED,
+    3: c.MARITAL_STATUS_SEPARATE,
+    4: c.MARITAL_STATUS_SEPARATE,
+    5: c.MARITAL_STATUS_SINGLE,
+    6: c.MARITAL_STATUS_MARRIED,
+    7: c.MARITAL_STATUS_SEPARATE,
+    -9: c.MARITAL_STATUS_SINGLE,
+}
+
+# Structural survey: main mode to work (MAINMODETRANSPWORK)
+SE_MODE = {
+    -10: "unknown",
+    -9: "unknown",
+    -8: "unknown",
+    1: "walk",  # walking
+    2: "walk",  # skateboard
+    3: "bike",  # bike / elec. bike
+    4: "car",  # Mofa / Moped / light motor bike
+    5: "car",  # Car as driver or passenger
+    6: "car",  # company bus
+    7: "pt",  # Train
+    8: "pt",  # Tram / Metro
+    9: "pt",  # Bus
+    10: "other",  # Ship, cable car, ...
+}
+
+SE_MODE_CATEGORIES = c.MODE_CATEGORIES
+
+# Municipality typology (TYP)
+MUNICIPALITY_TYPE = {
+    1: "urban",
+    2: "urban",
+    3: "suburban",
+    4: "urban",
+    5: "suburban",
+    6: "rural",
+    7: "rural",
+    8: "rural",
+    9: "rural",
+}
+
+MUNICIPALITY_TYPE_CATEGORIES = c.MUNICIPALITY_TYPE_CATEGORIES
+
+# NOGA 2008: education types by the first three digits
+NOGA_EDUCATION_TYPE = {
+    "851": "kindergarten",
+    "852": "primary",
+    "853": "secondary",
+    "854": "tertiary",
+}
+
+NOGA_EDUCATION_TYPE_CATEGORIES = ["kindergarten", "primary", "secondary", "tertiary"]
+
+# NOGA 2008: offered activities by the first two digits
+NOGA_OFFERS = {
+    "85": "education",  # education
+    "90": "leisure",  # arts, entertainment, leisure
+    "56": "leisure",  # gastronomy
+    "47": "shop",  # retail
+}
+
+NOGA_OFFERS_CATEGORIES = ["education", "leisure", "shop"]
+
+
+def recode(values, codebook, categories=None):
+    """
+        Recodes `values` with the given code book in one pass.
+
+        If the labels of the code book are strings, a categorical is returned whose
+        categories are `categories` (or the labels in order of declaration). Otherwise
+        a float array is returned. Values that are not in the code book become NaN.
+    """
+    codes = np.array(list(codebook.keys()))
+    labels = list(codebook.values())
+
+    indices = pd.Index(codes).get_indexer(np.asarray(values))
+    f_missing = indices < 0
+
+    if isinstance(labels[0], str):
+        if categories is None:
+            categories = list(dict.fromkeys(labels))
+
+        label_codes = pd.Index(categories).get_indexer(labels)
+        assert np.all(label_codes >= 0)
+
+        result = label_codes[indices]
+        result[f_missing] = -1
+
+        return pd.Categorical.from_codes(result, categories=categories)
+
+    result = np.array(labels, dtype=np.float64)[indices]
+    result[f_missing] = np.nan
+
+    return result
+
+
+def recode_prefix(values, codebook, categories=None):
+    """
+        Recodes string `values` by their prefix, all keys of the code book must have
+        the same length (for instance the leading digits of a NOGA code).
+    """
+    lengths = set(len(code) for code in codebook.keys())
+    assert len(lengths) == 1
+
+    return recode(pd.Series(values).astype(str).str[:lengths.pop()].values, codebook, categories)
@@ -1,8 +1,5 @@
 import pyproj
 
-# TODO: Pandas is quite good at working with categorical data. Refactor everything to make use of that.
-# It will not only be more readable but will also bring a speedup!
-
 CH1903 = "epsg:21781"
 LV05 = CH1903
 CH1903_PLUS = "epsg:2056"
@@ -42,3 +39,38 @@ POPULATION_DENSITY_RADIUS = 2.5 * 1e3
 
 BASE_SCALING_YEAR = 2015
 BASE_PROJECTED_YEAR = 2018
+
+# Fixed category sets of the string-valued columns, see data.utils.enforce_categories
+MODE_CATEGORIES = ["car", "car_passenger", "pt", "bike", "walk", "other", "unknown"]
+MODE_DETAILED_CATEGORIES = MODE_CATEGORIES + ["plane", "taxi"]
+PURPOSE_CATEGORIES = ["home", "work", "education", "shop", "leisure", "other", "interaction", "border", "unknown"]
+ZONE_LEVEL_CATEGORIES = ["country", "municipality", "quarter", "nuts", "nuts_0", "nuts_1", "nuts_2", "nuts_3",
+                         "postal_code"]
+OVGK_CATEGORIES = ["A", "B", "C", "D", "None"]
+MUNICIPALITY_TYPE_CATEGORIES = ["rural", "suburban", "urban"]
+VEHICLE_TYPE_CATEGORIES = ["truck", "other"]
+
+CATEGORIES = {
+    "mode": MODE_CATEGORIES,
+    "commute_mode": MODE_CATEGORIES,
+    "following_mode": MODE_CATEGORIES,
+    "mode_detailed": MODE_DETAILED_CATEGORIES,
+    "purpose": PURPOSE_CATEGORIES,
+    "preceding_purpose": PURPOSE_CATEGORIES,
+    "following_purpose": PURPOSE_CATEGORIES,
+    "zone_level": ZONE_LEVEL_CATEGORIES,
+    "ovgk": OVGK_CATEGORIES,
+    "municipality_type": MUNICIPALITY_TYPE_CATEGORIES,
+    "vehicle_type": VEHICLE_TYPE_CATEGORIES,
+}
+
+# Compact dtypes of stage outputs, see data.utils.apply_dtype_policy. Ids and indices
+# are stored as int32 and times as int32 seconds (float32 if they contain NaN or
+# fractions). LV95 coordinates stay float64, float32 would only resolve 0.25m.
+DTYPE_POLICY = {
+    "person_id": "id", "household_id": "id", "mz_person_id": "id", "mz_head_id": "id",
+    "trip_id": "id", "trip_index": "id", "activity_index": "id", "destination_id": "id",
+    "zone_id": "id", "home_zone_id": "id",
+    "departure_time": "time", "arrival_time": "time", "travel_time": "time", "trip_duration": "time",
+    "start_time": "time", "end_time": "time", "duration": "time",
+}
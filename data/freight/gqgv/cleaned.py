@@ -44,8 +44,8 @@ def execute(context):
     # apply divisor to weight
     df["weight"] /= df["divisor"]
 
-    # rename vehicle types
-    df["vehicle_type"] = df["vehicle_type"].replace(VEHICLE_TYPES)
+    # rename vehicle types, unknown codes become "other"
+    df["vehicle_type"] = df["vehicle_type"].map(VEHICLE_TYPES).fillna("other")
 
     # There are some NUTS ids that do not exist in our NUTS data (maybe old ids)
     # for now, drop all trips where NUTS not in NUTS data
@@ -1,11 +1,15 @@
 import pandas as pd
 
+import data.cache
+
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 def execute(context):
     data_path = context.config("data_path")
-    df = pd.read_csv("%s/freight/gqgv/GQGV_2014/GQGV_2014_Mikrodaten.csv" % data_path, sep=";")
+    df = data.cache.read(context, "%s/freight/gqgv/GQGV_2014/GQGV_2014_Mikrodaten.csv" % data_path,
+                         lambda path: pd.read_csv(path, sep=";"))
 
     return df
 
@@ -94,8 +94,8 @@ def execute(context):
     # rename columns
     df_merge = df_merge.rename(RENAMES, axis=1)
 
-    # rename vehicle types
-    df_merge["vehicle_type"] = df_merge["vehicle_type"].replace(VEHICLE_TYPES)
+    # rename vehicle types, unknown codes become "other"
+    df_merge["vehicle_type"] = df_merge["vehicle_type"].map(VEHICLE_TYPES).fillna("other")
 
     # There are some NUTS ids that do not exist in our NUTS data (maybe old ids)
     # for now, drop all trips where NUTS not in NUTS data
@@ -1,14 +1,23 @@
 import pandas as pd
 
+import data.cache
+import data.utils
+
 def configure(context):
     context.config("data_path")
+    context.config("threads")
+    data.cache.configure(context)
 
 def execute(context):
     data_path = context.config("data_path")
 
-    df_transport = pd.read_csv("%s/freight/gte/GTE_2017/Donnees/transport.csv" % data_path, sep=";", low_memory=False)
-    df_journey = pd.read_csv("%s/freight/gte/GTE_2017/Donnees/journeych.csv" % data_path, sep=";", low_memory=False)
-    df_week = pd.read_csv("%s/freight/gte/GTE_2017/Donnees/week.csv" % data_path, sep=";", low_memory=False)
+    def read(path):
+        return pd.read_csv(path, sep=";", low_memory=False)
+
+    df_transport, df_journey, df_week = data.utils.prefetch(
+        context, lambda name: data.cache.read(context, "%s/freight/gte/GTE_2017/Donnees/%s" % (data_path, name), read),
+        ["transport.csv", "journeych.csv", "week.csv"]
+    )
 
     return df_transport, df_journey, df_week
 
@@ -1,23 +1,25 @@
 import numpy as np
 import pandas as pd
-import pyproj
 
+import data.cache
 import data.constants as c
 import data.spatial.cantons
-import data.spatial.municipalities
-import data.spatial.municipality_types
+import data.spatial.hierarchy
 import data.spatial.ovgk
+import data.spatial.projection
+import data.spatial.raster
 import data.spatial.utils
-import data.spatial.zones
 import data.utils
 import data.utils
 
 
 def configure(context):
     context.config("data_path")
-    context.stage("data.spatial.municipalities")
-    context.stage("data.spatial.zones")
-    context.stage("data.spatial.municipality_types")
+    context.config("threads")
+    data.cache.configure(context)
+    data.spatial.raster.configure(context)
+    data.spatial.projection.configure(context)
+    context.stage("data.spatial.hierarchy")
     context.stage("data.statpop.density")
     context.stage("data.spatial.ovgk")
 
@@ -25,8 +27,9 @@ def configure(context):
 def execute(context):
     data_path = context.config("data_path")
 
-    df_mz_households = pd.read_csv(
-        "%s/microcensus/haushalte.csv" % data_path, sep=",", encoding="latin1")
+    df_mz_households = data.cache.read(
+        context, "%s/microcensus/haushalte.csv" % data_path,
+        lambda path: pd.read_csv(path, sep=",", encoding="latin1"))
 
     # Simple attributes
     df_mz_households["home_structure"] = df_mz_households["W_STRUKTUR_AGG_2000"]
@@ -41,11 +44,8 @@ def execute(context):
     df_mz_households["income_class"] = np.maximum(-1, df_mz_households["income_class"])  # Make all "invalid" entries -1
 
     # Convert coordinates to LV95
-    coords = df_mz_households[["W_X_CH1903", "W_Y_CH1903"]].values
-    transformer = pyproj.Transformer.from_crs(c.CH1903, c.CH1903_PLUS)
-    x, y = transformer.transform(coords[:, 0], coords[:, 1])
-    df_mz_households.loc[:, "home_x"] = x
-    df_mz_households.loc[:, "home_y"] = y
+    df_mz_households = data.spatial.projection.transform(
+        context, df_mz_households, [(("W_X_CH1903", "W_Y_CH1903"), ("home_x", "home_y"))], c.CH1903, c.CH1903_PLUS)
 
     # Class variable for number of cars
     df_mz_households["number_of_cars_class"] = 0
@@ -68,32 +68,29 @@ def execute(context):
     df_mz_households["canton_id"] = df_mz_households["W_KANTON"]
     df_mz_households = data.spatial.cantons.impute_sp_region(df_mz_households)
 
-    # Impute spatial information
-    df_municipalities = context.stage("data.spatial.municipalities")[0]
-    df_zones = context.stage("data.spatial.zones")
-    df_municipality_types = context.stage("data.spatial.municipality_types")
+    # Impute spatial information (the home zone is given on the municipality level)
+    df_hierarchy = context.stage("data.spatial.hierarchy")
 
-    df_spatial = pd.DataFrame(df_mz_households[["person_id", "home_x", "home_y"]])
-    df_spatial = data.spatial.utils.to_gpd(context, df_spatial, "home_x", "home_y")
-    df_spatial = data.spatial.utils.impute(context, df_spatial, df_municipalities, "person_id", "municipality_id")
-    df_spatial = data.spatial.zones.impute(df_spatial, df_zones)
-    df_spatial = data.spatial.municipality_types.impute(df_spatial, df_municipality_types)
+    # All spatial imputations run once per unique home location
+    x, y, inverse = data.spatial.utils.deduplicate(df_mz_households["home_x"].values, df_mz_households["home_y"].values)
+    df_locations = pd.DataFrame({"location_index": np.arange(len(x)), "x": x, "y": y})
 
-    df_mz_households = pd.merge(
-        df_mz_households, df_spatial[["person_id", "zone_id", "municipality_type"]],
-        on="person_id"
-    )
+    indices = data.spatial.hierarchy.locate(context, df_hierarchy, x, y)[inverse]
+    df_spatial = data.spatial.hierarchy.get(df_hierarchy, indices, ["municipality_zone_id", "municipality_type"])
 
-    df_mz_households["home_zone_id"] = df_mz_households["zone_id"]
+    df_mz_households = df_mz_households.reset_index(drop=True)
+    df_mz_households["home_zone_id"] = df_spatial["municipality_zone_id"].values
+    df_mz_households["municipality_type"] = df_spatial["municipality_type"].values
 
     # Impute density
-    data.statpop.density.impute(context.stage("data.statpop.density"), df_mz_households, "home_x", "home_y")
+    data.statpop.density.impute(context.stage("data.statpop.density"), df_locations, "x", "y")
+    df_mz_households["population_density"] = df_locations["population_density"].values[inverse]
 
     # Impute OV Guteklasse
     print("Imputing ÖV Güteklasse ...")
     df_ovgk = context.stage("data.spatial.ovgk")
-    df_spatial = data.spatial.ovgk.impute(context, df_ovgk, df_spatial, ["person_id"])
-    df_mz_households = pd.merge(df_mz_households, df_spatial[["person_id", "ovgk"]], on=["person_id"], how="left")
+    df_spatial = data.spatial.ovgk.impute(context, df_ovgk, df_locations, ["location_index"], x="x", y="y")
+    df_mz_households["ovgk"] = df_spatial["ovgk"].values[inverse]
 
     # Wrap it up
     return df_mz_households[[
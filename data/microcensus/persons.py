@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+import data.cache
+import data.codebook
 import data.constants as c
 import data.microcensus.income
 import data.utils
@@ -8,15 +10,17 @@ import data.utils
 
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
     context.stage("data.microcensus.households")
     context.stage("data.microcensus.trips")
 
 def execute(context):
     data_path = context.config("data_path")
 
-    df_mz_persons = pd.read_csv(
-        "%s/microcensus/zielpersonen.csv" % data_path,
-        sep = ",", encoding = "latin1", parse_dates = ["USTag"]
+    df_mz_persons = data.cache.read(
+        context, "%s/microcensus/zielpersonen.csv" % data_path,
+        lambda path: pd.read_csv(path, sep = ",", encoding = "latin1", parse_dates = ["USTag"]),
+        variant = "parse_dates=USTag"
     )
 
     df_mz_persons["age"] = df_mz_persons["alter"]
@@ -26,13 +30,7 @@ def execute(context):
     df_mz_persons["date"] = df_mz_persons["USTag"]
 
     # Marital status
-    df_mz_persons.loc[df_mz_persons["zivil"] == 1, "marital_status"] = c.MARITAL_STATUS_SINGLE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 2, "marital_status"] = c.MARITAL_STATUS_MARRIED
-    df_mz_persons.loc[df_mz_persons["zivil"] == 3, "marital_status"] = c.MARITAL_STATUS_SEPARATE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 4, "marital_status"] = c.MARITAL_STATUS_SEPARATE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 5, "marital_status"] = c.MARITAL_STATUS_SINGLE
-    df_mz_persons.loc[df_mz_persons["zivil"] == 6, "marital_status"] = c.MARITAL_STATUS_MARRIED
-    df_mz_persons.loc[df_mz_persons["zivil"] == 7, "marital_status"] = c.MARITAL_STATUS_SEPARATE
+    df_mz_persons["marital_status"] = data.codebook.recode(df_mz_persons["zivil"], data.codebook.MZ_MARITAL_STATUS)
 
     # Driving license
     df_mz_persons["driving_license"] = df_mz_persons["f20400a"] == 1
@@ -92,8 +90,8 @@ def execute(context):
     df_mz_persons.loc[df_mz_persons["f41301"] == 3, "parking_education"] = "no"
     df_mz_persons["parking_education"] = df_mz_persons["parking_education"].astype("category")
 
-    df_mz_persons["parking_cost_work"] = np.maximum(0, df_mz_persons["f41400"].astype(np.float))
-    df_mz_persons["parking_cost_education"] = np.maximum(0, df_mz_persons["f41401"].astype(np.float))
+    df_mz_persons["parking_cost_work"] = np.maximum(0, df_mz_persons["f41400"].astype(float))
+    df_mz_persons["parking_cost_education"] = np.maximum(0, df_mz_persons["f41401"].astype(float))
 
     # Wrap up
     df_mz_persons = df_mz_persons[[
@@ -0,0 +1,138 @@
+"""
+Reads the stages (etappen) of the microcensus once and provides the per-stage data
+as well as aggregates per trip, which are used by the trips and transit stages.
+"""
+
+import numpy as np
+import pandas as pd
+
+import data.cache
+import data.utils
+
+FIELDS = {
+    "HHNR": np.int64,
+    "WEGNR": np.float64,
+    "ETNR": np.float64,
+    "f51300": np.float64,
+    "f51100": np.float64,
+    "f51400": np.float64,
+    "f51330": np.float64,
+    "rdist": np.float64,
+    "ldist": np.float64,
+}
+
+RENAMES = {
+    "HHNR": "person_id",
+    "WEGNR": "trip_id",
+    "ETNR": "stage_id",
+    "f51300": "mode_code",
+    "f51330": "parking_cost",
+}
+
+
+def configure(context):
+    context.config("data_path")
+    data.cache.configure(context)
+
+
+def execute(context):
+    data_path = context.config("data_path")
+
+    def read(path):
+        with open(path, "rb") as f:
+            return data.utils.read_csv(context, f, FIELDS, RENAMES, sep=",")
+
+    df_stages = data.cache.read(context, "%s/microcensus/etappen.csv" % data_path, read,
+                                variant=(FIELDS, RENAMES))
+
+    # Cleaning, the small integer fields may be missing and are only cast afterwards
+    f_missing = df_stages["trip_id"].isna()
+    print("Removing %d stages without trip" % np.count_nonzero(f_missing))
+    df_stages = df_stages[~f_missing].copy()
+
+    df_stages["trip_id"] = df_stages["trip_id"].astype(np.int16)
+    df_stages["mode_code"] = df_stages["mode_code"].fillna(-1).astype(np.int16)
+
+    df_stages["departure_time"] = df_stages["f51100"] * 60.0
+    df_stages["arrival_time"] = df_stages["f51400"] * 60.0
+    df_stages["travel_time"] = df_stages["arrival_time"] - df_stages["departure_time"]
+    df_stages["parking_cost"] = np.maximum(0, df_stages["parking_cost"])
+
+    df_stages["mode"] = "other"
+    df_stages.loc[df_stages["mode_code"] == 1, "mode"] = "walk"
+    df_stages.loc[df_stages["mode_code"] == 9, "mode"] = "rail"
+    df_stages.loc[df_stages["mode_code"] == 10, "mode"] = "bus"
+    df_stages.loc[df_stages["mode_code"] == 11, "mode"] = "bus"
+    df_stages.loc[df_stages["mode_code"] == 12, "mode"] = "tram"
+
+    df_stages["is_car_passenger"] = df_stages["mode_code"] == 8
+
+    df_stages["routed_distance"] = df_stages["rdist"] * 1000.0
+    df_stages["euclidean_distance"] = df_stages["ldist"] * 1000.0
+
+    # Attention! Euclidean distance may be zero if there is no geo data in MZ.
+
+    # Number of stages and consecutive ids
+    grouped = df_stages.groupby(["person_id", "trip_id"], sort=False)
+    df_stages["number_of_stages"] = grouped["stage_id"].transform("size")
+    df_stages["stage_id"] = grouped.cumcount() + 1
+
+    # Flags
+    df_stages["is_vehicular"] = df_stages["mode"].isin(["rail", "bus", "tram"])
+    df_stages["is_first_stage"] = df_stages["stage_id"] == 1
+    df_stages["is_last_stage"] = df_stages["stage_id"] == df_stages["number_of_stages"]
+
+    df_stages = df_stages[[
+        "person_id", "trip_id", "stage_id", "mode_code",
+        "departure_time", "arrival_time", "travel_time", "mode",
+        "is_vehicular", "number_of_stages", "is_first_stage", "is_last_stage",
+        "routed_distance", "euclidean_distance", "parking_cost", "is_car_passenger"
+    ]]
+
+    # Construct times
+    f_vehicle = df_stages["is_vehicular"]
+    f_access_egress = ~f_vehicle & (df_stages["is_first_stage"] | df_stages["is_last_stage"])
+    f_transfer = ~f_vehicle & ~(df_stages["is_first_stage"] | df_stages["is_last_stage"])
+
+    df_aggregated = df_stages[["person_id", "trip_id", "number_of_stages", "parking_cost", "is_car_passenger"]].copy()
+
+    for prefix, f in [("access_egress", f_access_egress), ("transfer", f_transfer), ("in_vehicle", f_vehicle)]:
+        df_aggregated["%s_time" % prefix] = df_stages["travel_time"].where(f)
+        df_aggregated["%s_routed_distance" % prefix] = df_stages["routed_distance"].where(f)
+        df_aggregated["%s_euclidean_distance" % prefix] = df_stages["euclidean_distance"].where(f)
+
+    df_aggregated["line_switches"] = df_stages["is_vehicular"]
+
+    # Aggregate trips
+    df_aggregated = df_aggregated.groupby(["person_id", "trip_id"], sort=False).aggregate({
+        "number_of_stages": "first",
+        "parking_cost": "sum",
+        "is_car_passenger": "any",
+        "access_egress_time": "sum",
+        "transfer_time": "sum",
+        "in_vehicle_time": "sum",
+        "access_egress_routed_distance": "sum",
+        "transfer_routed_distance": "sum",
+        "in_vehicle_routed_distance": "sum",
+        "access_egress_euclidean_distance": "sum",
+        "transfer_euclidean_distance": "sum",
+        "in_vehicle_euclidean_distance": "sum",
+        "line_switches": "sum"
+    }).reset_index()
+
+    # Construct first waiting time
+    df_arrival = df_stages[(df_stages["stage_id"] == 1) & ~df_stages["is_vehicular"]]
+    df_arrival = df_arrival[["person_id", "trip_id", "arrival_time"]]
+
+    df_departure = df_stages[(df_stages["stage_id"] == 2) & df_stages["is_vehicular"]]
+    df_departure = df_departure[["person_id", "trip_id", "departure_time"]]
+
+    df_first = pd.merge(df_arrival, df_departure, how="inner", on=["person_id", "trip_id"])
+    df_first["first_waiting_time"] = df_first["departure_time"] - df_first["arrival_time"]
+
+    df_aggregated = pd.merge(
+        df_aggregated, df_first[["person_id", "trip_id", "first_waiting_time"]],
+        how="left", on=["person_id", "trip_id"]
+    )
+
+    return df_stages, df_aggregated
@@ -1,20 +1,20 @@
-import geopandas as gpd
+import data.cache
+import data.spatial.utils
 
 
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 
 def execute(context):
     # Load data
     data_path = context.config("data_path")
 
-    df = gpd.read_file(
-        "%s/municipality_borders/gd-b-00.03-875-gg18/ggg_2018-LV95/shp/g1k18.shp" % data_path,
+    df = data.spatial.utils.read_shapefile(
+        context, "%s/municipality_borders/gd-b-00.03-875-gg18/ggg_2018-LV95/shp/g1k18.shp" % data_path,
         encoding="latin1"
-    ).to_crs("epsg:2056")
-
-    df.crs = "epsg:2056"
+    )
 
     df = df.rename({"KTNR": "canton_id", "KTNAME": "canton_name"}, axis=1)
     df = df[["canton_id", "canton_name", "geometry"]]
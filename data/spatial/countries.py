@@ -1,15 +1,19 @@
 import numpy as np
 import pandas as pd
 
+import data.cache
+import data.utils
+
 
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 def execute(context):
     data_path = context.config("data_path")
 
-    df = pd.read_excel(
-        "%s/country_codes_2018.xlsx" % data_path
+    df = data.cache.read(
+        context, "%s/country_codes_2018.xlsx" % data_path, pd.read_excel
     )
 
     df["country_id"] = df["Ländercode BFS\nCode des pays OFS\nCodice del paese UST"]
@@ -20,16 +24,12 @@ def execute(context):
 
 def update_country_ids(df, df_countries, remove_unknown = False):
     assert("country_id" in df.columns)
+    mapping = data.utils.get_mapping(df_countries, "country_id", "country_id")
 
     df["deprecated_country_id"] = df["country_id"]
     del df["country_id"]
 
-    df_join = pd.merge(
-        df[["deprecated_country_id"]], df_countries,
-        left_on = "deprecated_country_id", right_on = "country_id", how = "left"
-    )
-
-    df.loc[:, "country_id"] = df_join.loc[:, "country_id"].values
+    df["country_id"] = mapping(df["deprecated_country_id"].values)
 
     if remove_unknown:
         return df[~np.isnan(df["country_id"])]
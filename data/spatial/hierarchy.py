@@ -0,0 +1,154 @@
+"""
+Precomputed hierarchy of the Swiss zoning system.
+
+Quarters lie within municipalities, and cantons, NUTS regions and municipality
+types are determined by the municipality. This stage computes these relations once
+and provides one row per quarter and one row per municipality with all attributes:
+
+    quarter_id -> municipality_id -> canton_id -> nuts_id_level_* -> municipality_type -> zone_id
+
+The quarter rows come first, such that a single point-in-polygon lookup in this
+layer (see `locate`) yields the finest unit of a point. Rows for known ids are found
+by dense array lookups (see `join`).
+"""
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+import data.spatial.raster
+import data.spatial.utils
+import data.spatial.zones
+import data.utils
+
+COLUMNS = ["quarter_id", "municipality_id", "canton_id", "municipality_type", "zone_id", "zone_level",
+           "municipality_zone_id"]
+
+
+def configure(context):
+    context.config("threads")
+    data.spatial.raster.configure(context)
+    context.stage("data.spatial.municipalities")
+    context.stage("data.spatial.quarters")
+    context.stage("data.spatial.cantons")
+    context.stage("data.spatial.nuts")
+    context.stage("data.spatial.municipality_types")
+    context.stage("data.spatial.zones")
+
+
+def impute_by_point(context, df, df_zones, id_field, zone_id_field):
+    """ Finds the zone for every row in `df` by a representative point of its geometry. """
+    points = df["geometry"].representative_point()
+
+    df_points = gpd.GeoDataFrame(pd.DataFrame({id_field: df[id_field].values}), geometry=points.values, crs=df.crs)
+    df_points = data.spatial.utils.impute(context, df_points, df_zones, id_field, zone_id_field)
+
+    return df_points[zone_id_field].values
+
+
+def execute(context):
+    df_municipalities = context.stage("data.spatial.municipalities")[0]
+    df_quarters = context.stage("data.spatial.quarters")
+    df_cantons = context.stage("data.spatial.cantons")
+    df_nuts = context.stage("data.spatial.nuts")
+    df_municipality_types = context.stage("data.spatial.municipality_types")
+    df_zones = context.stage("data.spatial.zones")
+
+    # Attributes that are determined by the municipality
+    df_municipalities = df_municipalities[["municipality_id", "geometry"]].reset_index(drop=True)
+
+    df_municipalities["canton_id"] = impute_by_point(
+        context, df_municipalities, df_cantons, "municipality_id", "canton_id")
+
+    df_nuts = df_nuts[df_nuts["nuts_id"].str.startswith("CH")]
+    nuts_columns = []
+
+    for level in sorted(df_nuts["nuts_level"].unique()):
+        column = "nuts_id_level_%d" % level
+
+        df_municipalities[column] = impute_by_point(
+            context, df_municipalities, df_nuts[df_nuts["nuts_level"] == level], "municipality_id", "nuts_id")
+
+        nuts_columns.append(column)
+
+    df_municipalities = pd.merge(df_municipalities, df_municipality_types[[
+        "municipality_id", "municipality_type"]], on="municipality_id", how="left")
+
+    # Quarters lie within one municipality
+    df_quarters = df_quarters[["quarter_id", "geometry"]].reset_index(drop=True)
+
+    df_quarters["municipality_id"] = impute_by_point(
+        context, df_quarters, df_municipalities, "quarter_id", "municipality_id")
+
+    df_quarters = pd.merge(df_quarters, pd.DataFrame(df_municipalities.drop(columns="geometry")),
+                           on="municipality_id", how="left")
+
+    df_municipalities["quarter_id"] = np.nan
+    df_hierarchy = pd.concat([df_quarters, df_municipalities], sort=False).reset_index(drop=True)
+
+    # Zones of the finest unit and of the municipality
+    resolver = data.spatial.zones.get_resolver(df_zones)
+    df_hierarchy["zone_id"] = resolver.resolve("quarter", df_hierarchy["quarter_id"].values)
+    df_hierarchy["municipality_zone_id"] = resolver.resolve("municipality", df_hierarchy["municipality_id"].values)
+
+    f_quarter = df_hierarchy["zone_id"] >= 0
+    df_hierarchy["zone_level"] = np.where(f_quarter, "quarter", "municipality")
+    df_hierarchy.loc[~f_quarter, "zone_id"] = df_hierarchy.loc[~f_quarter, "municipality_zone_id"]
+
+    assert np.all(df_hierarchy["municipality_zone_id"] >= 0)
+
+    df_hierarchy = gpd.GeoDataFrame(df_hierarchy[COLUMNS + nuts_columns + ["geometry"]], crs=df_municipalities.crs)
+    return data.utils.enforce_categories(df_hierarchy)
+
+
+def locate(context, df_hierarchy, x, y, fix_by_distance=True, point_type=""):
+    """
+        Returns the hierarchy row of the finest unit that contains each of the given
+        LV95 coordinates. Points outside of all units are assigned to the municipality
+        with the closest centroid if `fix_by_distance` is set, otherwise they obtain -1.
+    """
+    indices = data.spatial.utils.lookup(context, df_hierarchy, x, y, zone_type="hierarchy", point_type=point_type)
+    invalid_mask = indices < 0
+
+    if fix_by_distance and np.any(invalid_mask):
+        print("  Fixing %d points by centroid distance join..." % np.count_nonzero(invalid_mask))
+        municipality_indices = np.where(np.isnan(df_hierarchy["quarter_id"].values))[0]
+
+        centroids = df_hierarchy["geometry"].iloc[municipality_indices].centroid
+        kd_tree = KDTree(np.vstack([centroids.x, centroids.y]).T)
+
+        coordinates = np.vstack([np.asarray(x)[invalid_mask], np.asarray(y)[invalid_mask]]).T
+        indices[invalid_mask] = municipality_indices[kd_tree.query(coordinates, return_distance=False).flatten()]
+
+    return indices
+
+
+def join(df_hierarchy, municipality_ids, quarter_ids=None):
+    """
+        Returns the hierarchy row for known ids. The quarter is used if it is known,
+        otherwise the municipality. Unknown ids obtain -1.
+    """
+    f_municipality = np.isnan(df_hierarchy["quarter_id"].values)
+    indices = np.where(f_municipality)[0]
+
+    positions = data.utils.DenseLookup(df_hierarchy["municipality_id"].values[f_municipality])(municipality_ids)
+    result = np.where(positions >= 0, indices[np.maximum(positions, 0)], -1)
+
+    if quarter_ids is not None:
+        indices = np.where(~f_municipality)[0]
+
+        positions = data.utils.DenseLookup(df_hierarchy["quarter_id"].values[~f_municipality])(quarter_ids)
+        result = np.where(positions >= 0, indices[np.maximum(positions, 0)], result)
+
+    return result
+
+
+def get(df_hierarchy, indices, columns):
+    """ Returns the requested attributes for the given hierarchy rows, missing rows obtain NaN. """
+    df = pd.DataFrame(df_hierarchy[columns]).iloc[np.maximum(indices, 0)].reset_index(drop=True)
+
+    if np.any(indices < 0):
+        df = df.where(np.broadcast_to((indices >= 0)[:, np.newaxis], df.shape))
+
+    return df
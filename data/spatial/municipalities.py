@@ -3,9 +3,15 @@ import numpy as np
 import pandas as pd
 from sklearn.neighbors import KDTree
 
+import data.cache
+import data.spatial.utils
+import data.utils
+
 
 def configure(context):
     context.config("data_path")
+    context.config("threads")
+    data.cache.configure(context)
 
 
 REFERENCE_YEAR = 2018
@@ -30,15 +36,13 @@ def execute(context):
     df_all = []
     all_ids = set()
 
-    # Load all the shape files, only add the municipalities that haven't been found before
-    for year, shapefile, id_field, name_field in context.progress(SHAPEFILES, label="Reading municipality shape files"):
-        df = gpd.read_file(
-            "%s/%s" % (data_path, shapefile),
-            encoding="latin1"
-        ).to_crs("epsg:2056")
-
-        df.crs = "epsg:2056"
+    data_frames = data.utils.prefetch(context, lambda item: data.spatial.utils.read_shapefile(
+        context, "%s/%s" % (data_path, item[1]), encoding="latin1"
+    ), SHAPEFILES)
 
+    # Load all the shape files, only add the municipalities that haven't been found before
+    for (year, shapefile, id_field, name_field), df in context.progress(
+            zip(SHAPEFILES, data_frames), label="Reading municipality shape files", total=len(SHAPEFILES)):
         df.loc[:, "municipality_id"] = df[id_field]
         df.loc[:, "municipality_name"] = df[name_field]
         df.loc[:, "year"] = year
@@ -99,16 +103,12 @@ def execute(context):
 
 def update_municipality_ids(df, df_mapping, remove_unknown=False):
     assert ("municipality_id" in df.columns)
+    mapping = data.utils.get_mapping(df_mapping, "deprecated_municipality_id", "municipality_id")
 
     df["deprecated_municipality_id"] = df["municipality_id"]
     del df["municipality_id"]
 
-    df_join = pd.merge(
-        df[["deprecated_municipality_id"]], df_mapping,
-        on="deprecated_municipality_id", how="left"
-    )
-
-    df.loc[:, "municipality_id"] = df_join.loc[:, "municipality_id"].values
+    df["municipality_id"] = mapping(df["deprecated_municipality_id"].values)
 
     if remove_unknown:
         return df[~np.isnan(df["municipality_id"])]
@@ -3,9 +3,14 @@ import numpy as np
 import pandas as pd
 from sklearn.neighbors import KDTree
 
+import data.cache
+import data.codebook
+import data.utils
+
 
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
     context.stage("data.spatial.municipalities")
 
 
@@ -13,26 +18,18 @@ def execute(context):
     # Load data
     data_path = context.config("data_path")
 
-    df_types = pd.read_excel("%s/spatial_structure_2018.xlsx" % data_path,
-                             names=["municipality_id", "TYP"],
-                             usecols=[0, 21],
-                             skiprows=6,
-                             nrows=2229,
-                             )
+    df_types = data.cache.read(context, "%s/spatial_structure_2018.xlsx" % data_path,
+                               lambda path: pd.read_excel(path,
+                                                          names=["municipality_id", "TYP"],
+                                                          usecols=[0, 21],
+                                                          skiprows=6,
+                                                          nrows=2229,
+                                                          ), variant="usecols=0,21;skiprows=6;nrows=2229")
     df_municipalities = context.stage("data.spatial.municipalities")[0]
 
     # Rewrite classification
-    df_types.loc[df_types["TYP"] == 1, "municipality_type"] = "urban"
-    df_types.loc[df_types["TYP"] == 2, "municipality_type"] = "urban"
-    df_types.loc[df_types["TYP"] == 3, "municipality_type"] = "suburban"
-    df_types.loc[df_types["TYP"] == 4, "municipality_type"] = "urban"
-    df_types.loc[df_types["TYP"] == 5, "municipality_type"] = "suburban"
-    df_types.loc[df_types["TYP"] == 6, "municipality_type"] = "rural"
-    df_types.loc[df_types["TYP"] == 7, "municipality_type"] = "rural"
-    df_types.loc[df_types["TYP"] == 8, "municipality_type"] = "rural"
-    df_types.loc[df_types["TYP"] == 9, "municipality_type"] = "rural"
-
-    df_types["municipality_type"] = df_types["municipality_type"].astype("category")
+    df_types["municipality_type"] = data.codebook.recode(
+        df_types["TYP"], data.codebook.MUNICIPALITY_TYPE, data.codebook.MUNICIPALITY_TYPE_CATEGORIES)
     df_types = df_types[["municipality_id", "municipality_type"]]
 
     # Match by municipality_id
@@ -64,7 +61,7 @@ def execute(context):
     assert (set(np.unique(df_mapping["municipality_id"])) == set(np.unique(df_municipalities["municipality_id"])))
 
     df_mapping = pd.DataFrame(df_mapping[["municipality_id", "municipality_type", "imputed_municipality_type"]])
-    df_mapping["municipality_type"] = df_mapping["municipality_type"].astype("category")
+    df_mapping = data.utils.enforce_categories(df_mapping)
 
     return df_mapping
 
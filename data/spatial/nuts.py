@@ -1,10 +1,22 @@
+import hashlib
+
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 
+import data.cache
+import data.spatial.utils
+import data.utils
+
 
 def configure(context):
     context.config("data_path")
+    context.config("threads")
+    data.cache.configure(context)
+
+    # Buffer around Switzerland (in meters) outside of which foreign zones are reduced to their centroids
+    if context.config("nuts_buffer", default=None) is not None:
+        context.stage("data.spatial.swiss_border")
 
 
 SHAPEFILES = [
@@ -21,21 +33,74 @@ SHAPEFILES = [
 ]
 
 
+def get_buffer(context):
+    """
+        Returns the buffer around Switzerland in LV95 and its bounding box in WGS84.
+    """
+    df_border = context.stage("data.spatial.swiss_border")
+    buffer = df_border.unary_union.buffer(context.config("nuts_buffer"))
+
+    return buffer, gpd.GeoSeries([buffer], crs="epsg:2056").to_crs("epsg:4326").total_bounds
+
+
+def clip(df, id_field, buffer, bounds):
+    """
+        Projects the zones of a NUTS layer given in WGS84 to LV95 and reduces foreign
+        zones outside of the buffer to points. Swiss zones and zones intersecting the
+        buffer are projected with their full geometry. Only zones within the bounds of
+        the buffer are projected to be tested against it, all other zones are reduced
+        to a representative point in WGS84 which is projected on its own.
+    """
+    df_bounds = df.geometry.bounds
+
+    f = (df_bounds["maxx"] >= bounds[0]) & (df_bounds["minx"] <= bounds[2])
+    f &= (df_bounds["maxy"] >= bounds[1]) & (df_bounds["miny"] <= bounds[3])
+    f |= df[id_field].str.startswith("CH")
+
+    df_candidates = df[f].to_crs("epsg:2056")
+    f_inside = df_candidates[id_field].str.startswith("CH") | df_candidates.intersects(buffer)
+
+    # Candidates outside of the buffer have been projected anyway
+    df_near = df_candidates[~f_inside].copy()
+    df_near.geometry = df_near.geometry.centroid
+
+    df_far = df[~f].copy()
+    df_far.geometry = df_far.geometry.representative_point()
+    df_far = df_far.to_crs("epsg:2056")
+
+    return pd.concat([df_candidates[f_inside], df_near, df_far]).sort_index()
+
+
 def execute(context):
     data_path = context.config("data_path")
+    buffer = None
+
+    if context.config("nuts_buffer") is not None:
+        buffer, bounds = get_buffer(context)
 
     df_all = []
     all_ids = set()
 
-    # Load all the shape files, only add the NUTS zones that haven't been found before
-    for year, shapefile, id_field, name_field, level_field in context.progress(SHAPEFILES,
-                                                                               label="Reading NUTS shape files"):
-        df = gpd.read_file(
-            "%s/%s" % (data_path, shapefile),
-            encoding="utf-8"
+    def read_file(item):
+        year, shapefile, id_field, name_field, level_field = item
+
+        if buffer is None:
+            return data.spatial.utils.read_shapefile(
+                context, "%s/%s" % (data_path, shapefile), encoding="utf-8", crs="epsg:4326"
+            )
+
+        # The clipped layer is cached for this buffer
+        return data.spatial.utils.read_shapefile(
+            context, "%s/%s" % (data_path, shapefile), encoding="utf-8", crs="epsg:4326", target_crs=None,
+            transform=lambda df: clip(df, id_field, buffer, bounds),
+            transform_variant=(id_field, hashlib.sha1(buffer.wkb).hexdigest(), tuple(bounds))
         )
-        df.crs = "epsg:4326"
-        df = df.to_crs("epsg:2056")
+
+    data_frames = data.utils.prefetch(context, read_file, SHAPEFILES)
+
+    # Load all the shape files, only add the NUTS zones that haven't been found before
+    for (year, shapefile, id_field, name_field, level_field), df in context.progress(
+            zip(SHAPEFILES, data_frames), label="Reading NUTS shape files", total=len(SHAPEFILES)):
 
         df.loc[:, "nuts_id"] = df[id_field]
         df.loc[:, "nuts_name"] = df[name_field]
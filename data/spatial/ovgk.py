@@ -1,31 +1,41 @@
-import geopandas as gpd
 import numpy as np
-import pandas as pd
+
+import data.cache
+import data.spatial.utils
+import data.utils
 
 
 def configure(context):
     context.config("data_path")
     context.config("threads")
+    data.cache.configure(context)
 
 
 def execute(context):
     input_path = "%s/ov_guteklasse/LV95/Oev_Gueteklassen_ARE.shp" % context.config("data_path")
-    df = gpd.read_file(input_path)
-    df.crs = "epsg:2056"
+    df = data.spatial.utils.read_shapefile(context, input_path, crs="epsg:2056")
     df = df[["KLASSE", "geometry"]].rename({"KLASSE": "ovgk"}, axis=1)
-    return df
+    return data.utils.enforce_categories(df)
+
 
+def impute(context, df_ovgk, df, on, x=None, y=None):
+    """
+        Imputes the ÖV Güteklasse for the points in `df`, given by the coordinate columns
+        `x` and `y` or otherwise by the point geometries. The lookup runs once per unique
+        location.
+    """
+    if x is None:
+        x, y = df["geometry"].x.values, df["geometry"].y.values
+    else:
+        x, y = df[x].values, df[y].values
 
-def impute(context, df_ovgk, df, on):
-    indices = np.array_split(np.arange(len(df)), 100)
-    df_join = []
+    x, y, inverse = data.spatial.utils.deduplicate(x, y)
+    indices = data.spatial.utils.lookup(context, df_ovgk, x, y, zone_type="ÖV Güteklasse")[inverse]
 
-    for chunk in context.progress(indices, label="Imputing ÖV Güteklasse"):
-        df_join.append(gpd.sjoin(df.iloc[chunk], df_ovgk, op="within")[on + ["ovgk"]])
+    # Missing classes stay missing, points outside of all zones obtain "None"
+    values = np.asarray(df_ovgk["ovgk"].astype(object).values, dtype=object)
 
-    df_join = pd.concat(df_join)
-    df_join = pd.merge(df, df_join, on=on, how="left")
-    df_join.loc[df_join["ovgk"].isna(), "ovgk"] = "None"
-    df_join["ovgk"] = df_join["ovgk"].astype("category")
+    df_join = df[on].reset_index(drop=True)
+    df_join["ovgk"] = np.where(indices >= 0, values[np.maximum(indices, 0)], "None")
 
-    return df_join[on + ["ovgk"]]
+    return data.utils.enforce_categories(df_join)
@@ -0,0 +1,58 @@
+"""
+Coordinate transformation service.
+
+Transformers are created once per pair of coordinate reference systems and several
+coordinate column pairs of a data frame are transformed in one batched call. Missing
+(NaN) coordinates stay missing. For CH1903 (LV03) to CH1903+ (LV95) the official
+approximation of adding 2 000 000 m / 1 000 000 m can be used instead by setting
+the option `fast_projection`. It deviates by up to about 1.5 m from the exact
+transformation.
+"""
+
+import functools
+
+import numpy as np
+import pyproj
+
+import data.constants as c
+
+
+def configure(context):
+    context.config("fast_projection", default=False)
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(source, target):
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+
+def transform_coordinates(x, y, source=c.CH1903, target=c.LV95, fast=False):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+    result_x, result_y = np.full(x.shape, np.nan), np.full(y.shape, np.nan)
+    f = np.isfinite(x) & np.isfinite(y)
+
+    if fast:
+        assert (source, target) == (c.CH1903, c.LV95)
+        result_x[f], result_y[f] = x[f] + 2e6, y[f] + 1e6
+    else:
+        result_x[f], result_y[f] = get_transformer(source, target).transform(x[f], y[f])
+
+    return result_x, result_y
+
+
+def transform(context, df, columns, source=c.CH1903, target=c.LV95):
+    """
+        Transforms the coordinate columns of `df` in one call. `columns` is a list of
+        ((source_x, source_y), (target_x, target_y)) column names.
+    """
+    x = np.concatenate([df[source_x].values for (source_x, _), _ in columns])
+    y = np.concatenate([df[source_y].values for (_, source_y), _ in columns])
+
+    x, y = transform_coordinates(x, y, source, target, context.config("fast_projection"))
+
+    for index, (_, (target_x, target_y)) in enumerate(columns):
+        df[target_x] = x[index * len(df):(index + 1) * len(df)]
+        df[target_y] = y[index * len(df):(index + 1) * len(df)]
+
+    return df
@@ -0,0 +1,272 @@
+"""
+Optional raster index for zone layers.
+
+A zone layer is rasterized once at the resolution given by the config option
+`spatial_raster_resolution` (in meters, e.g. 10 to 25). Every LV95 cell holds the
+positional index of the zone polygon that contains the cell center, or -1. Cells
+that may be crossed by a polygon boundary are flagged, only points in these cells
+need an exact point-in-polygon test afterwards, all other points are resolved by
+array indexing. If `raw_cache_path` is set, rasters are stored there keyed by a hash
+of the geometries, such that they are only built once.
+
+The raster is stored in tiles of TILE_SIZE x TILE_SIZE cells. Tiles with a single
+value (inside one zone, outside all zones) are stored as that value, only tiles with
+several values are stored cell by cell. The raster is built in strips of one tile
+row, so the full extent is never allocated densely. The memory cost is 6 bytes per
+tile (8 bytes for more than 32767 zones) plus 512 bytes (1024 bytes) per tile with
+several values. For the Swiss municipalities at 10m, the extent of about 350km x
+220km has about 3M tiles (20MB) and a few 100k tiles along the boundaries (100MB to
+200MB), where a dense array of the extent with labels and flags takes about 2.3GB.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import uuid
+
+import numpy as np
+from matplotlib.path import Path
+
+import data.cache
+
+RASTER_VERSION = 2
+
+TILE_SIZE = 16
+
+# Returned by RasterIndex.lookup for points that need an exact test
+BOUNDARY = -2
+
+
+def configure(context):
+    context.config("spatial_raster_resolution", default=None)
+    data.cache.configure(context)
+
+
+def get_parts(geometry):
+    """ Returns the polygons of a (multi) polygon. """
+    if geometry is None or geometry.is_empty:
+        return []
+
+    if hasattr(geometry, "geoms"):
+        return [part for part in geometry.geoms if hasattr(part, "exterior")]
+
+    return [geometry]
+
+
+def get_rings(polygon):
+    return [np.asarray(polygon.exterior.coords)] + [np.asarray(ring.coords) for ring in polygon.interiors]
+
+
+def get_boundary_points(starts, deltas, spacing):
+    """ Samples points along ring segments such that consecutive points are at most `spacing` apart. """
+    counts = np.ceil(np.sqrt(np.sum(deltas ** 2, axis=1)) / spacing).astype(int) + 1
+
+    segments = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    fractions = offsets / np.repeat(np.maximum(counts - 1, 1), counts)
+
+    return starts[segments] + fractions[:, np.newaxis] * deltas[segments]
+
+
+def dilate(mask):
+    """ Marks every cell with a marked cell in its eight-neighbourhood. """
+    result = mask.copy()
+
+    for shift in (-1, 1):
+        result[max(0, shift):len(mask) + min(0, shift)] |= mask[max(0, -shift):len(mask) + min(0, -shift)]
+
+    expanded = result.copy()
+
+    for shift in (-1, 1):
+        expanded[:, max(0, shift):mask.shape[1] + min(0, shift)] |= result[:, max(0, -shift):mask.shape[1] + min(0, -shift)]
+
+    return expanded
+
+
+class RasterIndex:
+    def __init__(self, tile_labels, tile_blocks, blocks, origin, resolution):
+        self.tile_labels = tile_labels
+        self.tile_blocks = tile_blocks
+        self.blocks = blocks
+        self.origin = origin
+        self.resolution = resolution
+
+    def get_cells(self, x, y):
+        height, width = TILE_SIZE * np.array(self.tile_labels.shape)
+
+        with np.errstate(invalid="ignore"):
+            columns = np.floor((np.asarray(x) - self.origin[0]) / self.resolution)
+            rows = np.floor((np.asarray(y) - self.origin[1]) / self.resolution)
+
+            f = (columns >= 0) & (columns < width)
+            f &= (rows >= 0) & (rows < height)
+
+        return rows[f].astype(int), columns[f].astype(int), f
+
+    def lookup(self, x, y):
+        """
+            Returns the positional zone index for every point, -1 if no zone contains the
+            point and BOUNDARY if the point lies in a cell that needs an exact test.
+        """
+        rows, columns, f = self.get_cells(x, y)
+        tile_rows, tile_columns = rows // TILE_SIZE, columns // TILE_SIZE
+
+        values = np.asarray(self.tile_labels[tile_rows, tile_columns], dtype=int)
+        blocks = self.tile_blocks[tile_rows, tile_columns]
+
+        g = blocks >= 0
+        values[g] = self.blocks[blocks[g], rows[g] % TILE_SIZE, columns[g] % TILE_SIZE]
+
+        indices = np.full((len(f),), -1, dtype=int)
+        indices[f] = values
+
+        return indices
+
+    @staticmethod
+    def build(geometries, resolution):
+        parts = [(index, polygon) for index, geometry in enumerate(geometries) for polygon in get_parts(geometry)]
+        bounds = np.array([polygon.bounds for _, polygon in parts]).reshape(-1, 4)
+
+        origin = np.floor(bounds[:, :2].min(axis=0) / resolution) * resolution - resolution
+        shape = np.ceil((bounds[:, 2:].max(axis=0) - origin) / resolution).astype(int) + 1
+        tiles = np.ceil(shape / TILE_SIZE).astype(int)
+        width = tiles[0] * TILE_SIZE
+
+        # Cell windows covering the polygons and ring segments with their extent in y
+        starts = np.floor((bounds[:, :2] - origin) / resolution).astype(int)
+        ends = np.ceil((bounds[:, 2:] - origin) / resolution).astype(int)
+        rings = []
+
+        for _, polygon in parts:
+            items = []
+
+            for ring in get_rings(polygon):
+                segment_starts, segment_deltas = ring[:-1], ring[1:] - ring[:-1]
+                y = np.vstack([ring[:-1, 1], ring[1:, 1]])
+                items.append((ring, segment_starts, segment_deltas, y.min(axis=0), y.max(axis=0)))
+
+            rings.append(items)
+
+        dtype = np.int16 if len(geometries) < 2 ** 15 else np.int32
+        tile_labels = np.zeros((tiles[1], tiles[0]), dtype=dtype)
+        tile_blocks = np.full((tiles[1], tiles[0]), -1, dtype=np.int32)
+        blocks = []
+
+        for tile_row in range(tiles[1]):
+            first_row, last_row = tile_row * TILE_SIZE, (tile_row + 1) * TILE_SIZE
+
+            labels = np.full((TILE_SIZE, width), -1, dtype=dtype)
+
+            # One row of margin on both sides, such that boundaries in the neighbouring
+            # strips are taken into account when dilating
+            crossed = np.zeros((TILE_SIZE + 2, width), dtype=bool)
+            lower, upper = origin[1] + (first_row - 1) * resolution, origin[1] + (last_row + 1) * resolution
+
+            for k in np.where((bounds[:, 1] <= upper) & (bounds[:, 3] >= lower))[0]:
+                index = parts[k][0]
+                start_row, end_row = max(starts[k, 1], first_row), min(ends[k, 1], last_row)
+
+                if start_row < end_row:
+                    cx = origin[0] + (np.arange(starts[k, 0], ends[k, 0]) + 0.5) * resolution
+                    cy = origin[1] + (np.arange(start_row, end_row) + 0.5) * resolution
+                    centers = np.vstack([np.tile(cx, len(cy)), np.repeat(cy, len(cx))]).T
+
+                    inside = Path(rings[k][0][0]).contains_points(centers)
+
+                    for ring in rings[k][1:]:
+                        inside &= ~Path(ring[0]).contains_points(centers)
+
+                    # Overlapping zones: keep the one that comes first in the zone layer
+                    window = labels[start_row - first_row:end_row - first_row, starts[k, 0]:ends[k, 0]]
+                    f = inside.reshape(window.shape) & (window < 0)
+                    window[f] = index
+
+                for _, segment_starts, segment_deltas, minimum, maximum in rings[k]:
+                    f = (minimum <= upper) & (maximum >= lower)
+
+                    if np.any(f):
+                        points = get_boundary_points(segment_starts[f], segment_deltas[f], 0.5 * resolution)
+                        cells = np.floor((points - origin) / resolution).astype(int)
+                        cells = cells[(cells[:, 1] >= first_row - 1) & (cells[:, 1] <= last_row)]
+                        crossed[cells[:, 1] - first_row + 1, cells[:, 0]] = True
+
+            # Boundary points are sampled at half the resolution, so every cell that is
+            # crossed by a boundary is a neighbour of a cell with a sample
+            labels[dilate(crossed)[1:-1]] = BOUNDARY
+
+            # Split the strip into tiles and keep only the tiles with several values
+            strip = labels.reshape(TILE_SIZE, tiles[0], TILE_SIZE).transpose(1, 0, 2)
+            uniform = strip.min(axis=(1, 2)) == strip.max(axis=(1, 2))
+
+            tile_labels[tile_row] = np.where(uniform, strip[:, 0, 0], 0)
+            tile_blocks[tile_row, ~uniform] = len(blocks) + np.arange(np.count_nonzero(~uniform))
+            blocks.extend(strip[~uniform])
+
+        blocks = np.array(blocks, dtype=dtype).reshape(-1, TILE_SIZE, TILE_SIZE)
+        return RasterIndex(tile_labels, tile_blocks, blocks, origin, resolution)
+
+
+def get_key(geometries, resolution):
+    hash = hashlib.sha1()
+    hash.update(repr((RASTER_VERSION, float(resolution))).encode("utf-8"))
+
+    for value in data.cache.to_wkb(geometries):
+        hash.update(b"" if value is None else value)
+
+    return hash.hexdigest()
+
+
+def write(directory, raster):
+    temporary_directory = "%s.%s.tmp" % (directory, uuid.uuid4().hex)
+    os.makedirs(temporary_directory)
+
+    np.save("%s/tile_labels.npy" % temporary_directory, raster.tile_labels, allow_pickle=False)
+    np.save("%s/tile_blocks.npy" % temporary_directory, raster.tile_blocks, allow_pickle=False)
+    np.save("%s/blocks.npy" % temporary_directory, raster.blocks, allow_pickle=False)
+
+    with open("%s/meta.p" % temporary_directory, "wb") as f:
+        pickle.dump(dict(origin=raster.origin, resolution=raster.resolution), f)
+
+    try:
+        os.rename(temporary_directory, directory)
+    except OSError:
+        # Another process has written the same raster in the meantime
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+
+
+def load(directory):
+    with open("%s/meta.p" % directory, "rb") as f:
+        meta = pickle.load(f)
+
+    tile_labels = np.load("%s/tile_labels.npy" % directory, mmap_mode="r", allow_pickle=False)
+    tile_blocks = np.load("%s/tile_blocks.npy" % directory, mmap_mode="r", allow_pickle=False)
+    blocks = np.load("%s/blocks.npy" % directory, mmap_mode="r", allow_pickle=False)
+
+    return RasterIndex(tile_labels, tile_blocks, blocks, meta["origin"], meta["resolution"])
+
+
+def get_raster(context, geometries):
+    """
+        Returns the raster index for the given zone geometries, or None if the option
+        `spatial_raster_resolution` is not set.
+    """
+    resolution = context.config("spatial_raster_resolution")
+
+    if resolution is None:
+        return None
+
+    assert resolution > 0
+    cache_path = context.config("raw_cache_path")
+
+    if cache_path is None:
+        print("Rasterizing %d zones at %.1fm ..." % (len(geometries), resolution))
+        return RasterIndex.build(geometries, resolution)
+
+    directory = "%s/raster.%s" % (cache_path, get_key(geometries, resolution))
+
+    if not os.path.exists(directory):
+        print("Rasterizing %d zones at %.1fm ..." % (len(geometries), resolution))
+        write(directory, RasterIndex.build(geometries, resolution))
+
+    return load(directory)
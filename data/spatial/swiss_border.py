@@ -1,16 +1,15 @@
-import geopandas as gpd
+import data.cache
+import data.spatial.utils
 
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 def execute(context):
     data_path = context.config("data_path")
 
-    df = gpd.read_file(
-        "%s/municipality_borders/gd-b-00.03-875-gg18/ggg_2018-LV95/shp/g1l18.shp" % data_path,
-        encoding = "latin1"
-    ).to_crs("epsg:2056")
-
-    df.crs = "epsg:2056"
+    df = data.spatial.utils.read_shapefile(
+        context, "%s/municipality_borders/gd-b-00.03-875-gg18/ggg_2018-LV95/shp/g1l18.shp" % data_path, encoding="latin1"
+    )
 
     return df["geometry"]
@@ -1,31 +1,160 @@
+import os
+
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-import shapely.geometry as geo
+import shapely
+from shapely.ops import triangulate
+from shapely.prepared import prep
 from sklearn.neighbors import KDTree
 
+import data.cache
+import data.spatial.raster
+
+
+class PolygonSampler:
+    """
+        Samples uniformly distributed points in polygons.
+
+        Each polygon is triangulated once and its triangles are cached with their areas.
+        Points for any number of polygons are then drawn in one vectorized call by
+        choosing a triangle by area and a uniform point in the triangle. With Shapely 2.1
+        and newer, the constrained Delaunay triangulation covers the polygon exactly.
+        Otherwise, the Delaunay triangulation of the polygon vertices is used: triangles
+        outside the polygon are dropped and points in triangles that cross the boundary
+        are redrawn until they fall into the polygon.
+    """
+
+    def __init__(self, geometries):
+        self.geometries = list(geometries)
+        self.triangles = {}
+
+    def get_triangles(self, index):
+        if not index in self.triangles:
+            geometry = self.geometries[index]
+
+            if hasattr(shapely, "constrained_delaunay_triangles"):  # Shapely 2.1
+                parts = shapely.get_parts(shapely.constrained_delaunay_triangles(geometry))
+                coordinates = shapely.get_coordinates(parts).reshape(len(parts), 4, 2)[:, :3]
+                inside = np.ones((len(parts),), dtype=bool)
+            else:
+                prepared = prep(geometry)
+                parts = [part for part in triangulate(geometry) if prepared.intersects(part)]
+                coordinates = np.array([np.asarray(part.exterior.coords)[:3] for part in parts]).reshape(-1, 3, 2)
+                inside = np.array([prepared.contains(part) for part in parts], dtype=bool)
+
+            areas = np.array([part.area for part in parts])
+            assert np.sum(areas) > 0
+
+            self.triangles[index] = (coordinates, np.cumsum(areas) / np.sum(areas), inside)
+
+        return self.triangles[index]
+
+    def draw(self, indices, random):
+        """ Draws one point in the triangulation of each given polygon and tells whether its triangle is inside. """
+        unique_indices, ranks = np.unique(indices, return_inverse=True)
+        triangles = [self.get_triangles(index) for index in unique_indices]
+
+        # Shifting the cumulative areas by the rank of the polygon allows to choose
+        # the triangles for all polygons with one search
+        coordinates = np.concatenate([item[0] for item in triangles])
+        cdf = np.concatenate([rank + item[1] for rank, item in enumerate(triangles)])
+        cdf[np.cumsum([len(item[1]) for item in triangles]) - 1] = np.arange(len(triangles)) + 1
+        inside = np.concatenate([item[2] for item in triangles])
+
+        selection = np.searchsorted(cdf, ranks + random.random_sample(len(indices)), side="right")
+        a, b, c = coordinates[selection, 0], coordinates[selection, 1], coordinates[selection, 2]
+
+        # Uniform point in the triangle by reflecting points of the parallelogram
+        u, v = random.random_sample(len(indices)), random.random_sample(len(indices))
+        f = u + v > 1
+        u[f], v[f] = 1 - u[f], 1 - v[f]
+
+        return a + u[:, np.newaxis] * (b - a) + v[:, np.newaxis] * (c - a), inside[selection]
+
+    def sample(self, indices, random=np.random):
+        """ Returns one point for each given polygon index, repeat an index to obtain more points. """
+        indices = np.asarray(indices, dtype=int)
+        assert np.all(indices >= 0)
+
+        if hasattr(shapely, "contains_xy"):  # Shapely 2
+            contains = shapely.contains_xy
+        else:
+            from shapely.vectorized import contains
+
+        result = np.zeros((len(indices), 2))
+        pending = np.arange(len(indices))
+
+        while len(pending) > 0:
+            points, accepted = self.draw(indices[pending], random)
+
+            # Points in triangles that cross the polygon boundary are tested exactly
+            for index in np.unique(indices[pending][~accepted]):
+                f = ~accepted & (indices[pending] == index)
+                accepted[f] = contains(self.geometries[index], points[f, 0], points[f, 1])
+
+            result[pending[accepted]] = points[accepted]
+            pending = pending[~accepted]
+
+        return result
+
 
 def sample_coordinates(row, count):
-    samples = []
-    bounds = row["geometry"].bounds
+    return PolygonSampler([row["geometry"]]).sample(np.zeros((count,), dtype=int))
+
+
+def read_shapefile(context, path, encoding=None, crs=None, target_crs="epsg:2056", transform=None,
+                   transform_variant=None):
+    """
+        Reads a shape file and projects it to LV95 (EPSG:2056).
+
+        The projected layer is stored in the raw cache (see data.cache), such that
+        later runs neither need to parse the shape file again nor to reproject it. If
+        `crs` is given, it overrides the projection information of the shape file. If
+        `target_crs` is None, the layer is returned without reprojection.
+
+        If a `transform` is given, it is applied to the (projected) layer and only its
+        result is cached, under an entry that is additionally keyed by the code of the
+        transform and by `transform_variant`, which must describe its arguments.
+    """
+    def read(path):
+        df = gpd.read_file(path) if encoding is None else gpd.read_file(path, encoding=encoding)
+
+        if crs is not None:
+            df.crs = crs
+
+        if target_crs is not None:
+            df = df.to_crs(target_crs)
+
+        return df if transform is None else transform(df)
 
-    while len(samples) < count:
-        x = bounds[0] + np.random.random(size=(1000,)) * (bounds[2] - bounds[0])
-        y = bounds[1] + np.random.random(size=(1000,)) * (bounds[3] - bounds[1])
-        points = map(geo.Point, zip(x, y))
-        points = [point for point in points if row["geometry"].contains(point)]
-        samples += points
+    # The attributes live in the .dbf file next to the geometries
+    dbf_path = "%s.dbf" % os.path.splitext(path)[0]
+    dbf_mtime = os.stat(dbf_path).st_mtime_ns if os.path.exists(dbf_path) else None
 
-    return np.array(list(map(lambda p: (p.x, p.y), samples[:count])))
+    variant = (encoding, crs, target_crs, dbf_mtime)
+
+    if transform is not None:
+        if transform_variant is None:
+            raise RuntimeError("A transform_variant must be given to read %s with a transform" % path)
+
+        variant += (transform_variant, data.cache.get_reader_version(transform))
+
+    return data.cache.read(context, path, read, variant=variant)
 
 
 def to_gpd(context, df, x="x", y="y", crs="epsg:2056", coord_type=""):
-    df["geometry"] = [
-        geo.Point(*coord) for coord in context.progress(
-            zip(df[x], df[y]), total=len(df),
-            label="Converting %s coordinates" % coord_type
-        )]
-    df = gpd.GeoDataFrame(df)
+    """
+        Adds point geometries from the coordinate columns `x` and `y` (in one vectorized
+        call) and returns a GeoDataFrame in LV95.
+
+        Stage outputs with locations keep plain coordinate columns, such that millions of
+        points are not pickled into the cache. The geometries are materialized with this
+        function by the consumers that need them.
+    """
+    print("Converting %d %s coordinates ..." % (len(df), coord_type))
+
+    df = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df[x], df[y]))
     df.crs = crs
 
     if not crs == "epsg:2056":
@@ -35,6 +164,157 @@ def to_gpd(context, df, x="x", y="y", crs="epsg:2056", coord_type=""):
     return df
 
 
+def deduplicate(x, y):
+    """
+        Reduces coordinates to the unique locations, such that spatial imputations only
+        run once per location (many persons share a building, many enterprises share
+        coordinates). Returns the unique coordinates and the inverse index, results for
+        the unique locations are broadcast back by indexing them with it.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+
+    # Missing coordinates obtain the code -1 and form one location of their own
+    x_codes, x_values = pd.factorize(x)
+    y_codes, y_values = pd.factorize(y)
+
+    inverse = pd.factorize((x_codes + 1) * (len(y_values) + 1) + y_codes + 1)[0]
+
+    first = np.zeros((np.max(inverse) + 1 if len(inverse) > 0 else 0,), dtype=int)
+    first[inverse[::-1]] = np.arange(len(inverse))[::-1]
+
+    print("Found %d unique locations for %d observations" % (len(first), len(inverse)))
+
+    return x[first], y[first], inverse
+
+
+class ZoneTree:
+    """
+        Point in polygon index over a zone layer.
+
+        With Shapely 2, the zones are indexed in an STR tree and all points are queried
+        in one call. With Shapely 1.x, the points are sorted by x and, for every zone,
+        the points in its bounding box are found by binary search and tested in one
+        vectorized call. The index is built once per process on first use and is not
+        pickled, such that parallel workers build it once from the geometries they
+        obtain at start-up.
+    """
+
+    def __init__(self, geometries):
+        self.geometries = geometries
+        self.tree = None
+
+    def __getstate__(self):
+        return dict(geometries=self.geometries)
+
+    def __setstate__(self, state):
+        self.geometries = state["geometries"]
+        self.tree = None
+
+    def get_tree(self):
+        if self.tree is None:
+            if hasattr(shapely, "STRtree"):  # Shapely 2
+                self.tree = shapely.STRtree(self.geometries)
+            else:
+                self.tree = np.array([geometry.bounds for geometry in self.geometries]).reshape(-1, 4)
+
+        return self.tree
+
+    def lookup(self, coordinates):
+        """
+            Returns for every coordinate the index of the first geometry that contains it,
+            or -1 if no geometry contains the point.
+        """
+        indices = np.full((len(coordinates),), -1, dtype=int)
+
+        if len(coordinates) == 0:
+            return indices
+
+        tree = self.get_tree()
+
+        if hasattr(shapely, "STRtree"):  # Shapely 2
+            point_indices, zone_indices = tree.query(shapely.points(coordinates), predicate="within")
+
+            # Overlapping zones: keep the one that comes first in the zone layer
+            order = np.lexsort((zone_indices, point_indices))
+            point_indices, first = np.unique(point_indices[order], return_index=True)
+            indices[point_indices] = zone_indices[order][first]
+
+        else:  # Shapely 1.x
+            from shapely.vectorized import contains
+
+            order = np.argsort(coordinates[:, 0], kind="stable")
+            x, y = coordinates[order, 0], coordinates[order, 1]
+
+            lower = np.searchsorted(x, tree[:, 0], side="left")
+            upper = np.searchsorted(x, tree[:, 2], side="right")
+
+            # Zones are processed in layer order, overlapping zones keep the first match
+            for index in np.where(upper > lower)[0]:
+                candidates = np.arange(lower[index], upper[index])
+                candidates = candidates[(y[candidates] >= tree[index, 1]) & (y[candidates] <= tree[index, 3])]
+                candidates = candidates[indices[order[candidates]] < 0]
+
+                if len(candidates) > 0:
+                    inside = contains(self.geometries[index], x[candidates], y[candidates])
+                    indices[order[candidates[inside]]] = index
+
+        return indices
+
+
+def _lookup_parallel(context, coordinates):
+    indices = context.data("tree").lookup(coordinates)
+    context.progress.update(len(coordinates))
+    return indices
+
+
+def lookup(context, df_zones, x, y, chunk_size=10000, zone_type="", point_type=""):
+    """
+        Finds the zone that contains each of the given LV95 coordinates.
+
+        One index is built over the zone polygons (see ZoneTree) and the points are queried in
+        parallel in chunks of at least `chunk_size` points (the number of processes is
+        given by the `threads` option). If `spatial_raster_resolution` is set, the
+        points are first looked up in a raster index of the zones (see
+        data.spatial.raster) and only points close to a zone boundary are tested
+        exactly. The calling stage needs to declare both options. The result is an
+        integer array with the positional index into `df_zones` for every point, or -1
+        where no zone contains the point.
+    """
+    geometries = np.array(list(df_zones["geometry"].values), dtype=object)
+    coordinates = np.vstack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)]).T
+
+    raster = data.spatial.raster.get_raster(context, geometries)
+
+    if raster is None:
+        return _lookup_exact(context, geometries, coordinates, chunk_size, zone_type, point_type)
+
+    indices = raster.lookup(coordinates[:, 0], coordinates[:, 1])
+    f = indices == data.spatial.raster.BOUNDARY
+
+    print("  Resolved %d of %d points by raster lookup" % (len(indices) - np.count_nonzero(f), len(indices)))
+    indices[f] = _lookup_exact(context, geometries, coordinates[f], chunk_size, zone_type, point_type)
+
+    return indices
+
+
+def _lookup_exact(context, geometries, coordinates, chunk_size, zone_type, point_type):
+    processes = max(1, min(context.config("threads"), int(np.ceil(len(coordinates) / chunk_size))))
+    chunks = np.array_split(coordinates, processes)
+
+    with context.progress(label="Looking up %d %s zones for %d %s points ..." % (
+            len(geometries), zone_type, len(coordinates), point_type), total=len(coordinates)) as progress:
+        tree = ZoneTree(geometries)
+
+        if processes == 1:
+            indices = tree.lookup(coordinates)
+            progress.update(len(coordinates))
+        else:
+            with context.parallel(dict(tree=tree), processes=processes) as parallel:
+                indices = np.hstack(parallel.map(_lookup_parallel, chunks))
+
+    return indices
+
+
 def impute(context, df_points, df_zones, point_id_field, zone_id_field, fix_by_distance=True, chunk_size=10000,
            zone_type="", point_type=""):
     assert (type(df_points) == gpd.GeoDataFrame)
@@ -44,33 +324,23 @@ def impute(context, df_points, df_zones, point_id_field, zone_id_field, fix_by_d
     assert (zone_id_field in df_zones.columns)
     assert (not zone_id_field in df_points.columns)
 
-    df_original = df_points
-    df_points = df_points[[point_id_field, "geometry"]]
-    df_zones = df_zones[[zone_id_field, "geometry"]]
-
     print("Imputing %d %s zones onto %d %s points by spatial join..."
           % (len(df_zones), zone_type, len(df_points), point_type))
 
-    result = []
-    chunk_count = max(1, int(len(df_points) / chunk_size))
-    for chunk in context.progress(np.array_split(df_points, chunk_count), total=chunk_count):
-        result.append(gpd.sjoin(df_zones, chunk, op="contains", how="right"))
-    df_points = pd.concat(result).reset_index()
-
-    if "left_index" in df_points: del df_points["left_index"]
-    if "right_index" in df_points: del df_points["right_index"]
+    x, y = df_points["geometry"].x.values, df_points["geometry"].y.values
+    indices = lookup(context, df_zones, x, y, chunk_size, zone_type, point_type)
 
-    invalid_mask = pd.isnull(df_points[zone_id_field])
+    invalid_mask = indices < 0
 
     if fix_by_distance and np.any(invalid_mask):
         print("  Fixing %d points by centroid distance join..." % np.count_nonzero(invalid_mask))
         coordinates = np.vstack([df_zones["geometry"].centroid.x, df_zones["geometry"].centroid.y]).T
         kd_tree = KDTree(coordinates)
 
-        df_missing = df_points[invalid_mask]
-        coordinates = np.vstack([df_missing["geometry"].centroid.x, df_missing["geometry"].centroid.y]).T
-        indices = kd_tree.query(coordinates, return_distance=False).flatten()
+        coordinates = np.vstack([x[invalid_mask], y[invalid_mask]]).T
+        indices[invalid_mask] = kd_tree.query(coordinates, return_distance=False).flatten()
 
-        df_points.loc[invalid_mask, zone_id_field] = df_zones.iloc[indices][zone_id_field].values
+    df_points = df_points.reset_index(drop=True)
+    df_points[zone_id_field] = pd.Series(df_zones[zone_id_field].values[np.maximum(indices, 0)]).where(indices >= 0)
 
-    return pd.merge(df_original, df_points[[point_id_field, zone_id_field]], on=point_id_field, how="left")
+    return df_points
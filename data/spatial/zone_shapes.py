@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
 
+import data.spatial.utils
+import data.utils
+
 
 def configure(context):
     context.stage("data.spatial.zones")
@@ -27,3 +31,10 @@ def execute(context):
     #df.to_file("/home/sebastian/zones.shp")
 
     return df
+
+def sample_coordinates(df_shapes, zone_ids, random = np.random):
+    """ Samples one uniform location within the shape of each given zone in one call. """
+    positions = data.utils.DenseLookup(df_shapes["zone_id"].values)(zone_ids)
+    assert np.all(positions >= 0)
+
+    return data.spatial.utils.PolygonSampler(df_shapes["geometry"].values).sample(positions, random)
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+import data.utils
+
 
 def configure(context):
     context.stage("data.spatial.countries")
@@ -45,88 +47,86 @@ def execute(context):
     ])
 
     df_zones.loc[:, "zone_id"] = np.arange(len(df_zones))
-    df_zones["zone_level"] = df_zones["zone_level"].astype("category")
+    df_zones = data.utils.enforce_categories(df_zones)
 
     return df_zones[["zone_id", "zone_name", "zone_level", "zone_level_id"]]
 
-def impute(df, df_zones, zone_id_prefix = "",
-           quarter_id_field = "quarter_id", municipality_id_field = "municipality_id", country_id_field = "country_id",
-           nuts_id_field = "nuts_id", postal_code_field = "postal_code"):
-    print("Imputing %d zones" % len(df))
-    remaining_mask = np.ones((len(df),), dtype = np.bool)
-    df.loc[:, "zone_id"] = np.nan
+class ZoneResolver:
+    """
+        Resolves zone ids from the ids of the individual zoning levels (quarter,
+        municipality, ...) through one dense lookup array per level. The resolver is
+        built once per zone table, see get_resolver.
+    """
 
-    if quarter_id_field in df:
-        f = ~pd.isnull(df[quarter_id_field]) & remaining_mask
+    def __init__(self, df_zones):
+        self.zone_level_dtype = df_zones["zone_level"].dtype
+        self.lookups = {}
 
-        df_join = pd.merge(
-            df[f][[quarter_id_field]],
-            df_zones[df_zones["zone_level"] == "quarter"][["zone_level_id", "zone_id", "zone_level"]],
-            how = "left", left_on = quarter_id_field, right_on = "zone_level_id")
+        for level in df_zones["zone_level"].unique():
+            df_level = df_zones[df_zones["zone_level"] == level]
+            keys = df_level["zone_level_id"].values
 
-        df.loc[f, zone_id_prefix + "zone_id"] = df_join.loc[:, "zone_id"].values
-        df.loc[f, zone_id_prefix + "zone_level"] = df_join.loc[:, "zone_level"].values
-        remaining_mask &= pd.isnull(df[zone_id_prefix + "zone_id"])
+            try:
+                numeric_keys = np.asarray(keys, dtype=float)
+                dense = np.all(numeric_keys >= 0) and np.all(numeric_keys == np.floor(numeric_keys))
+            except (TypeError, ValueError):
+                dense = False
 
-        print("  Found %d quarters" % np.count_nonzero(df[zone_id_prefix + "zone_level"] == "quarter"))
+            # Numeric ids (quarters, municipalities, countries, postal codes) are looked up densely
+            lookup = data.utils.DenseLookup(numeric_keys) if dense else pd.Index(keys).get_indexer
 
-    if municipality_id_field in df:
-        f = ~pd.isnull(df[municipality_id_field]) & remaining_mask
+            self.lookups[level] = (lookup, df_level["zone_id"].values)
 
-        df_join = pd.merge(
-            df[f][[municipality_id_field]],
-            df_zones[df_zones["zone_level"] == "municipality"][["zone_level_id", "zone_id", "zone_level"]],
-            how = "left", left_on = municipality_id_field, right_on = "zone_level_id")
+    def resolve(self, level, values):
+        """ Returns the zone id for each of the given level ids, or -1 if it is unknown. """
+        if level not in self.lookups:
+            return np.full((len(values),), -1, dtype=int)
 
-        df.loc[f, zone_id_prefix + "zone_id"] = df_join.loc[:, "zone_id"].values
-        df.loc[f, zone_id_prefix + "zone_level"] = df_join.loc[:, "zone_level"].values
-        remaining_mask &= pd.isnull(df[zone_id_prefix + "zone_id"])
+        lookup, zone_ids = self.lookups[level]
+        positions = lookup(np.asarray(values))
 
-        print("  Found %d municipalities" % np.count_nonzero(df[zone_id_prefix + "zone_level"] == "municipality"))
+        return np.where(positions >= 0, zone_ids[np.maximum(positions, 0)], -1)
 
-    if country_id_field in df:
-        f = ~pd.isnull(df[country_id_field]) & remaining_mask
 
-        df_join = pd.merge(
-            df[f][[country_id_field]],
-            df_zones[df_zones["zone_level"] == "country"][["zone_level_id", "zone_id", "zone_level"]],
-            how = "left", left_on = country_id_field, right_on = "zone_level_id")
+_resolvers = data.utils.FrameCache()
 
-        df.loc[f, zone_id_prefix + "zone_id"] = df_join.loc[:, "zone_id"].values
-        df.loc[f, zone_id_prefix + "zone_level"] = df_join.loc[:, "zone_level"].values
-        remaining_mask &= pd.isnull(df[zone_id_prefix + "zone_id"])
 
-        print("  Found %d countries" % np.count_nonzero(df[zone_id_prefix + "zone_level"] == "country"))
+def get_resolver(df_zones):
+    return _resolvers.get(df_zones, "resolver", lambda: ZoneResolver(df_zones))
 
-    if nuts_id_field in df:
-        f = ~pd.isnull(df[nuts_id_field]) & remaining_mask
 
-        df_join = pd.merge(
-            df[f][[nuts_id_field]],
-            df_zones[df_zones["zone_level"] == "nuts"][["zone_level_id", "zone_id", "zone_level"]],
-            how = "left", left_on = nuts_id_field, right_on = "zone_level_id")
+def impute(df, df_zones, zone_id_prefix = "",
+           quarter_id_field = "quarter_id", municipality_id_field = "municipality_id", country_id_field = "country_id",
+           nuts_id_field = "nuts_id", postal_code_field = "postal_code"):
+    print("Imputing %d zones" % len(df))
+    resolver = get_resolver(df_zones)
+
+    zone_ids = np.full((len(df),), -1, dtype=int)
+    zone_levels = np.full((len(df),), -1, dtype=int)
+    df.loc[:, "zone_id"] = np.nan
 
-        df.loc[f, zone_id_prefix + "zone_id"] = df_join.loc[:, "zone_id"].values
-        df.loc[f, zone_id_prefix + "zone_level"] = df_join.loc[:, "zone_level"].values
-        remaining_mask &= pd.isnull(df[zone_id_prefix + "zone_id"])
+    levels = [
+        ("quarter", quarter_id_field, "quarters"), ("municipality", municipality_id_field, "municipalities"),
+        ("country", country_id_field, "countries"), ("nuts", nuts_id_field, "NUTS zones"),
+        ("postal_code", postal_code_field, "postal codes")
+    ]
 
-        print("  Found %d NUTS zones" % np.count_nonzero(df[zone_id_prefix + "zone_level"] == "nuts"))
+    for level, field, label in levels:
+        if field in df:
+            f = (zone_ids < 0) & ~pd.isnull(df[field]).values
 
-    if postal_code_field in df:
-        f = ~pd.isnull(df[postal_code_field]) & remaining_mask
+            code = resolver.zone_level_dtype.categories.get_loc(level)
 
-        df_join = pd.merge(
-            df[f][[postal_code_field]],
-            df_zones[df_zones["zone_level"] == "postal_code"][["zone_level_id", "zone_id", "zone_level"]],
-            how = "left", left_on = postal_code_field, right_on = "zone_level_id")
+            values = resolver.resolve(level, df[field].values[f])
+            zone_ids[f] = values
+            zone_levels[np.where(f)[0][values >= 0]] = code
 
-        df.loc[f, zone_id_prefix + "zone_id"] = df_join.loc[:, "zone_id"].values
-        df.loc[f, zone_id_prefix + "zone_level"] = df_join.loc[:, "zone_level"].values
-        remaining_mask &= pd.isnull(df[zone_id_prefix + "zone_id"])
+            print("  Found %d %s" % (np.count_nonzero(zone_levels == code), label))
 
-        print("  Found %d postal codes" % np.count_nonzero(df[zone_id_prefix + "zone_level"] == "postal_code"))
+    df[zone_id_prefix + "zone_id"] = np.where(zone_ids >= 0, zone_ids, np.nan)
+    df[zone_id_prefix + "zone_level"] = pd.Categorical.from_codes(zone_levels, dtype=resolver.zone_level_dtype)
 
-    unknown_count = np.count_nonzero(pd.isnull(df[zone_id_prefix + "zone_id"]))
+    unknown_count = np.count_nonzero(zone_ids < 0)
 
     if unknown_count > 0:
         print("  No information for %d observations" % unknown_count)
@@ -1,3 +1,15 @@
+"""
+Population density surface from the STATPOP home locations.
+
+The homes are counted on a LV95 grid (option `population_density_resolution`, in
+meters) and the counts are convolved with a disk of radius
+c.POPULATION_DENSITY_RADIUS, such that the density at a location is found by array
+indexing. The stage result is the small density grid instead of a KD tree over all
+homes. With `population_density_exact`, the home coordinates are kept as well and
+`impute` counts the homes within the radius exactly, reporting the deviation of the
+grid for validation.
+"""
+
 import numpy as np
 from sklearn.neighbors import KDTree
 
@@ -6,18 +18,72 @@ import data.constants as c
 
 def configure(context):
     context.stage("data.statpop.persons")
+    context.config("population_density_resolution", default=100.0)
+    context.config("population_density_exact", default=False)
+
+
+def convolve(counts, kernel):
+    """ Convolves the counts with a (symmetric) kernel using FFT, keeping the shape of the counts. """
+    shape = np.array(counts.shape) + np.array(kernel.shape) - 1
+
+    result = np.fft.irfft2(np.fft.rfft2(counts, shape) * np.fft.rfft2(kernel, shape), shape)
+    offset = np.array(kernel.shape) // 2
+
+    return result[offset[0]:offset[0] + counts.shape[0], offset[1]:offset[1] + counts.shape[1]]
 
 
 def execute(context):
     df_statpop = context.stage("data.statpop.persons")
-    density_coordinates = np.vstack([df_statpop["home_x"], df_statpop["home_y"]]).T
-    kd_tree = KDTree(density_coordinates)
+    resolution = context.config("population_density_resolution")
+    radius = c.POPULATION_DENSITY_RADIUS
+
+    coordinates = np.vstack([df_statpop["home_x"], df_statpop["home_y"]]).T
+
+    # Grid covering all homes with a margin of the radius, locations outside have no homes in reach
+    margin = int(np.ceil(radius / resolution)) + 1
+    origin = np.floor(np.min(coordinates, axis=0) / resolution) * resolution - margin * resolution
+    shape = np.ceil((np.max(coordinates, axis=0) - origin) / resolution).astype(int) + margin + 1
+
+    print("Counting %d homes on a %dx%d grid ..." % (len(coordinates), shape[0], shape[1]))
+    cells = np.floor((coordinates - origin) / resolution).astype(int)
+    counts = np.bincount(cells[:, 1] * shape[0] + cells[:, 0], minlength=shape[0] * shape[1])
+    counts = counts.reshape(shape[1], shape[0]).astype(np.float64)
+
+    # Disk kernel over the cell offsets
+    offsets = np.arange(-margin, margin + 1) * resolution
+    kernel = (np.hypot(*np.meshgrid(offsets, offsets)) <= radius).astype(np.float64)
 
-    return kd_tree
+    density = np.rint(convolve(counts, kernel)).astype(np.int32)
 
+    return dict(
+        density=density, origin=origin, resolution=resolution, radius=radius,
+        coordinates=coordinates if context.config("population_density_exact") else None
+    )
 
-def impute(kd_tree, df, x="x", y="y", radius=c.POPULATION_DENSITY_RADIUS):
+
+def impute(density, df, x="x", y="y", radius=c.POPULATION_DENSITY_RADIUS):
     print("Imputing population density ...")
+    assert radius == density["radius"]
+
     coordinates = np.vstack([df[x], df[y]]).T
-    counts = kd_tree.query_radius(coordinates, radius, count_only=True)
+    grid = density["density"]
+
+    cells = np.floor((coordinates - density["origin"]) / density["resolution"])
+
+    with np.errstate(invalid="ignore"):
+        f = (cells[:, 0] >= 0) & (cells[:, 0] < grid.shape[1]) & (cells[:, 1] >= 0) & (cells[:, 1] < grid.shape[0])
+
+    counts = np.zeros((len(coordinates),), dtype=np.int32)
+    counts[f] = grid[cells[f, 1].astype(int), cells[f, 0].astype(int)]
+
+    if density["coordinates"] is not None:
+        print("  Validating against exact counts ...")
+        kd_tree = KDTree(density["coordinates"])
+        exact_counts = kd_tree.query_radius(coordinates, radius, count_only=True)
+
+        deviation = np.abs(counts - exact_counts) / np.maximum(exact_counts, 1)
+        print("  Relative deviation of the grid: mean %.4f, max %.4f" % (np.mean(deviation), np.max(deviation)))
+
+        counts = exact_counts
+
     df["population_density"] = counts  # / (np.pi * c.POPULATION_DENSITY_RADIUS**2)
@@ -1,22 +1,38 @@
+import lzma as xz
+
+import data.cache
+import data.utils
+
+FIELDS = {
+    "householdIdNum": int,
+    "Plausibel": int
+}
+
+RENAMES = {
+    "householdIdNum": "household_id",
+    "Plausibel": "plausible"
+}
+
+
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 
-def execute(context):
+def read(context, filter=None, filter_variant=None):
+    """
+        Reads the STATPOP households. The optional `filter` is applied while parsing (see
+        data.cache.read), such that rejected rows are never materialized.
+    """
     data_path = context.config("data_path")
 
-    import lzma as xz
-    import data.utils
+    def parse(path, filter=None):
+        with xz.open(path) as f:
+            return data.utils.read_csv(context, f, FIELDS, RENAMES, total=3488739, filter=filter)
 
-    with xz.open("%s/statpop/STATPOP_2012_PHH.csv.xz" % data_path) as f:
-        fields = {
-            "householdIdNum": int,
-            "Plausibel": int
-        }
+    return data.cache.read(context, "%s/statpop/STATPOP_2012_PHH.csv.xz" % data_path, parse,
+                           variant=(FIELDS, RENAMES), filter=filter, filter_variant=filter_variant)
 
-        renames = {
-            "householdIdNum": "household_id",
-            "Plausibel": "plausible"
-        }
 
-        return data.utils.read_csv(context, f, fields, renames, total=3488739)
+def execute(context):
+    return read(context)
@@ -1,24 +1,41 @@
+import lzma as xz
+
+import data.cache
+import data.utils
+
+FIELDS = {
+    "personPseudoID" : int,
+    "householdIdNum" : int,
+    "REPORTINGMUNICIPALITYID" : int
+}
+
+RENAMES = {
+    "personPseudoID" : "person_id",
+    "householdIdNum" : "household_id",
+    "REPORTINGMUNICIPALITYID" : "municipality_id"
+}
+
+
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 
-def execute(context):
+def read(context, filter=None, filter_variant=None):
+    """
+        Reads the STATPOP links between persons and households. The optional `filter`
+        is applied while parsing (see data.cache.read), such that rejected rows are
+        never materialized.
+    """
     data_path = context.config("data_path")
 
-    import lzma as xz
-    import data.utils
+    def parse(path, filter=None):
+        with xz.open(path) as f:
+            return data.utils.read_csv(context, f, FIELDS, RENAMES, total = 8261094, filter = filter)
 
-    with xz.open("%s/statpop/STATPOP_2012_Link_Pers_HH.csv.xz" % data_path) as f:
-        fields = {
-            "personPseudoID" : int,
-            "householdIdNum" : int,
-            "REPORTINGMUNICIPALITYID" : int
-        }
+    return data.cache.read(context, "%s/statpop/STATPOP_2012_Link_Pers_HH.csv.xz" % data_path, parse,
+                           variant = (FIELDS, RENAMES), filter = filter, filter_variant = filter_variant)
 
-        renames = {
-            "personPseudoID" : "person_id",
-            "householdIdNum" : "household_id",
-            "REPORTINGMUNICIPALITYID" : "municipality_id"
-        }
 
-        return data.utils.read_csv(context, f, fields, renames, total = 8261094)
+def execute(context):
+    return read(context)
@@ -0,0 +1,69 @@
+"""
+Integerization of fitted expansion factors.
+
+The functions return the number of replications of every group (e.g. household)
+instead of replicated data frames. Randomness only comes from the given
+np.random.RandomState, so results are reproducible by seed.
+
+- "trs": Truncate-Replicate-Sample. Every group is replicated by the integer part of
+  its expansion factor. The remaining total is then sampled without replacement
+  with probabilities proportional to the remainders, using Efraimidis-Spirakis keys.
+  The replications sum up to the rounded total of the expansion factors.
+- "rounding": controlled (systematic) rounding. The cumulative expansion factors are
+  rounded from a common random offset, so each count is the floor or the ceiling of
+  its expansion factor and equals it in expectation. So does the total.
+"""
+
+import numpy as np
+
+METHODS = ["trs", "rounding"]
+
+
+def sample_without_replacement(weights, count, random):
+    """ Returns the indices of `count` items sampled without replacement with probabilities proportional to `weights`. """
+    if count == 0:
+        return np.zeros((0,), dtype=int)
+
+    f = weights > 0
+    assert count <= np.count_nonzero(f)
+
+    # Efraimidis-Spirakis: the items with the largest keys u^(1/w) form the sample
+    keys = np.full(weights.shape, -np.inf)
+    keys[f] = np.log(random.random_sample(np.count_nonzero(f))) / weights[f]
+
+    return np.argpartition(-keys, count - 1)[:count]
+
+
+def truncate_replicate_sample(weights, random):
+    weights = np.asarray(weights, dtype=np.float64)
+
+    # 1) Truncate and 2) replicate by the integer part
+    counts = np.floor(weights).astype(int)
+    remainders = weights - counts
+
+    # 3) Sample the remaining total by the remainders
+    count = int(np.round(np.sum(weights) - np.sum(counts)))
+    counts[sample_without_replacement(remainders, count, random)] += 1
+
+    return counts
+
+
+def controlled_rounding(weights, random):
+    weights = np.asarray(weights, dtype=np.float64)
+
+    cumulative = np.floor(np.cumsum(weights) + random.random_sample())
+    return np.diff(cumulative, prepend=0.0).astype(int)
+
+
+def integerize(weights, method="trs", random=None, seed=None):
+    """ Returns the number of replications for every expansion factor. """
+    if random is None:
+        random = np.random.RandomState(seed)
+
+    if method == "trs":
+        return truncate_replicate_sample(weights, random)
+
+    if method == "rounding":
+        return controlled_rounding(weights, random)
+
+    raise RuntimeError("Unknown integerization method: %s" % method)
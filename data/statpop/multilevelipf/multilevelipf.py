@@ -1,4 +1,21 @@
+"""
+Iterative proportional updating (IPU) with group (household) and individual
+(person) level controls.
+
+A fitting problem is kept at group level: one expansion factor per group and one
+sparse group x control incidence matrix per control level. Group controls count a
+group once if it matches, individual controls count the matching individuals of
+each group. Totals of all controls are then sparse matrix-vector products and the
+adjustment of one control only touches the groups in its column.
+"""
+
+import copy
+import time
+
 import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+from scipy.sparse.linalg import spsolve
 
 
 def add_expansion_factor_column(df):
@@ -14,174 +31,314 @@ def check_control_has_weight_column(controls):
     return controls
 
 
-def compute_group_filters(df, group_controls):
-    # create filters for group level controls
-    group_filters = []
-    for control in group_controls:
-        for _, row in control.iterrows():
-            group_filter = [row["weight"]]
+def compute_incidence(df, group_indices, number_of_groups, controls):
+    """
+        Returns the control weights and a sparse (CSC) matrix that holds for every group
+        and control row the number of rows in `df` that match the control row. The
+        attributes of a control are all columns of the control data frame except
+        for the weight, missing attributes never match.
+    """
+    weights, matrices = [], []
+
+    for control in controls:
+        columns = [column for column in control.columns if column != "weight"]
+
+        df_control = pd.DataFrame(control[columns]).reset_index(drop=True)
+        df_control["control_index"] = np.arange(len(df_control))
 
-            # build filter
-            f = np.ones(df.shape[0], dtype=np.bool)
-            for c in list(row.drop("weight").index):
-                f &= (df[c] == row[c])
+        df_match = pd.DataFrame(df[columns]).reset_index(drop=True)
+        df_match["group_index"] = group_indices
+        df_match = pd.merge(df_match.dropna(subset=columns), df_control, on=columns)
 
-            group_filter.append(f)
-            group_filters.append(group_filter)
+        matrices.append(sparse.csc_matrix((
+            np.ones((len(df_match),)), (df_match["group_index"].values, df_match["control_index"].values)
+        ), shape=(number_of_groups, len(df_control))))
 
-    return group_filters
+        weights.append(control["weight"].values.astype(np.float64))
 
+    if len(controls) == 0:
+        return np.zeros((0,)), sparse.csc_matrix((number_of_groups, 0))
 
-def compute_individual_filters(df, group_id, individual_controls):
-    # create filters for individual level controls
-    individual_filters = []
-    for control in individual_controls:
-        for _, row in control.iterrows():
-            individual_filter = [row["weight"]]
+    # Duplicate entries are summed up on conversion
+    return np.concatenate(weights), sparse.hstack(matrices, format="csc")
 
-            # build a filter to select all individuals that match current control values
-            f_individual = np.ones(df.shape[0], dtype=np.bool)
-            for c in list(row.drop("weight").index):
-                f_individual &= (df[c] == row[c])
 
-            individual_filter.append(f_individual)
+def compute_group_incidence(df, group_indices, number_of_groups, group_controls):
+    weights, matrix = compute_incidence(df, group_indices, number_of_groups, group_controls)
 
-            # select group ids corresponding to individuals to rescale
-            group_ids = list(df[f_individual][group_id].unique())
-            f_group = df[group_id].isin(group_ids)
+    # Every group counts once for a group control
+    matrix.data[:] = 1.0
+    return weights, matrix
 
-            individual_filter.append(f_group)
-            individual_filters.append(individual_filter)
 
-    return individual_filters
+def compute_individual_incidence(df, group_indices, number_of_groups, individual_controls):
+    return compute_incidence(df, group_indices, number_of_groups, individual_controls)
 
 
 class FittingProblem:
+    """
+        Fitting problem at group level. `df` contains one row per individual, the
+        expansion factors and attributes of the groups are taken from their first row.
+        Controls are data frames with the control attributes and a weight column.
+    """
+
     def __init__(self, df, group_controls, group_id, individual_controls=None, individual_id=""):
         if individual_controls is None:
             individual_controls = []
-        self.df = df
-        self.group_controls = group_controls
+
+        group_indices, _ = pd.factorize(df[group_id])
+
+        self.df = add_expansion_factor_column(df.drop_duplicates(group_id).reset_index(drop=True))
+        self.group_sizes = np.ones((len(self.df),))
         self.group_id = group_id
-        self.individual_controls = individual_controls
         self.individual_id = individual_id
 
-    def get_group_expansion_factors(self, group_filter):
-        return self.df[group_filter][[self.group_id, "expansion_factor"]].drop_duplicates(self.group_id)["expansion_factor"]
+        self.group_weights, self.group_incidence = compute_group_incidence(
+            df, group_indices, len(self.df), group_controls)
 
-    def get_individual_expansion_factors(self, individual_filter):
-        return self.df[individual_filter]["expansion_factor"]
+        self.individual_weights, self.individual_incidence = compute_individual_incidence(
+            df, group_indices, len(self.df), individual_controls)
 
+    def get_expansion_factors(self):
+        return self.df["expansion_factor"].values.astype(np.float64)
 
-class IPUSolver:
-    def __init__(self, group_rel_tol=1e-3, group_abs_tol=10, ind_rel_tol=1e-3, ind_abs_tol=10, max_iter=2000):
+    def aggregate(self):
+        """
+            Collapses groups that are identical for the fit into classes. Groups are
+            identical if they have the same initial expansion factor and the same row in
+            the incidence matrices, i.e. they match the same group controls and have the
+            same number of individuals in every individual control. The returned class
+            problem has one row per class with the incidence multiplied by the class size
+            (kept in `group_sizes`), its fitted expansion factors apply to every group of
+            the class. Also returns the class of every group.
+        """
+        keys = get_row_keys(sparse.hstack([self.group_incidence, self.individual_incidence]))
+        keys = np.hstack([keys, pd.factorize(self.get_expansion_factors())[0][:, np.newaxis]])
+
+        _, first, classes = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        classes = classes.reshape(-1)
+        sizes = sparse.diags(np.bincount(classes).astype(np.float64))
+
+        problem = copy.copy(self)
+        problem.df = self.df.iloc[first].reset_index(drop=True)
+        problem.group_sizes = sizes.diagonal()
+        problem.group_incidence = sparse.csc_matrix(sizes.dot(self.group_incidence[first]))
+        problem.individual_incidence = sparse.csc_matrix(sizes.dot(self.individual_incidence[first]))
+
+        return problem, classes
+
+    def get_group_cells(self):
+        """
+            Returns for every group the cell of group controls it matches, i.e. groups in
+            the same cell match exactly the same group controls. With one level of
+            mutually exclusive group controls, the cells are these controls. Groups that
+            match no group control obtain -1.
+        """
+        keys = get_row_keys(self.group_incidence)
+        _, cells = np.unique(keys, axis=0, return_inverse=True)
+        cells = cells.reshape(-1)
+
+        f_unmatched = np.diff(self.group_incidence.tocsr().indptr) == 0
+        return np.where(f_unmatched, -1, cells)
+
+
+def get_row_keys(matrix):
+    """ Returns a padded integer array that encodes the (column, count) entries of every row of `matrix`. """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sort_indices()
+
+    nnz = np.diff(matrix.indptr)
+    values = np.rint(matrix.data).astype(np.int64)
+    codes = matrix.indices.astype(np.int64) * (np.max(values, initial=0) + 1) + values
+
+    keys = np.full((matrix.shape[0], max(np.max(nnz, initial=0), 1)), -1, dtype=np.int64)
+    keys[np.repeat(np.arange(matrix.shape[0]), nnz), np.arange(len(codes)) - np.repeat(matrix.indptr[:-1], nnz)] = codes
+
+    return keys
+
+
+def get_columns(matrix):
+    return [
+        (matrix.indices[start:end], matrix.data[start:end])
+        for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])
+    ]
+
+
+def compute_errors(matrix, weights, expansion_factors):
+    """ Returns the weighted mean absolute percentage error and the weighted mean absolute error. """
+    if len(weights) == 0:
+        return 0.0, 0.0
+
+    errors = np.abs(matrix.T.dot(expansion_factors) - weights)
+    denominator = np.sum(np.abs(weights))
+
+    return np.sum(errors) / denominator, np.sum(errors * np.abs(weights)) / denominator
+
+
+class Solver:
+    """
+        Common convergence test of the solvers: the fit is converged if the group
+        controls and the individual controls each meet either their relative (WMAPE)
+        or their absolute (WMAE) tolerance.
+    """
+
+    def __init__(self, group_rel_tol, group_abs_tol, ind_rel_tol, ind_abs_tol, max_iter):
         self.group_rel_tol = group_rel_tol
         self.group_abs_tol = group_abs_tol
         self.ind_rel_tol = ind_rel_tol
         self.ind_abs_tol = ind_abs_tol
         self.max_iter = max_iter
 
-    def _group_fit(self, df, group_controls, group_id):
-        for group_control in group_controls:
-            group_weight = group_control[0]
-            group_filter = group_control[1]
-            df = self._group_adjust(df, group_filter, group_weight, group_id)
-        return df
+        # One entry per convergence check with the errors at group and individual level
+        self.history = []
 
-    @staticmethod
-    def _group_adjust(df, group_filter, group_weight, group_id):
-        # rescale expansion factors
-        total = np.sum(df[group_filter][[group_id, "expansion_factor"]].drop_duplicates(group_id)["expansion_factor"])
-        r = group_weight / total
-        df.loc[group_filter, "expansion_factor"] *= r
+        # Summary of the last fit: iterations, wall time and final errors
+        self.info = {}
 
-        return df
+    def _is_converged(self, problem, expansion_factors, iteration):
+        group_wmape, group_wmae = compute_errors(problem.group_incidence, problem.group_weights, expansion_factors)
+        ind_wmape, ind_wmae = compute_errors(problem.individual_incidence, problem.individual_weights, expansion_factors)
 
-    def _individual_fit(self, df, controls):
-        for control in controls:
-            weight = control[0]
-            individual_filter = control[1]
-            group_filter = control[2]
-            df = self._individual_adjust(df, individual_filter, group_filter, weight)
+        self.history.append(dict(
+            iteration=iteration, group_wmape=group_wmape, group_wmae=group_wmae,
+            individual_wmape=ind_wmape, individual_wmae=ind_wmae
+        ))
 
-        return df
+        if len(problem.group_weights) == 0:
+            return True
 
-    @staticmethod
-    def _individual_adjust(df, f_individual, f_group, weight):
-        # compute scaling factor
-        total = np.sum(df[f_individual]["expansion_factor"])
-        r = weight / total
+        if group_wmape > self.group_rel_tol and group_wmae > self.group_abs_tol:
+            return False
 
-        # assign to groups
-        df.loc[f_group, "expansion_factor"] *= r
+        if ind_wmape > self.ind_rel_tol and ind_wmae > self.ind_abs_tol:
+            return False
 
-        return df
+        return True
 
-    def _is_converged(self, df, group_controls, group_id, individual_controls):
+    def _finish(self, problem, expansion_factors, converged, start_time):
+        last = self.history[-1] if len(self.history) > 0 else {}
 
-        if len(group_controls) == 0:
-            return True
+        self.info = dict(
+            iterations=last.get("iteration", -1) + 1, time=time.time() - start_time, converged=converged,
+            group_wmape=last.get("group_wmape", 0.0), individual_wmape=last.get("individual_wmape", 0.0)
+        )
 
-        # compute WMAPE and WMAE at group level
-        nominator_wmape = 0
-        nominator_wmae = 0
-        denominator = 0
+        df = problem.df.copy()
+        df["expansion_factor"] = expansion_factors
 
-        for group_control in group_controls:
-            weight = group_control[0]
-            f_group = group_control[1]
-            total = np.sum(df[f_group][[group_id, "expansion_factor"]].drop_duplicates(group_id)["expansion_factor"])
+        return df, converged
 
-            nominator_wmape += np.abs(total - weight)
-            nominator_wmae += np.abs(total - weight) * np.abs(weight)
-            denominator += np.abs(weight)
 
-        wmape = nominator_wmape / denominator
-        wmae = nominator_wmae / denominator
+class IPUSolver(Solver):
+    def __init__(self, group_rel_tol=1e-3, group_abs_tol=10, ind_rel_tol=1e-3, ind_abs_tol=10, max_iter=2000):
+        Solver.__init__(self, group_rel_tol, group_abs_tol, ind_rel_tol, ind_abs_tol, max_iter)
 
-        if wmape > self.group_rel_tol and wmae > self.group_abs_tol:
-            return False
+    @staticmethod
+    def _adjust(expansion_factors, columns, weights):
+        # Controls are adjusted one after another, every one rescales the groups in its column
+        for (indices, counts), weight in zip(columns, weights):
+            total = np.dot(counts, expansion_factors[indices])
 
-        # compute WMAPE and WMAE at individual level
-        nominator_wmape = 0
-        nominator_wmae = 0
-        denominator = 0
+            if total > 0:
+                expansion_factors[indices] *= weight / total
 
-        for individual_control in individual_controls:
-            weight = individual_control[0]
-            f_individual = individual_control[1]
-            total = np.sum(df[f_individual]["expansion_factor"])
+    def fit(self, problem):
+        """
+            Fits the expansion factors of the groups. Returns the group level data frame
+            with the fitted expansion factors and whether the algorithm converged.
+        """
+        start_time = time.time()
+        expansion_factors = problem.get_expansion_factors()
 
-            nominator_wmape += np.abs(total - weight)
-            nominator_wmae += np.abs(total - weight) * np.abs(weight)
-            denominator += np.abs(weight)
+        group_columns = get_columns(problem.group_incidence)
+        individual_columns = get_columns(problem.individual_incidence)
 
-        wmape = nominator_wmape / denominator
-        wmae = nominator_wmae / denominator
+        self.history = []
+        converged = False
 
-        if wmape > self.ind_rel_tol and wmae > self.ind_abs_tol:
-            return False
+        for i in range(self.max_iter):
+            # group fit and check convergence
+            self._adjust(expansion_factors, group_columns, problem.group_weights)
+            if self._is_converged(problem, expansion_factors, i):
+                converged = True
+                break
 
-        return True
+            # individual fit and check convergence
+            self._adjust(expansion_factors, individual_columns, problem.individual_weights)
+            if self._is_converged(problem, expansion_factors, i):
+                converged = True
+                break
+
+        return self._finish(problem, expansion_factors, converged, start_time)
+
+
+class RakingSolver(Solver):
+    """
+        Generalized raking: the expansion factors are w = d * exp(A l), with the initial
+        expansion factors d and the group x control incidence A of all controls. This
+        is the solution closest to d in terms of entropy that meets all controls. The
+        Lagrange multipliers l are found by Newton iterations on A^T w - t = 0 with a
+        backtracking line search, which converges quadratically close to the solution.
+        Controls without any matching group cannot be met and are left out.
+    """
+
+    def __init__(self, group_rel_tol=1e-3, group_abs_tol=10, ind_rel_tol=1e-3, ind_abs_tol=10, max_iter=100,
+                 min_step=1e-4, ridge=1e-10):
+        Solver.__init__(self, group_rel_tol, group_abs_tol, ind_rel_tol, ind_abs_tol, max_iter)
+        self.min_step = min_step
+        self.ridge = ridge
 
     def fit(self, problem):
+        """
+            Fits the expansion factors of the groups. Returns the group level data frame
+            with the fitted expansion factors and whether the algorithm converged.
+        """
+        start_time = time.time()
+        initial_factors = problem.get_expansion_factors()
+
+        matrix = sparse.hstack([problem.group_incidence, problem.individual_incidence], format="csr")
+        targets = np.concatenate([problem.group_weights, problem.individual_weights])
+
+        # Classes of groups enter the totals with their size, but every group of a class has the factor of one group
+        exponents = sparse.diags(1.0 / problem.group_sizes).dot(matrix)
+
+        active = np.asarray(matrix.sum(axis=0)).flatten() > 0
+        matrix, exponents, targets = matrix[:, active], exponents[:, active], targets[active]
 
-        df = problem.df
-        group_controls = problem.group_controls
-        group_id = problem.group_id
-        individual_controls = problem.individual_controls
+        multipliers = np.zeros((len(targets),))
+        expansion_factors = initial_factors.copy()
+
+        self.history = []
+        converged = False
 
         for i in range(self.max_iter):
-            # group fit and check convergence
-            df = self._group_fit(df=df, group_controls=group_controls, group_id=group_id)
-            if self._is_converged(df=df, group_controls=group_controls, group_id=group_id,
-                                  individual_controls=individual_controls):
-                return df, True
+            if self._is_converged(problem, expansion_factors, i):
+                converged = True
+                break
 
-            # individual fit and check convergence
-            df = self._individual_fit(df=df, controls=individual_controls)
-            if self._is_converged(df=df, group_controls=group_controls, group_id=group_id,
-                                  individual_controls=individual_controls):
-                return df, True
+            residuals = matrix.T.dot(expansion_factors) - targets
+            jacobian = sparse.csc_matrix(matrix.T.dot(sparse.diags(expansion_factors)).dot(exponents))
+
+            # Controls may be linearly dependent (e.g. municipality totals add up to the
+            # canton totals), hence the small ridge on the sparse Jacobian
+            ridge = self.ridge * max(np.max(jacobian.diagonal()), 1.0)
+            direction = -spsolve(jacobian + ridge * sparse.identity(len(targets), format="csc"), residuals)
+
+            norm, step = np.linalg.norm(residuals), 1.0
+
+            while step >= self.min_step:
+                candidate_multipliers = multipliers + step * direction
+                candidate_factors = initial_factors * np.exp(np.minimum(exponents.dot(candidate_multipliers), 50.0))
+
+                if np.linalg.norm(matrix.T.dot(candidate_factors) - targets) < norm:
+                    break
+
+                step *= 0.5
+
+            if step < self.min_step:
+                # No further improvement, the controls cannot be met together
+                break
+
+            multipliers, expansion_factors = candidate_multipliers, candidate_factors
 
-        return df, False
+        return self._finish(problem, expansion_factors, converged, start_time)
@@ -1,40 +1,56 @@
+import lzma as xz
+
+import data.cache
+import data.utils
+
+FIELDS = {
+    "personPseudoID": int,
+    "SEX": int,
+    "AGE": int,
+    "MARITALSTATUS": int,
+    "NATIONALITYCATEGORY": int,
+    "GEOCOORDN": float,
+    "GEOCOORDE": float,
+    "POPULATIONTYPE": int,
+    "TYPEOFRESIDENCE": int,
+    "REPORTINGMUNICIPALITYID": int,
+    "FEDERALBUILDINGID": int,
+}
+
+RENAMES = {
+    "personPseudoID": "person_id",
+    "SEX": "sex",
+    "AGE": "age",
+    "MARITALSTATUS": "marital_status",
+    "NATIONALITYCATEGORY": "nationality",
+    "GEOCOORDN": "home_y",
+    "GEOCOORDE": "home_x",
+    "POPULATIONTYPE": "population_type",
+    "TYPEOFRESIDENCE": "type_of_residence",
+    "REPORTINGMUNICIPALITYID": "municipality_id",
+    "FEDERALBUILDINGID": "federal_building_id",
+}
+
+
 def configure(context):
     context.config("data_path")
+    data.cache.configure(context)
 
 
-def execute(context):
+def read(context, filter=None, filter_variant=None):
+    """
+        Reads the STATPOP persons. The optional `filter` is applied while parsing (see
+        data.cache.read), such that rejected rows are never materialized.
+    """
     data_path = context.config("data_path")
 
-    import lzma as xz
-    import data.utils
-
-    with xz.open("%s/statpop/STATPOP_2012_Personen.csv.xz" % data_path) as f:
-        fields = {
-            "personPseudoID": int,
-            "SEX": int,
-            "AGE": int,
-            "MARITALSTATUS": int,
-            "NATIONALITYCATEGORY": int,
-            "GEOCOORDN": float,
-            "GEOCOORDE": float,
-            "POPULATIONTYPE": int,
-            "TYPEOFRESIDENCE": int,
-            "REPORTINGMUNICIPALITYID": int,
-            "FEDERALBUILDINGID": int,
-        }
-
-        renames = {
-            "personPseudoID": "person_id",
-            "SEX": "sex",
-            "AGE": "age",
-            "MARITALSTATUS": "marital_status",
-            "NATIONALITYCATEGORY": "nationality",
-            "GEOCOORDN": "home_y",
-            "GEOCOORDE": "home_x",
-            "POPULATIONTYPE": "population_type",
-            "TYPEOFRESIDENCE": "type_of_residence",
-            "REPORTINGMUNICIPALITYID": "municipality_id",
-            "FEDERALBUILDINGID": "federal_building_id",
-        }
-
-        return data.utils.read_csv(context, f, fields, renames, total=8261094)
+    def parse(path, filter=None):
+        with xz.open(path) as f:
+            return data.utils.read_csv(context, f, FIELDS, RENAMES, total=8261094, filter=filter)
+
+    return data.cache.read(context, "%s/statpop/STATPOP_2012_Personen.csv.xz" % data_path, parse,
+                           variant=(FIELDS, RENAMES), filter=filter, filter_variant=filter_variant)
+
+
+def execute(context):
+    return read(context)
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 
+import data.cache
 import data.constants as c
 
 CANTON_TO_ID = {
@@ -63,6 +64,7 @@ CANTON_TO_ID_MULTILANGUAGE = {"Zürich": 1,
 def configure(context):
     context.config("data_path")
     context.config("scaling_year")
+    data.cache.configure(context)
 
 
 def execute(context):
@@ -74,8 +76,9 @@ def execute(context):
     if scaling_year < c.BASE_PROJECTED_YEAR:
 
         # Load csv for historical data
-        df_households = (pd.read_csv("%s/projections/households/px-x-0102020000_402.csv" % data_path,
-                                     sep=";", encoding="latin1", skiprows=1)
+        df_households = (data.cache.read(context, "%s/projections/households/px-x-0102020000_402.csv" % data_path,
+                                         lambda path: pd.read_csv(path, sep=";", encoding="latin1", skiprows=1),
+                                         variant="skiprows=1")
                          .rename({'Kanton (-) / Bezirk (>>) / Gemeinde (......)': "canton_id"}, axis=1)
                          )
 
@@ -109,9 +112,10 @@ def execute(context):
     else:
 
         # Load excel for projections
-        df_households = pd.read_excel(
-            "%s/projections/households/su-d-01.03.03.03.01.xlsx" % data_path,
-            header=[0, 1], skiprows=2, nrows=27, index_col=0).reset_index().rename({
+        df_households = data.cache.read(
+            context, "%s/projections/households/su-d-01.03.03.03.01.xlsx" % data_path,
+            lambda path: pd.read_excel(path, header=[0, 1], skiprows=2, nrows=27, index_col=0),
+            variant="header=0,1;skiprows=2;nrows=27;index_col=0").reset_index().rename({
             "index": "canton_id",
             "Total": "total",
             "1 Person": "1",
@@ -0,0 +1,60 @@
+"""
+Optional municipality level projections for the scaling of STATPOP.
+
+The options `scaling_municipality_households` and `scaling_municipality_population`
+point to CSV files (relative to `data_path`) with one row per control:
+
+- households: municipality_id, weight and optionally household_size (1, 2, 3, ...)
+- population: municipality_id, weight and optionally any of sex (0 male, 1 female),
+  nationality (0 Swiss, 1 foreign) and age (in years) or age_class
+
+Deprecated municipality ids are mapped to the reference municipalities. If an option
+is not set, the respective data frame is None.
+"""
+
+import numpy as np
+import pandas as pd
+
+import data.cache
+import data.constants as c
+import data.spatial.municipalities
+
+
+def configure(context):
+    context.config("data_path")
+    context.config("scaling_municipality_households", default=None)
+    context.config("scaling_municipality_population", default=None)
+    data.cache.configure(context)
+    context.stage("data.spatial.municipalities")
+
+
+def read(context, path, columns):
+    df = data.cache.read(context, "%s/%s" % (context.config("data_path"), path), pd.read_csv)
+
+    if "age" in df.columns and "age_class" not in df.columns:
+        df["age_class"] = np.digitize(df["age"], c.AGE_CLASS_UPPER_BOUNDS)
+
+    columns = [column for column in columns if column in df.columns]
+    df = df[["municipality_id"] + columns + ["weight"]].copy()
+
+    df = data.spatial.municipalities.update_municipality_ids(
+        df, context.stage("data.spatial.municipalities")[1], remove_unknown=True)
+
+    # Merged municipalities are summed up
+    df = df.groupby(["municipality_id"] + columns)["weight"].sum().reset_index()
+    print("Read %d municipality controls from %s" % (len(df), path))
+
+    return df
+
+
+def execute(context):
+    df_households, df_population = None, None
+
+    if context.config("scaling_municipality_households") is not None:
+        df_households = read(context, context.config("scaling_municipality_households"), ["household_size"])
+
+    if context.config("scaling_municipality_population") is not None:
+        df_population = read(context, context.config("scaling_municipality_population"),
+                             ["sex", "nationality", "age_class"])
+
+    return df_households, df_population
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 
+import data.cache
 import data.constants as c
 
 CANTON_TO_ID = {"Zürich": 1,
@@ -33,6 +34,7 @@ CANTON_TO_ID = {"Zürich": 1,
 def configure(context):
     context.config("data_path")
     context.config("scaling_year")
+    data.cache.configure(context)
 
 def execute(context):
     data_path = context.config("data_path")
@@ -43,8 +45,9 @@ def execute(context):
     if scaling_year < c.BASE_PROJECTED_YEAR:
 
         # load excel data
-        df = pd.read_csv("%s/projections/population/px-x-0102010000_101.csv" % data_path, sep=";",
-                         encoding="latin1", skiprows=1).rename({
+        df = data.cache.read(context, "%s/projections/population/px-x-0102010000_101.csv" % data_path,
+                             lambda path: pd.read_csv(path, sep=";", encoding="latin1", skiprows=1),
+                             variant="skiprows=1").rename({
             "Kanton (-) / Bezirk (>>) / Gemeinde (......)":"canton_id",
             "Jahr":"year",
             "Staatsangehörigkeit (Kategorie)":"nationality",
@@ -65,8 +68,9 @@ def execute(context):
     else:
 
         # load csv projection data
-        df = pd.read_csv("%s/projections/population/px-x-0104020000_101.csv" % data_path, sep=";",
-                         encoding="latin1", skiprows=1).rename({
+        df = data.cache.read(context, "%s/projections/population/px-x-0104020000_101.csv" % data_path,
+                             lambda path: pd.read_csv(path, sep=";", encoding="latin1", skiprows=1),
+                             variant="skiprows=1").rename({
             "Kanton": "canton_id",
             "Staatsangehörigkeit (Kategorie)":"nationality",
             "Geschlecht": "sex",
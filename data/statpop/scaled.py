@@ -2,17 +2,95 @@ import numpy as np
 import pandas as pd
 
 import data.constants as c
-from data.statpop.multilevelipf import multilevelipf
-from data.statpop.multilevelipf.multilevelipf import FittingProblem, IPUSolver
+from data.statpop.multilevelipf import integerization, multilevelipf
+from data.statpop.multilevelipf.multilevelipf import FittingProblem, IPUSolver, RakingSolver
+
+SOLVERS = ["ipu", "raking"]
+SOLVER_NAMES = dict(ipu="IPU", raking="generalized raking")
 
 
 def configure(context):
     context.config("enable_scaling", default=False)
     context.config("scaling_year", default=c.BASE_SCALING_YEAR)
+    context.config("scaling_household_classes", default=False)
+    context.config("scaling_integerization", default="trs")
+    context.config("scaling_solver", default="ipu")
+    context.config("scaling_municipality_controls", default=False)
+    context.config("random_seed", 0)
     context.config("threads")
     context.stage("data.statpop.statpop")
     context.stage("data.statpop.projections.households")
     context.stage("data.statpop.projections.population")
+    context.stage("data.statpop.projections.municipalities")
+
+
+def scale_to_cantons(df_controls, df_canton_controls, iterations=100):
+    """
+        Scales the municipality controls such that they add up to the canton controls.
+        If the municipality controls contain attributes of the canton controls (e.g. the
+        household size), they are fitted to the canton margins of these attributes by
+        IPF while keeping the relative totals of the municipalities.
+    """
+    attributes = [column for column in df_controls.columns
+                  if column in df_canton_controls.columns and column not in ("canton_id", "weight")]
+
+    df_controls = df_controls.reset_index(drop=True)
+    keys = ["canton_id"] + attributes
+
+    canton_targets = pd.merge(df_controls[keys], df_canton_controls.groupby(keys)["weight"].sum().reset_index(),
+                              on=keys, how="left")["weight"].values
+
+    canton_totals = df_controls["canton_id"].map(df_canton_controls.groupby("canton_id")["weight"].sum()).values
+    municipality_totals = df_controls.groupby("home_municipality_id")["weight"].transform("sum").values
+    municipality_totals = municipality_totals * canton_totals / df_controls.groupby(
+        "canton_id")["weight"].transform("sum").values
+
+    for iteration in range(iterations if len(attributes) > 0 else 1):
+        df_controls["weight"] *= canton_targets / df_controls.groupby(keys)["weight"].transform("sum").values
+
+        if len(attributes) > 0:
+            df_controls["weight"] *= municipality_totals / df_controls.groupby(
+                "home_municipality_id")["weight"].transform("sum").values
+
+    return df_controls[~np.isnan(df_controls["weight"])]
+
+
+def get_municipality_controls(df_statpop, df_household_controls, df_population_controls,
+                              df_municipality_households, df_municipality_population, number_household_classes):
+    """
+        Returns the household and population controls by municipality. Without
+        municipality projections, the number of households per municipality follows
+        the current distribution in STATPOP. All controls are scaled to the canton
+        controls (see `scale_to_cantons`), such that both levels can be met together.
+    """
+    df_municipalities = df_statpop[["home_municipality_id", "canton_id"]].drop_duplicates("home_municipality_id")
+
+    if df_municipality_households is None:
+        df_households = df_statpop.drop_duplicates("household_id").groupby(
+            "home_municipality_id").size().reset_index(name="weight")
+    else:
+        df_households = df_municipality_households.rename(columns={"municipality_id": "home_municipality_id"})
+
+        if "household_size" in df_households.columns:
+            df_households["household_size_class_projection"] = np.minimum(
+                number_household_classes, df_households["household_size"]) - 1
+
+            df_households = df_households.groupby(
+                ["home_municipality_id", "household_size_class_projection"])["weight"].sum().reset_index()
+
+    df_households = pd.merge(df_municipalities, df_households, on="home_municipality_id")
+    df_households["weight"] = df_households["weight"].astype(np.float64)
+    df_households = scale_to_cantons(df_households, df_household_controls)
+
+    df_population = None
+
+    if df_municipality_population is not None:
+        df_population = df_municipality_population.rename(columns={"municipality_id": "home_municipality_id"})
+        df_population = pd.merge(df_municipalities, df_population, on="home_municipality_id")
+        df_population["weight"] = df_population["weight"].astype(np.float64)
+        df_population = scale_to_cantons(df_population, df_population_controls)
+
+    return df_households, df_population
 
 
 def execute(context):
@@ -22,7 +100,10 @@ def execute(context):
 
         scaling_year = context.config("scaling_year")
 
-        print("Scaling STATPOP to year", scaling_year, "using IPU.")
+        solver = context.config("scaling_solver")
+        assert solver in SOLVERS
+
+        print("Scaling STATPOP to year", scaling_year, "using %s." % SOLVER_NAMES[solver])
 
         processes = context.config("threads")
         df_household_controls, hh_year = context.stage("data.statpop.projections.households")
@@ -43,48 +124,93 @@ def execute(context):
         number_household_classes = len(df_household_controls["household_size_class_projection"].unique())
         df_statpop["household_size_class_projection"] = np.minimum(number_household_classes, df_statpop["household_size"]) - 1
 
+        # municipality controls are fitted together with the canton controls within each canton
+        df_municipality_households, df_municipality_population = None, None
+
+        if context.config("scaling_municipality_controls"):
+            df_municipality_households, df_municipality_population = get_municipality_controls(
+                df_statpop, df_household_controls, df_population_controls,
+                *context.stage("data.statpop.projections.municipalities"), number_household_classes)
+
+            print("Number of municipality household controls :", len(df_municipality_households))
+
+            if df_municipality_population is not None:
+                print("Number of municipality population controls :", len(df_municipality_population))
+
         # create IPU fitting problem by canton
         problems = []
         canton_ids = list(df_statpop.sort_values("canton_id")["canton_id"].unique())
 
         for canton_id in context.progress(canton_ids, label="Constructing separate IPU fitting problems by canton..."):
             # select sub df
-            df = df_statpop[df_statpop["canton_id"] == canton_id].copy()
-            df = multilevelipf.add_expansion_factor_column(df)
+            df = df_statpop[df_statpop["canton_id"] == canton_id]
 
-            # get group controls, perform checks and convert to filters
+            # get group controls and perform checks
             group_controls = [df_household_controls[df_household_controls["canton_id"] == canton_id]]
+
+            if df_municipality_households is not None:
+                group_controls.append(df_municipality_households[df_municipality_households["canton_id"] == canton_id])
+
             group_id = "household_id"
             assert multilevelipf.check_control_has_weight_column(group_controls)
-            group_controls = multilevelipf.compute_group_filters(df, group_controls)
 
-            # get individual controls, perform checks and convert to filters
+            # get individual controls and perform checks
             individual_controls = [df_population_controls[df_population_controls["canton_id"] == canton_id]]
+
+            if df_municipality_population is not None:
+                individual_controls.append(
+                    df_municipality_population[df_municipality_population["canton_id"] == canton_id])
+
             individual_id = "individual_id"
             assert multilevelipf.check_control_has_weight_column(individual_controls)
-            individual_controls = multilevelipf.compute_individual_filters(df, group_id, individual_controls)
 
-            # create fitting problem
+            # create fitting problem, which converts the controls to sparse incidence matrices by household
             problem = FittingProblem(df, group_controls, group_id, individual_controls, individual_id)
             problems.append(problem)
 
         print("Constructed %d IPU fitting problems." % len(problems))
-        print("Starting IPU.")
+        print("Starting %s." % SOLVER_NAMES[solver])
+
+        integerization_method = context.config("scaling_integerization")
+        assert integerization_method in integerization.METHODS
+
+        # Every problem is integerized with its own seed
+        random = np.random.RandomState(context.config("random_seed"))
+        random_seeds = random.randint(10000, size=len(problems))
 
         # Run IPU algorithm in parallel
         with context.progress(label="Performing IPU on STATPOP by canton...", total=len(problems)):
-            with context.parallel(processes=processes) as parallel:
-                df_households, convergence = [], []
+            with context.parallel(processes=processes, data=dict(
+                    household_classes=context.config("scaling_household_classes"),
+                    integerization_method=integerization_method, solver=solver)) as parallel:
+                df_households, info = [], {}
 
-                for df_household_item, convergence_item in parallel.imap_unordered(process, problems):
+                for canton_id, df_household_item, info_item in parallel.imap_unordered(
+                        process, zip(canton_ids, problems, random_seeds)):
                     df_households.append(df_household_item)
-                    convergence.append(convergence_item)
-
-        df_households = pd.concat(df_households)
-        print("Convergence rate:", np.round(np.mean(convergence), 3))
-
-        # Generate new unique ids
+                    info[canton_id] = info_item
+
+        df_households = pd.concat(df_households).sort_values("statpop_household_id")
+        print("Convergence rate:", np.round(np.mean([item["converged"] for item in info.values()]), 3))
+
+        for canton_id in sorted(info.keys()):
+            print("  Canton %d: %d iterations, %.2fs, WMAPE %.2e (households) %.2e (persons)" % (
+                canton_id, info[canton_id]["iterations"], info[canton_id]["time"],
+                info[canton_id]["group_wmape"], info[canton_id]["individual_wmape"]))
+
+        context.set_info("scaling_fit", {
+            "solver": solver, "cantons": {
+                int(canton_id): dict(
+                    iterations=int(item["iterations"]), time=float(item["time"]), converged=bool(item["converged"]),
+                    group_wmape=float(item["group_wmape"]), individual_wmape=float(item["individual_wmape"]))
+                for canton_id, item in sorted(info.items())
+            }
+        })
+
+        # Replicate the households and generate new unique ids
         print("Generating new household ids.")
+        df_households = pd.DataFrame({"statpop_household_id": np.repeat(
+            df_households["statpop_household_id"].values, df_households["replications"].values)})
         df_households["household_id_new"] = np.arange(df_households.shape[0]) + 1
         del df_statpop["household_id"]
 
@@ -109,48 +235,45 @@ def execute(context):
     return df_statpop
 
 
-def process(context, problem):
+def process(context, arguments):
+    canton_id, problem, random_seed = arguments
 
-    # Create the IPU solver
-    ipu_solver = IPUSolver(group_rel_tol=1e-4, group_abs_tol=1, ind_rel_tol=1e-5, ind_abs_tol=10, max_iter=2000)
+    # Create the solver, both use the same tolerances
+    if context.data("solver") == "raking":
+        solver = RakingSolver(group_rel_tol=1e-4, group_abs_tol=1, ind_rel_tol=1e-5, ind_abs_tol=10, max_iter=100)
+    else:
+        solver = IPUSolver(group_rel_tol=1e-4, group_abs_tol=1, ind_rel_tol=1e-5, ind_abs_tol=10, max_iter=2000)
 
     # Fit the problem, which results a df with expansion factors and whether the algorithm converged
-    df_result, convergence = ipu_solver.fit(problem)
-
-    df_households = []
-    # Integerize the results using the "Truncate-Replicate-Sample" method
-    # We loop through the groups here to get a better fit by household size
-    # because we know they are mutually exclusive (but this is not general)
-    for i, group_control in enumerate(problem.group_controls):
-        group_weight = group_control[0]
-        group_filter = group_control[1]
-
-        # 1) Truncate - here we compute both the integer part (count) and remainder of the weight for each household
-        df_hh_group = (df_result[group_filter][["household_id", "statpop_household_id", "expansion_factor"]]
-                       .drop_duplicates("household_id"))
-        weights = df_hh_group["expansion_factor"].values
-        counts = np.floor(weights).astype(np.int)
-        remainders = weights - counts
-
-        # 2) Replicate - We duplicate the households based on the count
-        indices = np.repeat(list(df_hh_group.index), counts)
-        df_replicate = df_hh_group.loc[indices]
-
-        # 3) Sample - We sample the required remaining households based on the remainders without replacement
-        indices = np.random.choice(list(df_hh_group.index), int(np.round(np.sum(weights) - np.sum(counts))),
-                                   replace=False, p=(remainders / np.sum(remainders)))
-        df_sample = df_hh_group.loc[indices]
-
-        # We combine the replicated and sampled households
-        df = pd.concat([df_replicate, df_sample])
-
-        # We add them to our list by group
-        df_households.append(df)
-
-    df_households = pd.concat(df_households).drop("expansion_factor", axis=1)
-    df_households["household_id"] = np.arange(df_households.shape[0]) + 1
+    if context.data("household_classes"):
+        # Households with the same control signature are fitted as one class and obtain its expansion factor
+        class_problem, classes = problem.aggregate()
+        df_classes, convergence = solver.fit(class_problem)
+
+        df_result = problem.df.copy()
+        df_result["expansion_factor"] = df_classes["expansion_factor"].values[classes]
+    else:
+        df_result, convergence = solver.fit(problem)
+
+    # Integerize the results into a number of replications per household
+    # We loop through the cells of group controls (household size, and municipality
+    # if given) here to get a better fit, the cells are mutually exclusive
+    random = np.random.RandomState(random_seed)
+    replications = np.zeros((len(df_result),), dtype=int)
+
+    cells = problem.get_group_cells()
+    order = np.argsort(cells, kind="stable")
+    order = order[cells[order] >= 0]
+
+    for indices in np.split(order, np.flatnonzero(np.diff(cells[order])) + 1):
+        weights = df_result["expansion_factor"].values[indices]
+        replications[indices] = integerization.integerize(weights, context.data("integerization_method"), random)
 
     context.progress.update()
 
-    # return only duplicated households with new and original ids
-    return df_households, convergence
+    # return only the original ids with their number of replications
+    df_households = pd.DataFrame({
+        "statpop_household_id": df_result["statpop_household_id"].values, "replications": replications
+    })
+
+    return canton_id, df_households[df_households["replications"] > 0], solver.info
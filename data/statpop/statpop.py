@@ -1,45 +1,58 @@
 import numpy as np
 import pandas as pd
 
+import data.cache
+import data.codebook
 import data.constants as c
 import data.spatial.cantons
-import data.spatial.municipalities
-import data.spatial.municipality_types
+import data.spatial.hierarchy
 import data.spatial.ovgk
+import data.spatial.raster
 import data.spatial.utils
-import data.spatial.zones
 import data.statpop.density
 import data.statpop.head_of_household
-import data.utils
+import data.statpop.households
+import data.statpop.link
+import data.statpop.persons
 import data.utils
 
 
 def configure(context):
+    context.config("data_path")
+    context.config("threads")
+    data.cache.configure(context)
+    data.spatial.raster.configure(context)
+    context.stage("data.spatial.hierarchy")
     context.stage("data.statpop.persons")
-    context.stage("data.statpop.households")
-    context.stage("data.statpop.link")
-    context.stage("data.spatial.municipalities")
-    context.stage("data.spatial.quarters")
-    context.stage("data.spatial.zones")
-    context.stage("data.spatial.municipality_types")
     context.stage("data.statpop.density")
-    context.stage("data.spatial.cantons")
     context.stage("data.spatial.ovgk")
 
 
 def execute(context):
+    # All persons are parsed once by their stage, which is shared with the population density
     df_persons = context.stage("data.statpop.persons")
-    df_households = context.stage("data.statpop.households")
-    df_link = context.stage("data.statpop.link")
-
-    # Filter non-main residence
-    df_persons = df_persons[df_persons["type_of_residence"] == 1]
-
-    # Only allow people with a building ID
-    df_persons = df_persons[df_persons["federal_building_id"] < 999990000]
 
-    # Only allow permanent residents
-    df_persons = df_persons[df_persons["population_type"] == 1]
+    df_persons = df_persons[
+        # Filter non-main residence
+        (df_persons["type_of_residence"] == 1) &
+        # Only allow people with a building ID
+        (df_persons["federal_building_id"] < 999990000) &
+        # Only allow permanent residents
+        (df_persons["population_type"] == 1)
+    ]
+
+    # The filters are applied while reading the link and household files, such that rejected rows
+    # are never materialized. They are only kept if they match a remaining person. The filter
+    # variants identify the ids that are kept in the raw cache.
+    person_ids = df_persons["person_id"].unique()
+    df_link = data.statpop.link.read(context, filter=lambda df: df["person_id"].isin(person_ids),
+                                     filter_variant=("person_ids", data.cache.hash_values(person_ids)))
+
+    household_ids = df_link["household_id"].unique()
+    df_households = data.statpop.households.read(context, filter=lambda df: (
+        # Only allow plausible households
+        (df["plausible"] == 1) & df["household_id"].isin(household_ids)
+    ), filter_variant=("plausible", data.cache.hash_values(household_ids)))
 
     # Merge STATPOP persons and households into a list of persons with houeshold attributes
     df = pd.merge(df_persons, df_link, on=("person_id", "municipality_id"))
@@ -49,9 +62,6 @@ def execute(context):
     df_size = df.groupby("household_id").size().reset_index(name="household_size")
     df = pd.merge(df, df_size, on="household_id")
 
-    # Only allow plausible households
-    df = df[df["plausible"] == 1]
-
     # Only allow houesholds under a certian size
     df = df[df["household_size"] <= c.MAXIMUM_HOUSEHOLD_SIZE]
 
@@ -63,16 +73,7 @@ def execute(context):
     df = df[~df["all_under_age"]]
 
     # This mapping comes from KM
-    for from_value, to_value in zip((1, 2, 3, 4, 5, 6, 7, -9), (
-            c.MARITAL_STATUS_SINGLE, c.MARITAL_STATUS_MARRIED,
-            c.MARITAL_STATUS_SEPARATE, c.MARITAL_STATUS_SEPARATE,
-            c.MARITAL_STATUS_SINGLE, c.MARITAL_STATUS_MARRIED,
-            c.MARITAL_STATUS_SEPARATE, c.MARITAL_STATUS_SINGLE
-    )):
-        df.loc[df["marital_status"] == from_value, "marital_status_new"] = to_value
-
-    df["marital_status"] = df["marital_status_new"]
-    del df["marital_status_new"]
+    df["marital_status"] = data.codebook.recode(df["marital_status"], data.codebook.STATPOP_MARITAL_STATUS)
 
     # Some adjustments from KM
     data.utils.fix_marital_status(df)
@@ -85,45 +86,24 @@ def execute(context):
     # Get the age class
     df["age_class"] = np.digitize(df["age"], c.AGE_CLASS_UPPER_BOUNDS)
 
-    # Impute spatial information
-    df_municipalities = context.stage("data.spatial.municipalities")[0]
-    df_zones = context.stage("data.spatial.zones")
-    df_municipality_types = context.stage("data.spatial.municipality_types")
-    df_quarters = context.stage("data.spatial.quarters")
-    df_cantons = context.stage("data.spatial.cantons")
+    # Impute spatial information: only the finest unit (quarter or municipality) is found
+    # spatially, canton, municipality type and zone follow from the zone hierarchy
+    df_hierarchy = context.stage("data.spatial.hierarchy")
 
-    df_spatial = pd.DataFrame(df[["person_id", "home_x", "home_y"]])
-    df_spatial = data.spatial.utils.to_gpd(context, df_spatial, "home_x", "home_y", coord_type="home")
+    # All spatial imputations run once per unique home location
+    x, y, inverse = data.spatial.utils.deduplicate(df["home_x"].values, df["home_y"].values)
+    df_locations = pd.DataFrame({"location_index": np.arange(len(x)), "x": x, "y": y})
 
-    # Impute municipalities
-    df_spatial = (data.spatial.utils.impute(context, df_spatial, df_municipalities, "person_id", "municipality_id",
-                                            zone_type="municipality", point_type="home")[
-        ["person_id", "municipality_id", "geometry"]])
-    df_spatial["municipality_id"] = df_spatial["municipality_id"].astype(np.int)
+    indices = data.spatial.hierarchy.locate(context, df_hierarchy, x, y, point_type="home")[inverse]
 
-    # Impute quarters
-    df_spatial = (data.spatial.utils.impute(context, df_spatial, df_quarters, "person_id", "quarter_id",
-                                            fix_by_distance=False, zone_type="quarter", point_type="home")[
-        ["person_id", "municipality_id", "quarter_id", "geometry"]])
-
-    # Impute cantons
-    df_spatial = (data.spatial.utils.impute(context, df_spatial, df_cantons, "person_id", "canton_id",
-                                            zone_type="canton", point_type="home")[
-        ["person_id", "municipality_id", "quarter_id", "canton_id", "geometry"]])
-
-    # Impute municipality types
-    df_spatial = data.spatial.municipality_types.impute(df_spatial, df_municipality_types)
-
-    # Impute zones
-    df_spatial = data.spatial.zones.impute(df_spatial, df_zones)
-
-    assert (len(df) == len(df_spatial))
+    df_spatial = data.spatial.hierarchy.get(df_hierarchy, indices, [
+        "zone_id", "municipality_type", "municipality_id", "quarter_id", "canton_id"])
 
     del df["municipality_id"]
-    df = pd.merge(
-        df, df_spatial[["person_id", "zone_id", "municipality_type", "municipality_id", "quarter_id", "canton_id"]],
-        on="person_id"
-    )
+    df = df.reset_index(drop=True)
+
+    for column in df_spatial.columns:
+        df[column] = df_spatial[column].values
 
     df["home_zone_id"] = df["zone_id"]
     df["home_municipality_id"] = df["municipality_id"]
@@ -133,13 +113,14 @@ def execute(context):
     df = data.spatial.cantons.impute_sp_region(df)
 
     # Impute population density
-    data.statpop.density.impute(context.stage("data.statpop.density"), df, "home_x", "home_y")
+    data.statpop.density.impute(context.stage("data.statpop.density"), df_locations, "x", "y")
+    df["population_density"] = df_locations["population_density"].values[inverse]
 
     # Impute OV Guteklasse
     print("Imputing ÖV Güteklasse ...")
     df_ovgk = context.stage("data.spatial.ovgk")
-    df_spatial = data.spatial.ovgk.impute(context, df_ovgk, df_spatial, ["person_id"])
-    df = pd.merge(df, df_spatial[["person_id", "ovgk"]], on=["person_id"], how="left")
+    df_spatial = data.spatial.ovgk.impute(context, df_ovgk, df_locations, ["location_index"], x="x", y="y")
+    df["ovgk"] = df_spatial["ovgk"].values[inverse]
 
     # Save original statpop person and household ids
     df["statpop_person_id"] = df["person_id"].astype(int)
@@ -158,4 +139,4 @@ def execute(context):
 
     df = data.statpop.head_of_household.impute(df)
 
-    return df
+    return data.utils.apply_dtype_policy(df)
@@ -1,48 +1,64 @@
+import lzma as xz
+
 import pandas as pd
 
+import data.cache
+import data.utils
+
+FILES = [
+    ("structural_survey/se_zpers_2012_CH.csv.xz", "WEIGHT2012", 286016, ","),
+    ("structural_survey/se_zpers_2011_CH.csv.xz", "WEIGHT2011", 282750, ";"),
+    ("structural_survey/se_zpers_2010_CH.csv.xz", "WEIGHT2010", 317222, ","),
+]
+
 
 def configure(context):
     context.config("data_path")
+    context.config("threads")
+    data.cache.configure(context)
+
+
+def get_fields(weight_column):
+    fields = {
+        "RES_MUN": int,
+        "RES_QUARTER": int,
+        "COMPANY_MUN": int,
+        "COMPANY_QUARTER": int,
+        "COMPANY_CTRY": int,
+        "MAINMODETRANSPWORK": int,
+        weight_column: float,
+        "SCHOOL_MUN": int,
+        "SCHOOL_QUARTER": int
+    }
+
+    renames = {
+        "RES_MUN": "home_municipality",
+        "RES_QUARTER": "home_quarter",
+        "COMPANY_MUN": "work_municipality",
+        "COMPANY_QUARTER": "work_quarter",
+        "COMPANY_CTRY": "work_country",
+        "MAINMODETRANSPWORK": "mode",
+        weight_column: "weight",
+        "SCHOOL_MUN": "education_municipality",
+        "SCHOOL_QUARTER": "education_quarter"
+    }
+
+    return fields, renames
 
 
 def execute(context):
     data_path = context.config("data_path")
 
-    import lzma as xz
-    import data.utils
-
-    data_frames = []
-
-    for path, weight_column, total, sep in [
-        ("%s/structural_survey/se_zpers_2012_CH.csv.xz" % data_path, "WEIGHT2012", 286016, ","),
-        ("%s/structural_survey/se_zpers_2011_CH.csv.xz" % data_path, "WEIGHT2011", 282750, ";"),
-        ("%s/structural_survey/se_zpers_2010_CH.csv.xz" % data_path, "WEIGHT2010", 317222, ","),
-    ]:
-        with xz.open(path) as f:
-            fields = {
-                "RES_MUN": int,
-                "RES_QUARTER": int,
-                "COMPANY_MUN": int,
-                "COMPANY_QUARTER": int,
-                "COMPANY_CTRY": int,
-                "MAINMODETRANSPWORK": int,
-                weight_column: float,
-                "SCHOOL_MUN": int,
-                "SCHOOL_QUARTER": int
-            }
-
-            renames = {
-                "RES_MUN": "home_municipality",
-                "RES_QUARTER": "home_quarter",
-                "COMPANY_MUN": "work_municipality",
-                "COMPANY_QUARTER": "work_quarter",
-                "COMPANY_CTRY": "work_country",
-                "MAINMODETRANSPWORK": "mode",
-                weight_column: "weight",
-                "SCHOOL_MUN": "education_municipality",
-                "SCHOOL_QUARTER": "education_quarter"
-            }
-
-            data_frames.append(data.utils.read_csv(context, f, fields, renames, total=total, sep=sep))
+    def read_file(item):
+        path, weight_column, total, sep = item
+        fields, renames = get_fields(weight_column)
+
+        def read(path):
+            with xz.open(path) as f:
+                return data.utils.read_csv(context, f, fields, renames, total=total, sep=sep)
+
+        return data.cache.read(context, "%s/%s" % (data_path, path), read, variant=(fields, renames, sep))
+
+    data_frames = list(data.utils.prefetch(context, read_file, FILES))
 
     return pd.concat(data_frames, sort=True)
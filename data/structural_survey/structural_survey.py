@@ -1,7 +1,9 @@
 import numpy as np
 
+import data.codebook
 import data.spatial.countries
 import data.spatial.countries
+import data.spatial.hierarchy
 import data.spatial.municipalities
 import data.spatial.municipalities
 import data.spatial.quarters
@@ -10,6 +12,7 @@ import data.spatial.utils
 import data.spatial.utils
 import data.spatial.zones
 import data.spatial.zones
+import data.utils
 
 
 def configure(context):
@@ -20,6 +23,7 @@ def configure(context):
     context.stage("data.spatial.countries")
     context.stage("data.spatial.municipalities")
     context.stage("data.spatial.quarters")
+    context.stage("data.spatial.hierarchy")
 
 
 def execute(context):
@@ -29,23 +33,17 @@ def execute(context):
     df_countries = context.stage("data.spatial.countries")
     df_municipalities, df_municipality_mapping = context.stage("data.spatial.municipalities")
     df_quarters = context.stage("data.spatial.quarters")
+    df_hierarchy = context.stage("data.spatial.hierarchy")
+
+    # Locations in municipalities and quarters without observations are sampled in their shapes
+    municipality_sampler = data.spatial.utils.PolygonSampler(df_municipalities["geometry"].values)
+    municipality_lookup = data.utils.DenseLookup(df_municipalities["municipality_id"].values)
+
+    quarter_sampler = data.spatial.utils.PolygonSampler(df_quarters["geometry"].values)
+    quarter_lookup = data.utils.DenseLookup(df_quarters["quarter_id"].values)
 
     # Find the correct modes
-    df_se.loc[:, "mode_numeric"] = df_se.loc[:, "mode"].astype(np.int)
-    df_se.loc[df_se["mode_numeric"] == -10, "mode"] = "unknown"
-    df_se.loc[df_se["mode_numeric"] == -9, "mode"] = "unknown"
-    df_se.loc[df_se["mode_numeric"] == -8, "mode"] = "unknown"
-    df_se.loc[df_se["mode_numeric"] == 1, "mode"] = "walk"  # walking
-    df_se.loc[df_se["mode_numeric"] == 2, "mode"] = "walk"  # skateboard
-    df_se.loc[df_se["mode_numeric"] == 3, "mode"] = "bike"  # bike / elec. bike
-    df_se.loc[df_se["mode_numeric"] == 4, "mode"] = "car"  # Mofa / Moped / light motor bike
-    df_se.loc[df_se["mode_numeric"] == 5, "mode"] = "car"  # Car as driver or passenger
-    df_se.loc[df_se["mode_numeric"] == 6, "mode"] = "car"  # company bus
-    df_se.loc[df_se["mode_numeric"] == 7, "mode"] = "pt"  # Train
-    df_se.loc[df_se["mode_numeric"] == 8, "mode"] = "pt"  # Tram / Metro
-    df_se.loc[df_se["mode_numeric"] == 9, "mode"] = "pt"  # Bus
-    df_se.loc[df_se["mode_numeric"] == 10, "mode"] = "other"  # Ship, cable car, ...
-    del df_se["mode_numeric"]
+    df_se["mode"] = data.codebook.recode(df_se["mode"], data.codebook.SE_MODE, data.codebook.SE_MODE_CATEGORIES)
 
     # Impute the home zone
     df_se.loc[:, "municipality_id"] = df_se["home_municipality"]
@@ -98,7 +96,7 @@ def execute(context):
 
     # Assign coordinates in the home municipalities
 
-    se_municipality_ids = np.unique(df_se["home_municipality_id"].dropna()).astype(np.int)
+    se_municipality_ids = np.unique(df_se["home_municipality_id"].dropna()).astype(int)
     for municipality_id in context.progress(se_municipality_ids,
                                             label="Imputing home locations by municipality from STATPOP"):
         indices = np.where(df_statpop["home_municipality_id"] == municipality_id)[0]
@@ -113,18 +111,15 @@ def execute(context):
         df_se[np.isnan(df_se["home_municipality_x"])]["home_municipality_id"].dropna())
     print("A number of %d municipalities could not be assigned from STATPOP" % len(unassigned_municipality_ids))
 
-    for municipality_id in context.progress(unassigned_municipality_ids,
-                                            label="Sampling home locations for municipalities"):
-        f = np.isnan(df_se["home_municipality_x"]) & (df_se["home_municipality_id"] == municipality_id)
-        row = df_municipalities[df_municipalities["municipality_id"] == municipality_id].iloc[0]
-        coordinates = data.spatial.utils.sample_coordinates(row, np.count_nonzero(f))
-        df_se.loc[f, "home_municipality_x"], df_se.loc[f, "home_municipality_y"] = coordinates[:, 0], coordinates[:, 1]
+    f = np.isnan(df_se["home_municipality_x"]) & ~np.isnan(df_se["home_municipality_id"])
+    coordinates = municipality_sampler.sample(municipality_lookup(df_se.loc[f, "home_municipality_id"].values))
+    df_se.loc[f, "home_municipality_x"], df_se.loc[f, "home_municipality_y"] = coordinates[:, 0], coordinates[:, 1]
 
     assert (~np.any(np.isnan(df_se["home_municipality_x"])))
 
     # Assign coordinates in the home quarters
 
-    se_quarter_ids = np.unique(df_se["home_quarter_id"].dropna()).astype(np.int)
+    se_quarter_ids = np.unique(df_se["home_quarter_id"].dropna()).astype(int)
     for quarter_id in context.progress(se_quarter_ids, label="Imputing home locations by quarter from STATPOP"):
         indices = np.where(df_statpop["home_quarter_id"] == quarter_id)[0]
 
@@ -137,11 +132,9 @@ def execute(context):
     unassigned_quarter_ids = np.unique(df_se[np.isnan(df_se["home_quarter_x"])]["home_quarter_id"].dropna())
     print("A number of %d quarters could not be assigned from STATPOP" % len(unassigned_quarter_ids))
 
-    for quarter_id in context.progress(unassigned_quarter_ids, label="Sampling home locations for municipalities"):
-        f = np.isnan(df_se["home_quarter_x"]) & (df_se["home_quarter_id"] == quarter_id)
-        row = df_quarters[df_quarters["quarter_id"] == quarter_id].iloc[0]
-        coordinates = data.spatial.utils.sample_coordinates(row, np.count_nonzero(f))
-        df_se.loc[f, "home_quarter_x"], df_se.loc[f, "home_quarter_y"] = coordinates[:, 0], coordinates[:, 1]
+    f = np.isnan(df_se["home_quarter_x"]) & ~np.isnan(df_se["home_quarter_id"])
+    coordinates = quarter_sampler.sample(quarter_lookup(df_se.loc[f, "home_quarter_id"].values))
+    df_se.loc[f, "home_quarter_x"], df_se.loc[f, "home_quarter_y"] = coordinates[:, 0], coordinates[:, 1]
 
     quarter_count = np.count_nonzero(~np.isnan(df_se["home_quarter_x"]))
     municipality_count = np.count_nonzero(~np.isnan(df_se["home_municipality_x"]))
@@ -171,7 +164,7 @@ def execute(context):
 
     # Assign coordinates in the work municipalities
 
-    se_municipality_ids = np.unique(df_se["work_municipality_id"].dropna()).astype(np.int)
+    se_municipality_ids = np.unique(df_se["work_municipality_id"].dropna()).astype(int)
     for municipality_id in context.progress(se_municipality_ids,
                                             label="Imputing work locations by municipality from STATENT"):
         indices = np.where(df_statent["municipality_id"] == municipality_id)[0]
@@ -186,16 +179,13 @@ def execute(context):
         df_se[np.isnan(df_se["work_municipality_x"])]["work_municipality_id"].dropna())
     print("A number of %d municipalities could not be assigned from STATENT" % len(unassigned_municipality_ids))
 
-    for municipality_id in context.progress(unassigned_municipality_ids,
-                                            label="Sampling work locations for municipalities"):
-        f = np.isnan(df_se["work_municipality_x"]) & (df_se["work_municipality_id"] == municipality_id)
-        row = df_municipalities[df_municipalities["municipality_id"] == municipality_id].iloc[0]
-        coordinates = data.spatial.utils.sample_coordinates(row, np.count_nonzero(f))
-        df_se.loc[f, "work_municipality_x"], df_se.loc[f, "work_municipality_y"] = coordinates[:, 0], coordinates[:, 1]
+    f = np.isnan(df_se["work_municipality_x"]) & ~np.isnan(df_se["work_municipality_id"])
+    coordinates = municipality_sampler.sample(municipality_lookup(df_se.loc[f, "work_municipality_id"].values))
+    df_se.loc[f, "work_municipality_x"], df_se.loc[f, "work_municipality_y"] = coordinates[:, 0], coordinates[:, 1]
 
     # Assign coordinates in the work quarters
 
-    se_quarter_ids = np.unique(df_se["work_quarter_id"].dropna()).astype(np.int)
+    se_quarter_ids = np.unique(df_se["work_quarter_id"].dropna()).astype(int)
     for quarter_id in context.progress(se_quarter_ids, label="Imputing work locations by quarter from STATENT"):
         indices = np.where(df_statent["quarter_id"] == quarter_id)[0]
 
@@ -208,11 +198,9 @@ def execute(context):
     unassigned_quarter_ids = np.unique(df_se[np.isnan(df_se["work_quarter_x"])]["work_quarter_id"].dropna())
     print("A number of %d quarters could not be assigned from STATENT" % len(unassigned_quarter_ids))
 
-    for quarter_id in context.progress(unassigned_quarter_ids, label="Sampling work locations for municipalities"):
-        f = np.isnan(df_se["work_quarter_x"]) & (df_se["work_quarter_id"] == quarter_id)
-        row = df_quarters[df_quarters["quarter_id"] == quarter_id].iloc[0]
-        coordinates = data.spatial.utils.sample_coordinates(row, np.count_nonzero(f))
-        df_se.loc[f, "work_quarter_x"], df_se.loc[f, "work_quarter_y"] = coordinates[:, 0], coordinates[:, 1]
+    f = np.isnan(df_se["work_quarter_x"]) & ~np.isnan(df_se["work_quarter_id"])
+    coordinates = quarter_sampler.sample(quarter_lookup(df_se.loc[f, "work_quarter_id"].values))
+    df_se.loc[f, "work_quarter_x"], df_se.loc[f, "work_quarter_y"] = coordinates[:, 0], coordinates[:, 1]
 
     quarter_count = np.count_nonzero(~np.isnan(df_se["work_quarter_x"]))
     municipality_count = np.count_nonzero(~np.isnan(df_se["work_municipality_x"]))
@@ -234,12 +222,25 @@ def execute(context):
 
     # Now that all the coordinates are available, a zone can be assigned
     print("Imputing home zones ...")
-    df_se = data.spatial.zones.impute(df_se, df_zones, zone_id_prefix="home_",
-                                      municipality_id_field="home_municipality_id", quarter_id_field="home_quarter_id")
+    df_se = df_se.reset_index(drop=True)
+
+    indices = data.spatial.hierarchy.join(df_hierarchy, df_se["home_municipality_id"], df_se["home_quarter_id"])
+    df_spatial = data.spatial.hierarchy.get(df_hierarchy, indices, ["zone_id", "zone_level"])
+    df_se["home_zone_id"] = df_spatial["zone_id"].values
+    df_se["home_zone_level"] = df_spatial["zone_level"].values
 
     print("Imputing work zones ...")
-    df_se = data.spatial.zones.impute(df_se, df_zones, zone_id_prefix="work_", country_id_field="work_country_id",
-                                      municipality_id_field="work_municipality_id", quarter_id_field="work_quarter_id")
+    indices = data.spatial.hierarchy.join(df_hierarchy, df_se["work_municipality_id"], df_se["work_quarter_id"])
+    df_spatial = data.spatial.hierarchy.get(df_hierarchy, indices, ["zone_id", "zone_level"])
+    df_se["work_zone_id"] = df_spatial["zone_id"].values
+    df_se["work_zone_level"] = df_spatial["zone_level"].values
+
+    # Work places abroad obtain the zone of the country
+    zone_ids = data.spatial.zones.get_resolver(df_zones).resolve("country", df_se["work_country_id"].values)
+
+    f = (indices < 0) & (zone_ids >= 0)
+    df_se.loc[f, "work_zone_id"] = zone_ids[f]
+    df_se.loc[f, "work_zone_level"] = "country"
 
     return df_se[[
         "home_municipality_id", "home_quarter_id", "home_zone_id", "home_zone_level",
@@ -1,3 +1,7 @@
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 
@@ -9,7 +13,7 @@ def fix_marital_status(df):
     df.loc[
         (df["marital_status"] == c.MARITAL_STATUS_SEPARATE) & (df["age"] < c.SEPARATE_SINGLE_THRESHOLD)
         , "marital_status"] = c.MARITAL_STATUS_SINGLE
-    df.loc[:, "marital_status"] = df.loc[:, "marital_status"].astype(np.int)
+    df.loc[:, "marital_status"] = df.loc[:, "marital_status"].astype(int)
 
 
 def assign_household_class(df):
@@ -23,33 +27,265 @@ def assign_household_class(df):
     df["household_size_class"] = np.minimum(5, df["household_size"]) - 1
 
 
-def read_csv(context, fp, fields, renames=None, sep=";", total=None, encoding="latin1", limit=None):
+def enforce_categories(df):
+    """
+        Converts all string-valued columns with a fixed category set (c.CATEGORIES) into
+        categoricals with exactly these categories.
+
+        This is applied at stage boundaries, such that merges and concatenations of
+        stage outputs keep the categorical type. Values outside of the category set
+        are considered an error, the sets in data.constants must be complete.
+    """
+    for column, categories in c.CATEGORIES.items():
+        if column in df.columns:
+            values = df[column]
+            unknown = ~values.isna() & ~values.isin(categories)
+
+            if np.any(unknown):
+                raise RuntimeError("Unknown values for %s: %s" % (column, set(values[unknown])))
+
+            df[column] = values.astype(pd.CategoricalDtype(categories))
+
+    return df
+
+
+def apply_dtype_policy(df):
+    """
+        Downcasts the numeric columns of a stage output according to c.DTYPE_POLICY.
+
+        Ids without missing values become int32 and times become int32 seconds if they
+        are integral, otherwise float32. Columns whose values do not fit into the
+        compact types keep their type.
+    """
+    int32 = np.iinfo(np.int32)
+
+    for column, kind in c.DTYPE_POLICY.items():
+        if column not in df.columns or len(df) == 0:
+            continue
+
+        values = df[column]
+
+        if values.dtype.kind not in "iuf":
+            continue
+
+        f_missing = values.isna()
+
+        if kind == "time":
+            if not np.all(np.abs(values[~f_missing]) < 2 ** 24):
+                print("Keeping %s as %s, the values do not fit into 32 bit" % (column, values.dtype))
+
+            elif not np.any(f_missing) and np.all(np.mod(values, 1.0) == 0.0):
+                df[column] = values.astype(np.int32)
+
+            else:
+                df[column] = values.astype(np.float32)
+
+        elif kind == "id" and not np.any(f_missing):
+            if values.min() >= int32.min and values.max() <= int32.max:
+                df[column] = values.astype(np.int32)
+            else:
+                print("Keeping %s as %s, the values do not fit into int32" % (column, values.dtype))
+
+    return df
+
+
+# Types that are understood by the read_csv field specification and the
+# corresponding column types that pandas parses them into directly.
+CSV_DTYPES = {
+    int: np.int64,
+    float: np.float64,
+    str: object,
+}
+
+
+def read_csv(context, fp, fields, renames=None, sep=";", total=None, encoding="latin1", limit=None,
+             chunk_size=500000, filter=None):
+    """
+        Reads the given fields from a CSV file handle (for instance an open xz file).
+
+        Only the columns in `fields` are parsed. Fields with type int, float or str, or
+        with a NumPy scalar type (e.g. np.int16), are parsed directly into typed columns,
+        any other callable is applied as a converter on the respective column. The file
+        is streamed in chunks of `chunk_size` lines such that progress can be reported
+        against `total` (number of lines including the header).
+
+        If `filter` is given, it is called with every chunk (with renamed columns) and must
+        return a boolean mask of the rows to keep. Rejected rows are dropped right away and
+        never end up in the full data frame.
+    """
     if renames is None:
         renames = {}
-    header = None
-    data = []
 
-    count = 0
+    dtypes, converters = {}, {}
 
-    for line in context.progress(fp, total=total):
-        line = line.decode(encoding).strip().split(sep)
-
-        if header is None:
-            header = line
+    for field_name, field_function in fields.items():
+        if field_function in CSV_DTYPES:
+            dtypes[field_name] = CSV_DTYPES[field_function]
+        elif isinstance(field_function, type) and issubclass(field_function, np.generic):
+            dtypes[field_name] = field_function
         else:
-            data.append([
-                field_function(line[header.index(field_name)])
-                for field_name, field_function in fields.items()
-            ])
+            converters[field_name] = field_function
+
+    reader = pd.read_csv(
+        fp, sep=sep, encoding=encoding, usecols=list(fields.keys()),
+        dtype=dtypes, converters=converters, chunksize=chunk_size,
+        nrows=None if limit is None else max(0, limit - 1)
+    )
+
+    columns = [renames[field_name] if field_name in renames else field_name for field_name in fields.keys()]
+    chunks = []
+
+    with context.progress(total=total) as progress:
+        progress.update()  # Header
+
+        for chunk in reader:
+            progress.update(len(chunk))
+
+            chunk = chunk[list(fields.keys())]
+            chunk.columns = columns
+
+            if filter is not None:
+                chunk = chunk[filter(chunk)]
+
+            chunks.append(chunk)
+
+    if len(chunks) == 0:
+        df = pd.DataFrame({
+            column: pd.Series(dtype=dtypes.get(field_name, object)) for field_name, column in zip(fields, columns)
+        })
+    else:
+        df = pd.concat(chunks, ignore_index=True)
+
+    return df
+
+
+def prefetch(context, function, arguments):
+    """
+        Applies `function` to each element of `arguments` and yields the results in the
+        order of `arguments`.
+
+        All calls are started right away in a pool of at most `threads` threads, such
+        that independent files of a stage are read concurrently. Decompression and
+        parsing release the GIL for large parts, so the wall time is bound by the
+        largest file rather than by the sum. Stages using this need to declare the
+        `threads` config option.
+    """
+    arguments = list(arguments)
+    workers = max(1, min(len(arguments), context.config("threads")))
+
+    if workers == 1:
+        for argument in arguments:
+            yield function(argument)
+
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(function, argument) for argument in arguments]
+
+        for future in futures:
+            yield future.result()
+
+
+class DenseLookup:
+    """
+        Maps non-negative integer keys (for instance municipality or quarter ids) to
+        their positions through a dense array, such that key joins become array
+        indexing instead of merges.
+    """
+
+    def __init__(self, keys):
+        keys = np.asarray(keys, dtype=float)
+        assert len(keys) == 0 or (np.all(keys >= 0) and np.all(keys == np.floor(keys)))
+
+        keys = keys.astype(np.int64)
+        assert len(np.unique(keys)) == len(keys)
+
+        self.table = np.full((keys.max() + 1 if len(keys) > 0 else 0,), -1, dtype=np.int64)
+        self.table[keys] = np.arange(len(keys))
+
+    def __call__(self, values):
+        """ Returns the position of every value, -1 for missing or unknown values. """
+        values = np.asarray(values, dtype=float)
+
+        with np.errstate(invalid="ignore"):
+            f = (values >= 0) & (values < len(self.table))
+
+        positions = np.full((len(values),), -1, dtype=np.int64)
+        positions[f] = self.table[values[f].astype(np.int64)]
+
+        return positions
+
+
+class DenseMapping:
+    """
+        Maps non-negative integer ids (for instance deprecated municipality ids) to new
+        ids through a dense array. Chains of mappings (a -> b -> c) are resolved once on
+        construction, such that every id maps to its final id directly. If an id is
+        mapped more than once, the first mapping is used.
+    """
+
+    def __init__(self, source_ids, target_ids):
+        source_ids = np.asarray(source_ids, dtype=float)
+        target_ids = np.asarray(target_ids, dtype=float)
+
+        f = ~np.isnan(source_ids)
+        source_ids, indices = np.unique(source_ids[f], return_index=True)
+        target_ids = target_ids[f][indices]
+
+        self.lookup = DenseLookup(source_ids)
+
+        for _ in range(len(target_ids)):
+            positions = self.lookup(target_ids)
+            resolved_ids = np.where(positions >= 0, target_ids[np.maximum(positions, 0)], target_ids)
+
+            if np.all((resolved_ids == target_ids) | (np.isnan(resolved_ids) & np.isnan(target_ids))):
+                break
+
+            target_ids = resolved_ids
+
+        self.target_ids = target_ids
+
+    def __call__(self, values):
+        """ Returns the new id for every value as float, NaN for missing or unknown values. """
+        positions = self.lookup(values)
+        return np.where(positions >= 0, self.target_ids[np.maximum(positions, 0)], np.nan)
+
+
+class FrameCache:
+    """
+        Caches values derived from data frames, for instance lookups built from their
+        columns. Entries belong to the data frame object and are dropped when it is
+        garbage collected. Data frames are not hashable, so the entries are indexed by
+        id() and hold a weak reference to their data frame.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def _remove(self, identifier, reference):
+        entry = self.entries.get(identifier)
+
+        if entry is not None and entry[0] is reference:
+            del self.entries[identifier]
+
+    def get(self, df, key, factory):
+        """ Returns the value cached for `df` and `key`, calling `factory` if there is none. """
+        entry = self.entries.get(id(df))
+
+        if entry is None or entry[0]() is not df:
+            entry = (weakref.ref(df, functools.partial(self._remove, id(df))), {})
+            self.entries[id(df)] = entry
+
+        if key not in entry[1]:
+            entry[1][key] = factory()
+
+        return entry[1][key]
 
-        count += 1
 
-        if limit is not None and count == limit:
-            break
+_mappings = FrameCache()
 
-    columns = [
-        renames[field_name] if field_name in renames else field_name
-        for field_name in fields.keys()
-    ]
 
-    return pd.DataFrame.from_records(data, columns=columns)
+def get_mapping(df, source_field, target_field):
+    """ Returns the DenseMapping for two columns of `df`, it is only built once per data frame. """
+    return _mappings.get(df, (source_field, target_field),
+                         lambda: DenseMapping(df[source_field].values, df[target_field].values))
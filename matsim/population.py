@@ -4,6 +4,7 @@ import io
 import numpy as np
 import pandas as pd
 
+import data.utils
 import matsim.writers
 
 
@@ -140,7 +141,7 @@ def execute(context):
     df_activities = df_activities.sort_values(by=["person_id", "activity_index"])
 
     df_persons = df_persons[PERSON_FIELDS]
-    df_activities = df_activities[ACTIVITY_FIELDS]
+    df_activities = data.utils.enforce_categories(df_activities[ACTIVITY_FIELDS].copy())
 
     person_iterator = iter(df_persons.itertuples())
     activity_iterator = iter(df_activities.itertuples())
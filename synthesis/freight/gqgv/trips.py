@@ -25,7 +25,7 @@ def execute(context):
 
         # compute origin counts
         origin_counts = np.random.multinomial(demand, origin_pdf_matrices[vehicle_type].values[:, 0])
-        counts = np.zeros(od_pdf_matrices[vehicle_type].shape, dtype=np.int)
+        counts = np.zeros(od_pdf_matrices[vehicle_type].shape, dtype=int)
 
         # compute origin-destination counts
         for i in range(len(origin_counts)):
@@ -47,7 +47,7 @@ def execute(context):
                         origin_id = od_pdf_matrices[vehicle_type].index[origin_index]
                         destination_id = od_pdf_matrices[vehicle_type].columns[destination_index]
 
-                        trips = np.repeat(np.array([[origin_id, destination_id, vehicle_type]], dtype=np.object),
+                        trips = np.repeat(np.array([[origin_id, destination_id, vehicle_type]], dtype=object),
                                           number_of_trips, axis=0)
 
                         trips_frames.append(pd.DataFrame(columns=["origin_id", "destination_id", "vehicle_type"],
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+import data.utils
+
 
 def configure(context):
     context.stage("synthesis.freight.gte.trips")
@@ -34,6 +36,6 @@ def execute(context):
                          "destination_x", "destination_y",
                          "departure_time",
                          "vehicle_type"]
-    ]
+    ].copy()
 
-    return df_trips
+    return data.utils.enforce_categories(df_trips)
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 
+import data.utils
+
 """
 Transforms the synthetic trip table into a synthetic activity table.
 """
@@ -33,7 +35,7 @@ def execute(context):
     df_last = df_activities.sort_values(by=["person_id", "activity_index"]).groupby("person_id").last().reset_index()
     df_last.loc[:, "purpose"] = df_last.loc[:, "following_purpose_following_trip"]
     df_last.loc[:, "start_time"] = df_last.loc[:, "arrival_time_following_trip"]
-    df_last.loc[:, "end_time"] = np.nan
+    df_last["end_time"] = np.nan
     df_last.loc[:, "activity_index"] += 1
     df_last.loc[:, "is_last"] = True
 
@@ -58,6 +60,7 @@ def execute(context):
 
     df_activities = df_activities[[
         "person_id", "activity_index", "start_time", "end_time", "duration", "purpose", "is_last"
-    ]]
+    ]].copy()
 
-    return df_activities
+    df_activities = data.utils.enforce_categories(df_activities)
+    return data.utils.apply_dtype_policy(df_activities)
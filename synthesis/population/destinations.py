@@ -1,6 +1,7 @@
 import pandas as pd
 
-import data.spatial.utils as spatial_utils
+import data.codebook
+import data.utils
 
 
 def configure(context):
@@ -15,20 +16,17 @@ def execute(context):
     df.loc[:, "offers_work"] = True
     df.loc[:, "offers_other"] = True
 
-    # 85 = education
-    df.loc[:, "offers_education"] = df["noga"].str.startswith("85")
+    # 85 = education; 90 = arts, entertainment, leisure; 56 = gastronomy; 47 = retail
+    offers = data.codebook.recode_prefix(df["noga"], data.codebook.NOGA_OFFERS, data.codebook.NOGA_OFFERS_CATEGORIES)
 
-    # 90 = arts, entertainment, leisure; 56 = gastronomy
-    df.loc[:, "offers_leisure"] = df["noga"].str.startswith("90") | df[
-        "noga"].str.startswith("56")
-
-    # 47 = retail
-    df.loc[:, "offers_shop"] = df["noga"].str.startswith("47")
+    df.loc[:, "offers_education"] = offers == "education"
+    df.loc[:, "offers_leisure"] = offers == "leisure"
+    df.loc[:, "offers_shop"] = offers == "shop"
 
     del df["noga"]
 
-    df = spatial_utils.to_gpd(context, df, x="destination_x", y="destination_y", coord_type="facility")
+    # Geometries are not needed by the consumers of this stage, they use the coordinates
+    df = df[["destination_id", "destination_x", "destination_y",
+             "offers_work", "offers_education", "offers_leisure", "offers_shop", "offers_other"]].copy()
 
-    return df[["destination_id", "destination_x", "destination_y",
-               "offers_work", "offers_education", "offers_leisure", "offers_shop", "offers_other",
-               "geometry"]]
+    return data.utils.apply_dtype_policy(df)
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 
 import data.constants as c
+import data.utils
 
 """
 This stage fuses sampled STATPOP data with microcensus data.
@@ -65,4 +66,4 @@ def execute(context):
     df_persons["mz_person_id"] = df_persons["mz_person_id"].fillna(-1).astype(int)
     df_persons["mz_head_id"] = df_persons["mz_head_id"].fillna(-1).astype(int)
 
-    return df_persons
+    return data.utils.apply_dtype_policy(df_persons)
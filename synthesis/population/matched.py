@@ -63,9 +63,9 @@ def statistical_matching(progress, df_source, source_identifier, weight, df_targ
 
     # Perform matching
     weights = df_source[weight].values
-    assigned_indices = np.ones((len(df_target),), dtype=np.int) * -1
-    unassigned_mask = np.ones((len(df_target),), dtype=np.bool)
-    assigned_levels = np.ones((len(df_target),), dtype=np.int) * -1
+    assigned_indices = np.ones((len(df_target),), dtype=int) * -1
+    unassigned_mask = np.ones((len(df_target),), dtype=bool)
+    assigned_levels = np.ones((len(df_target),), dtype=int) * -1
     uniform = random.random_sample(size=(len(df_target),))
 
     column_indices = [np.arange(len(unique_values[column])) for column in columns]
@@ -231,8 +231,8 @@ def execute(context):
     assert (len(df_population) == initial_statpop_length - removed_persons_count)
 
     # Convert IDs
-    df_target["mz_id"] = df_target["mz_id"].astype(np.int)
-    df_source["mz_id"] = df_source["mz_id"].astype(np.int)
+    df_target["mz_id"] = df_target["mz_id"].astype(int)
+    df_source["mz_id"] = df_source["mz_id"].astype(int)
 
     # Get the attributes from the MZ for the head of household (and thus for the household)
     df_attributes = pd.merge(
@@ -1,6 +1,3 @@
-import data.spatial.utils as spatial_utils
-
-
 def configure(context):
     context.stage("synthesis.population.enriched")
     context.stage("data.statpop.households")
@@ -13,7 +10,7 @@ def execute(context):
                                                                              "home_y": "y"},
                                                                             axis=1)
 
-    df_homes = spatial_utils.to_gpd(context, df_homes, coord_type="home")
+    # Geometries are materialized by the consumers, see data.spatial.utils.to_gpd
     df_homes = df_homes.drop_duplicates(subset="household_id")
 
-    return df_homes[["household_id", "municipality_id", "geometry"]]
+    return df_homes[["household_id", "municipality_id", "x", "y"]]
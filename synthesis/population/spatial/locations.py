@@ -1,6 +1,9 @@
 import geopandas as gpd
 import pandas as pd
 
+import data.spatial.utils
+import data.utils
+
 
 def configure(context):
     context.stage("synthesis.population.spatial.home.locations")
@@ -16,6 +19,11 @@ def execute(context):
     df_work, df_education = context.stage("synthesis.population.spatial.primary.locations")
     df_secondary = context.stage("synthesis.population.spatial.secondary.locations")[0]
 
+    # The primary locations are stored as coordinates
+    df_home = data.spatial.utils.to_gpd(context, df_home, coord_type="home")
+    df_work = data.spatial.utils.to_gpd(context, df_work, coord_type="work")
+    df_education = data.spatial.utils.to_gpd(context, df_education, coord_type="education")
+
     df_persons = context.stage("synthesis.population.sampled")[["person_id", "household_id"]]
     df_locations = context.stage("synthesis.population.activities")[["person_id", "activity_index", "purpose"]]
 
@@ -59,4 +67,4 @@ def execute(context):
 
     df_locations = gpd.GeoDataFrame(df_locations, crs="epsg:2056")
 
-    return df_locations
+    return data.utils.apply_dtype_policy(df_locations)
@@ -1,8 +1,6 @@
 import numpy as np
 from sklearn.neighbors import KDTree
 
-import data.spatial.utils as spatial_utils
-
 
 def configure(context):
     context.stage("data.statent.statent")
@@ -50,6 +48,5 @@ def execute(context):
                                                                "education_y": "y"},
                                                               axis=1)
 
-    df_persons = spatial_utils.to_gpd(context, df_persons, coord_type="education")
-
-    return df_persons[["person_id", "destination_id", "geometry"]]
+    # Geometries are materialized by the consumers, see data.spatial.utils.to_gpd
+    return df_persons[["person_id", "destination_id", "x", "y"]]
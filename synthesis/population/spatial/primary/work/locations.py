@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
 
-import data.spatial.utils as spatial_utils
 import data.spatial.zone_shapes
 
 
@@ -49,12 +48,10 @@ def execute(context):
 
     df_shapes = context.stage("data.spatial.zone_shapes")
 
-    for zone_id in context.progress(empty_zones, label="Assigning national locations for empty zones ..."):
-        count = df_national[df_national["work_zone_id"] == zone_id]["count"].iloc[0]
-        row = df_shapes[df_shapes["zone_id"] == zone_id].iloc[0]
-        coordinates = data.spatial.zone_shapes.sample_coordinates(row, count)
-        df.loc[df["work_zone_id"] == zone_id, "work_x"] = coordinates[:, 0]
-        df.loc[df["work_zone_id"] == zone_id, "work_y"] = coordinates[:, 1]
+    f = df["work_zone_id"].isin(empty_zones)
+    coordinates = data.spatial.zone_shapes.sample_coordinates(df_shapes, df.loc[f, "work_zone_id"].values)
+    df.loc[f, "work_x"] = coordinates[:, 0]
+    df.loc[f, "work_y"] = coordinates[:, 1]
 
     # Second, handle the international commuters
     print("TODO: We do not handle commuter traffic at the moment.")
@@ -72,6 +69,5 @@ def execute(context):
                                           "work_location_id": "destination_id"},
                                          axis=1)
 
-    df = spatial_utils.to_gpd(context, df, coord_type="work")
-
-    return df[["person_id", "destination_id", "geometry"]]
+    # Geometries are materialized by the consumers, see data.spatial.utils.to_gpd
+    return df[["person_id", "destination_id", "x", "y"]]
@@ -33,7 +33,7 @@ def execute(context):
     # Merge commute information into the persons
     df = pd.merge(df_persons, df_commute, on="mz_person_id")
 
-    df_demand = df.groupby(["commute_mode", "home_zone_id"]).size().reset_index(name="count")
+    df_demand = df.groupby(["commute_mode", "home_zone_id"], observed=True).size().reset_index(name="count")
     pdf_matrices, cdf_matrices = context.stage("data.od.matrix")
     commute_counts = {}
 
@@ -47,7 +47,7 @@ def execute(context):
                    ]) for origin_zone in context.progress(df_zones["zone_id"], label=mode)
         ])[:, np.newaxis]
 
-        counts = np.zeros(pdf_matrices[source_mode].shape, dtype=np.int)
+        counts = np.zeros(pdf_matrices[source_mode].shape, dtype=int)
 
         for i in range(len(df_zones)):
             if origin_counts[i] > 0:
@@ -58,7 +58,7 @@ def execute(context):
         assert (len(counts) == len(df_zones))
 
     distances = context.stage("data.od.distances")
-    work_zones = np.zeros((len(df),), dtype=np.int)
+    work_zones = np.zeros((len(df),), dtype=int)
     zone_ids = list(df_zones["zone_id"])
 
     with context.progress(label="Assigning work zones", total=5 * len(df_zones)) as progress:
@@ -4,7 +4,7 @@ import pandas as pd
 import shapely.geometry as geo
 
 from synthesis.population.spatial.secondary.components import CustomDistanceSampler, CustomDiscretizationSolver
-from synthesis.population.spatial.secondary.problems import find_assignment_problems
+from synthesis.population.spatial.secondary.problems import LOCATION_FIELDS, find_assignment_problems
 from synthesis.population.spatial.secondary.rda import AssignmentSolver, DiscretizationErrorObjective, \
     GravityChainSolver
 
@@ -24,27 +24,28 @@ def configure(context):
 
 
 def prepare_locations(context):
-    # Load persons and their primary locations
+    # Load persons and their primary locations, the problems only need their coordinates
     df_home = context.stage("synthesis.population.spatial.home.locations")
     df_work, df_education = context.stage("synthesis.population.spatial.primary.locations")
 
-    df_home = df_home.rename(columns={"geometry": "home"})
-    df_work = df_work.rename(columns={"geometry": "work"})
-    df_education = df_education.rename(columns={"geometry": "education"})
+    df_home = df_home.rename(columns={"x": "home_x", "y": "home_y"})
+    df_work = df_work.rename(columns={"x": "work_x", "y": "work_y"})
+    df_education = df_education.rename(columns={"x": "education_x", "y": "education_y"})
 
     df_locations = context.stage("synthesis.population.sampled")[["person_id", "household_id"]]
-    df_locations = pd.merge(df_locations, df_home[["household_id", "home"]], how="left", on="household_id")
-    df_locations = pd.merge(df_locations, df_work[["person_id", "work"]], how="left", on="person_id")
-    df_locations = pd.merge(df_locations, df_education[["person_id", "education"]], how="left", on="person_id")
+    df_locations = pd.merge(df_locations, df_home[["household_id", "home_x", "home_y"]], how="left", on="household_id")
+    df_locations = pd.merge(df_locations, df_work[["person_id", "work_x", "work_y"]], how="left", on="person_id")
+    df_locations = pd.merge(df_locations, df_education[["person_id", "education_x", "education_y"]], how="left",
+                            on="person_id")
 
-    return df_locations[["person_id", "home", "work", "education"]].sort_values(by="person_id")
+    return df_locations[LOCATION_FIELDS].sort_values(by="person_id")
 
 
 def prepare_destinations(context):
     df_destinations = context.stage("synthesis.population.destinations")
 
     identifiers = df_destinations["destination_id"].values
-    locations = np.vstack(df_destinations["geometry"].apply(lambda x: np.array([x.x, x.y])).values)
+    locations = np.vstack([df_destinations["destination_x"].values, df_destinations["destination_y"].values]).T
 
     data = {}
 
@@ -32,7 +32,7 @@ def find_bare_assignment_problems(df):
             problem = None
 
 
-LOCATION_FIELDS = ["person_id", "home", "work", "education"]
+LOCATION_FIELDS = ["person_id", "home_x", "home_y", "work_x", "work_y", "education_x", "education_y"]
 
 
 def find_assignment_problems(df, df_locations):
@@ -77,11 +77,11 @@ def find_assignment_problems(df, df_locations):
         problem["destination"] = None
 
         if origin_purpose in FIXED_PURPOSES:
-            problem["origin"] = current_location[LOCATION_FIELDS.index(origin_purpose)]  # Shapely POINT
-            problem["origin"] = np.array([[problem["origin"].x, problem["origin"].y]])
+            index = LOCATION_FIELDS.index("%s_x" % origin_purpose)
+            problem["origin"] = np.array([current_location[index:index + 2]])
 
         if destination_purpose in FIXED_PURPOSES:
-            problem["destination"] = current_location[LOCATION_FIELDS.index(destination_purpose)]  # Shapely POINT
-            problem["destination"] = np.array([[problem["destination"].x, problem["destination"].y]])
+            index = LOCATION_FIELDS.index("%s_x" % destination_purpose)
+            problem["destination"] = np.array([current_location[index:index + 2]])
 
         yield problem
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 
 import data.constants as c
+import data.utils
 
 """
 This stage attaches all trip relevant information to the synthetic population.
@@ -70,7 +71,7 @@ def execute(context):
     df_count = df_trips.groupby("person_id").size().reset_index(name="count")
     df_trips["trip_index"] = np.hstack([np.arange(count) for count in df_count["count"].values])
 
-    return df_trips[[
+    df_trips = df_trips[[
         "person_id", "trip_index",
         "departure_time", "arrival_time",
         "preceding_purpose",
@@ -79,4 +80,7 @@ def execute(context):
         "trip_duration",
         # "activity_duration",
         "mode"
-    ]]
+    ]].copy()
+
+    df_trips = data.utils.enforce_categories(df_trips)
+    return data.utils.apply_dtype_policy(df_trips)
@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data.cache
+
+
+class Context:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+
+    def config(self, name):
+        assert name == "raw_cache_path"
+        return self.cache_path
+
+
+def create_source(tmpdir):
+    path = str(tmpdir.join("source.csv"))
+
+    pd.DataFrame({
+        "id": [3, 1, 2],
+        "value": [0.5, np.nan, 2.5],
+        "label": ["a", None, "c"],
+    }).to_csv(path, index=False)
+
+    return path
+
+
+class Reader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path, filter=None):
+        self.calls += 1
+        df = pd.read_csv(path)
+
+        df["category"] = pd.Categorical(["x", "y", "x"], categories=["x", "y", "z"])
+        return df if filter is None else df[filter(df)].reset_index(drop=True)
+
+
+def test_round_trip(tmpdir):
+    path = create_source(tmpdir)
+    context = Context(str(tmpdir.mkdir("cache")))
+    reader = Reader()
+
+    df_expected = reader(path)
+    df_first = data.cache.read(context, path, reader)
+    df_second = data.cache.read(context, path, reader)
+
+    assert reader.calls == 2
+    pd.testing.assert_frame_equal(df_first, df_expected)
+
+    # Loaded columns are memory-mapped, copies are plain arrays
+    pd.testing.assert_frame_equal(df_second.copy(), df_expected)
+
+
+def test_memory_mapped(tmpdir, monkeypatch):
+    path = create_source(tmpdir)
+    context = Context(str(tmpdir.mkdir("cache")))
+    reader = Reader()
+
+    data.cache.read(context, path, reader)
+
+    # Keep track of the arrays that are loaded from the cache
+    arrays = []
+    load = np.load
+
+    def load_array(*args, **kwargs):
+        arrays.append(load(*args, **kwargs))
+        return arrays[-1]
+
+    monkeypatch.setattr(np, "load", load_array)
+    df = data.cache.read(context, path, reader)
+
+    assert isinstance(arrays[0], np.memmap) and isinstance(arrays[1], np.memmap)
+    assert np.shares_memory(df["id"].values, arrays[0])
+    assert np.shares_memory(df["value"].values, arrays[1])
+
+
+def test_invalidation(tmpdir):
+    path = create_source(tmpdir)
+    context = Context(str(tmpdir.mkdir("cache")))
+    reader = Reader()
+
+    data.cache.read(context, path, reader, variant="a")
+    data.cache.read(context, path, reader, variant="a")
+    assert reader.calls == 1
+
+    # Another variant is a separate entry
+    data.cache.read(context, path, reader, variant="b")
+    assert reader.calls == 2
+
+    # Changing the source invalidates the entry
+    pd.DataFrame({"id": [1], "value": [1.0], "label": ["d"]}).to_csv(path, index=False)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    df = data.cache.read(context, path, lambda path: pd.read_csv(path), variant="a")
+    assert list(df["label"]) == ["d"]
+
+    # So does changing the reader
+    df = data.cache.read(context, path, lambda path: pd.read_csv(path)[["id"]], variant="a")
+    assert list(df.columns) == ["id"]
+
+
+def test_filter(tmpdir):
+    path = create_source(tmpdir)
+    context = Context(str(tmpdir.mkdir("cache")))
+    reader = Reader()
+
+    df = data.cache.read(context, path, reader, filter=lambda df: df["id"] > 1)
+    assert list(df["id"]) == [3, 2]
+
+    df = data.cache.read(context, path, reader, filter=lambda df: df["id"] > 1)
+    assert list(df["id"]) == [3, 2] and reader.calls == 1
+
+    # Another filter is a separate entry, even without a filter variant
+    df = data.cache.read(context, path, reader, filter=lambda df: df["id"] < 2)
+    assert list(df["id"]) == [1] and reader.calls == 2
+
+    # Values the filter closes over are described by the filter variant
+    for ids in ([1, 3], [2]):
+        df = data.cache.read(context, path, reader, filter=lambda df: df["id"].isin(ids),
+                             filter_variant=data.cache.hash_values(ids))
+        assert sorted(df["id"]) == ids
+
+    assert reader.calls == 4
+
+    with pytest.raises(RuntimeError):
+        data.cache.read(context, path, reader, filter=lambda df: df["id"].isin(ids))
+
+
+def test_disabled(tmpdir):
+    path = create_source(tmpdir)
+    reader = Reader()
+
+    data.cache.read(Context(None), path, reader)
+    data.cache.read(Context(None), path, reader)
+
+    assert reader.calls == 2
@@ -0,0 +1,31 @@
+import numpy as np
+
+import data.codebook
+import data.constants as c
+
+
+def test_recode_labels():
+    result = data.codebook.recode(np.array([9, 15, 2, 99, -99]), data.codebook.MZ_MODE,
+                                  data.codebook.MZ_MODE_CATEGORIES)
+
+    assert list(result.categories) == c.MODE_CATEGORIES
+    assert list(result[:3]) == ["car", "walk", "pt"]
+    assert result.isna()[3]
+    assert result[4] == "unknown"
+
+
+def test_recode_numbers():
+    result = data.codebook.recode(np.array([1, 2, 4, 8]), data.codebook.MZ_MARITAL_STATUS)
+
+    assert result.dtype == np.float64
+    assert np.array_equal(result[:3], [c.MARITAL_STATUS_SINGLE, c.MARITAL_STATUS_MARRIED, c.MARITAL_STATUS_SEPARATE])
+    assert np.isnan(result[3])
+
+
+def test_recode_prefix():
+    result = data.codebook.recode_prefix(np.array(["851000", "854200", "471100", "620100"]),
+                                         data.codebook.NOGA_EDUCATION_TYPE,
+                                         data.codebook.NOGA_EDUCATION_TYPE_CATEGORIES)
+
+    assert list(result[:2]) == ["kindergarten", "tertiary"]
+    assert result.isna()[2:].all()
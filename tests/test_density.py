@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+import data.constants as c
+import data.statpop.density
+
+
+class Context:
+    def __init__(self, df_persons, exact):
+        self.df_persons = df_persons
+        self.exact = exact
+
+    def stage(self, name):
+        assert name == "data.statpop.persons"
+        return self.df_persons
+
+    def config(self, name):
+        return dict(population_density_resolution=100.0, population_density_exact=self.exact)[name]
+
+
+def create_homes(random):
+    # Two towns in a larger rural area
+    return pd.DataFrame(np.vstack([
+        random.normal([2600000.0, 1200000.0], 1000.0, size=(2000, 2)),
+        random.normal([2610000.0, 1205000.0], 500.0, size=(1000, 2)),
+        random.uniform([2590000.0, 1190000.0], [2620000.0, 1210000.0], size=(500, 2)),
+    ]), columns=["home_x", "home_y"])
+
+
+def test_density():
+    random = np.random.RandomState(0)
+    df_persons = create_homes(random)
+
+    df_locations = pd.DataFrame(random.uniform(
+        [2590000.0, 1190000.0], [2620000.0, 1210000.0], size=(1000, 2)), columns=["x", "y"])
+    df_locations.loc[0] = [0.0, 0.0]  # Far outside of the grid
+
+    coordinates = df_persons[["home_x", "home_y"]].values
+    exact_counts = KDTree(coordinates).query_radius(
+        df_locations[["x", "y"]].values, c.POPULATION_DENSITY_RADIUS, count_only=True)
+
+    # The grid approximates the exact counts within the radius
+    density = data.statpop.density.execute(Context(df_persons, False))
+    data.statpop.density.impute(density, df_locations)
+
+    counts = df_locations["population_density"].values
+    assert counts[0] == 0
+    assert np.abs(np.sum(counts) - np.sum(exact_counts)) < 0.02 * np.sum(exact_counts)
+    assert np.mean(np.abs(counts - exact_counts)) < 0.05 * np.mean(exact_counts)
+
+    # With the exact option, the exact counts are used
+    density = data.statpop.density.execute(Context(df_persons, True))
+    assert density["coordinates"].dtype == np.float64
+
+    data.statpop.density.impute(density, df_locations)
+    assert np.array_equal(df_locations["population_density"].values, exact_counts)
@@ -0,0 +1,60 @@
+import contextlib
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely.geometry as geo
+
+import data.spatial.hierarchy
+
+
+class Context:
+    def config(self, name):
+        return dict(spatial_raster_resolution=None, threads=1)[name]
+
+    @contextlib.contextmanager
+    def progress(self, label=None, total=None):
+        yield Progress()
+
+
+class Progress:
+    def update(self, count=1):
+        pass
+
+
+def create_hierarchy():
+    # Two quarters in municipality 261, followed by the municipalities 261 and 1061
+    return gpd.GeoDataFrame({
+        "quarter_id": [26101.0, 26102.0, np.nan, np.nan],
+        "municipality_id": [261, 261, 261, 1061],
+        "canton_id": [1, 1, 1, 3],
+        "municipality_type": pd.Categorical(["urban", "urban", "urban", "suburban"]),
+        "zone_id": [10, 11, 0, 1],
+    }, geometry=[
+        geo.box(0.0, 0.0, 5.0, 10.0), geo.box(5.0, 0.0, 10.0, 10.0),
+        geo.box(0.0, 0.0, 10.0, 10.0), geo.box(20.0, 0.0, 30.0, 10.0),
+    ], crs="epsg:2056")
+
+
+def test_join_and_get():
+    df_hierarchy = create_hierarchy()
+
+    # Quarters are used where they are known, otherwise the municipality
+    indices = data.spatial.hierarchy.join(df_hierarchy, [1061, 261, 261, 999], [np.nan, 26102, 99999, np.nan])
+    assert np.array_equal(indices, [3, 1, 2, -1])
+    assert np.array_equal(data.spatial.hierarchy.join(df_hierarchy, [261, 1061]), [2, 3])
+
+    df = data.spatial.hierarchy.get(df_hierarchy, indices, ["zone_id", "canton_id", "municipality_type"])
+    assert list(df["zone_id"][:3]) == [1, 11, 0] and list(df["canton_id"][:3]) == [3, 1, 1]
+    assert list(df["municipality_type"][:3]) == ["suburban", "urban", "urban"]
+    assert df.iloc[3].isna().all()
+
+
+def test_locate():
+    df_hierarchy = create_hierarchy()
+    x, y = np.array([2.0, 7.0, 25.0, 40.0]), np.array([5.0, 5.0, 5.0, 5.0])
+
+    # Points outside of all units are assigned to the municipality with the closest centroid
+    assert np.array_equal(data.spatial.hierarchy.locate(Context(), df_hierarchy, x, y), [0, 1, 3, 3])
+    assert np.array_equal(data.spatial.hierarchy.locate(Context(), df_hierarchy, x, y, fix_by_distance=False),
+                          [0, 1, 3, -1])
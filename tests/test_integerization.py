@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from data.statpop.multilevelipf import integerization
+
+
+def create_weights(seed=0):
+    return np.random.RandomState(seed).uniform(0.0, 4.0, 500)
+
+
+def test_trs_preserves_total():
+    weights = create_weights()
+    counts = integerization.integerize(weights, "trs", seed=42)
+
+    assert np.sum(counts) == np.round(np.sum(weights))
+    assert np.all((counts == np.floor(weights)) | (counts == np.ceil(weights)))
+
+
+def test_trs_is_reproducible_by_seed():
+    weights = create_weights()
+
+    first = integerization.integerize(weights, "trs", seed=42)
+    second = integerization.integerize(weights, "trs", random=np.random.RandomState(42))
+    other = integerization.integerize(weights, "trs", seed=43)
+
+    assert np.array_equal(first, second)
+    assert not np.array_equal(first, other)
+
+
+def test_controlled_rounding():
+    weights = create_weights()
+    counts = integerization.integerize(weights, "rounding", seed=42)
+
+    assert abs(np.sum(counts) - np.sum(weights)) < 1.0
+    assert np.all((counts == np.floor(weights)) | (counts == np.ceil(weights)))
+
+
+def test_unknown_method():
+    with pytest.raises(RuntimeError):
+        integerization.integerize(create_weights(), "unknown", seed=42)
@@ -0,0 +1,51 @@
+import contextlib
+
+import numpy as np
+
+import data.microcensus.stages
+
+
+class Context:
+    def __init__(self, data_path):
+        self.data_path = data_path
+
+    def config(self, name):
+        return dict(data_path=self.data_path, raw_cache_path=None)[name]
+
+    @contextlib.contextmanager
+    def progress(self, total=None):
+        yield Progress()
+
+
+class Progress:
+    def update(self, count=1):
+        pass
+
+
+def test_stages(tmpdir):
+    tmpdir.mkdir("microcensus").join("etappen.csv").write("\n".join([
+        "HHNR,WEGNR,ETNR,f51300,f51100,f51400,f51330,rdist,ldist",
+        "1,1,1,1,480,485,-99,0.4,0.3",  # Walk to the station
+        "1,1,2,9,490,510,-99,12.0,10.0",  # Train
+        "1,1,3,1,510,515,-99,0.5,0.4",  # Walk from the station
+        "1,2,1,8,1000,1020,5,8.0,6.0",  # Car passenger
+        "2,,1,1,600,610,-99,1.0,0.8",  # Stage without a trip
+    ]) + "\n")
+
+    df_stages, df_aggregated = data.microcensus.stages.execute(Context(str(tmpdir)))
+
+    assert len(df_stages) == 4
+    assert list(df_stages["mode"]) == ["walk", "rail", "walk", "other"]
+    assert list(df_stages["is_vehicular"]) == [False, True, False, False]
+
+    df_aggregated = df_aggregated.set_index("trip_id")
+    assert list(df_aggregated["number_of_stages"]) == [3, 1]
+    assert list(df_aggregated["is_car_passenger"]) == [False, True]
+    assert list(df_aggregated["parking_cost"]) == [0.0, 5.0]
+    assert list(df_aggregated["line_switches"]) == [1, 0]
+
+    assert df_aggregated.loc[1, "access_egress_time"] == 600.0
+    assert df_aggregated.loc[1, "in_vehicle_time"] == 1200.0
+    assert df_aggregated.loc[1, "in_vehicle_routed_distance"] == 12000.0
+    assert df_aggregated.loc[1, "first_waiting_time"] == 300.0
+    assert np.isnan(df_aggregated.loc[2, "first_waiting_time"])
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+from data.statpop.multilevelipf.multilevelipf import FittingProblem, IPUSolver, RakingSolver
+
+
+def create_persons(number_of_households=60, seed=0):
+    random = np.random.RandomState(seed)
+    sizes = random.choice([1, 2, 3, 4], number_of_households, p=[0.3, 0.3, 0.2, 0.2])
+    household_ids = np.repeat(np.arange(number_of_households), sizes)
+
+    return pd.DataFrame({
+        "household_id": household_ids,
+        "person_id": np.arange(len(household_ids)),
+        "household_size_class": np.minimum(sizes, 3)[household_ids] - 1,
+        "sex": random.randint(0, 2, len(household_ids)),
+        "age_class": random.randint(0, 3, len(household_ids)),
+    })
+
+
+def create_controls(df, seed=1):
+    """ Controls that are met exactly by random household weights, such that the fit is feasible. """
+    random = np.random.RandomState(seed)
+    household_weights = random.uniform(0.5, 3.0, df["household_id"].max() + 1)
+
+    df = df.copy()
+    df["weight"] = household_weights[df["household_id"]]
+
+    df_households = df.drop_duplicates("household_id").groupby("household_size_class")["weight"].sum().reset_index()
+    df_sex = df.groupby("sex")["weight"].sum().reset_index()
+    df_age = df.groupby("age_class")["weight"].sum().reset_index()
+
+    return [df_households], [df_sex, df_age]
+
+
+def fit_dense(df, group_controls, individual_controls, iterations):
+    """
+        Reference IPU on the person level with one boolean filter per control row, as
+        the solver was implemented before the sparse incidence matrices.
+    """
+    expansion_factors = np.ones((len(df),))
+    f_first = ~df["household_id"].duplicated().values
+
+    for iteration in range(iterations):
+        for control in group_controls:
+            for _, row in control.iterrows():
+                f = np.ones((len(df),), dtype=bool)
+
+                for column in row.drop("weight").index:
+                    f &= df[column].values == row[column]
+
+                expansion_factors[f] *= row["weight"] / np.sum(expansion_factors[f & f_first])
+
+        for control in individual_controls:
+            for _, row in control.iterrows():
+                f = np.ones((len(df),), dtype=bool)
+
+                for column in row.drop("weight").index:
+                    f &= df[column].values == row[column]
+
+                f_group = df["household_id"].isin(df.loc[f, "household_id"]).values
+                expansion_factors[f_group] *= row["weight"] / np.sum(expansion_factors[f])
+
+    return expansion_factors[f_first]
+
+
+def test_ipu_matches_dense_reference():
+    df = create_persons()
+    group_controls, individual_controls = create_controls(df)
+
+    # Negative tolerances never converge, so both run the same number of iterations
+    solver = IPUSolver(group_rel_tol=-1, group_abs_tol=-1, ind_rel_tol=-1, ind_abs_tol=-1, max_iter=5)
+    problem = FittingProblem(df, group_controls, "household_id", individual_controls, "person_id")
+    df_result, converged = solver.fit(problem)
+
+    assert not converged
+    assert len(solver.history) == 10
+
+    expected = fit_dense(df, group_controls, individual_controls, 5)
+    assert np.allclose(df_result["expansion_factor"].values, expected, rtol=1e-12)
+
+
+def test_ipu_meets_controls():
+    df = create_persons()
+    group_controls, individual_controls = create_controls(df)
+
+    solver = IPUSolver(group_rel_tol=1e-8, group_abs_tol=0, ind_rel_tol=1e-8, ind_abs_tol=0)
+    problem = FittingProblem(df, group_controls, "household_id", individual_controls, "person_id")
+    df_result, converged = solver.fit(problem)
+
+    assert converged
+    assert solver.info["converged"]
+    assert 0 < solver.info["iterations"] <= solver.max_iter
+
+    weights = df["household_id"].map(df_result.set_index("household_id")["expansion_factor"])
+    assert np.allclose(weights.groupby(df["sex"]).sum().values, individual_controls[0]["weight"].values, rtol=1e-6)
+
+    household_weights = df_result.groupby("household_size_class")["expansion_factor"].sum()
+    assert np.allclose(household_weights.values, group_controls[0]["weight"].values, rtol=1e-6)
+
+
+def test_household_classes_fit_like_households():
+    df = create_persons()
+    group_controls, individual_controls = create_controls(df)
+
+    problem = FittingProblem(df, group_controls, "household_id", individual_controls, "person_id")
+    class_problem, classes = problem.aggregate()
+
+    assert len(class_problem.df) < len(problem.df)
+    assert np.sum(class_problem.group_sizes) == len(problem.df)
+
+    solver = IPUSolver(group_rel_tol=-1, group_abs_tol=-1, ind_rel_tol=-1, ind_abs_tol=-1, max_iter=5)
+    expected = solver.fit(problem)[0]["expansion_factor"].values
+    result = solver.fit(class_problem)[0]["expansion_factor"].values[classes]
+
+    assert np.allclose(result, expected, rtol=1e-12)
+
+
+def test_raking_converges_to_controls():
+    df = create_persons()
+    group_controls, individual_controls = create_controls(df)
+
+    solver = RakingSolver(group_rel_tol=1e-10, group_abs_tol=0, ind_rel_tol=1e-10, ind_abs_tol=0)
+    problem = FittingProblem(df, group_controls, "household_id", individual_controls, "person_id")
+    df_result, converged = solver.fit(problem)
+
+    assert converged
+    assert solver.info["iterations"] < 20
+
+    expansion_factors = df_result["expansion_factor"].values
+    assert np.all(expansion_factors > 0)
+
+    assert np.allclose(problem.group_incidence.T.dot(expansion_factors), problem.group_weights, rtol=1e-9)
+    assert np.allclose(problem.individual_incidence.T.dot(expansion_factors), problem.individual_weights, rtol=1e-9)
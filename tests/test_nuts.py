@@ -0,0 +1,35 @@
+import geopandas as gpd
+import numpy as np
+import shapely.geometry as geo
+
+import data.spatial.nuts
+
+
+def create_zones():
+    # Zones in WGS84 around Basel, in France next to Switzerland and far away in Portugal
+    return gpd.GeoDataFrame({
+        "NUTS_ID": ["CH03", "DE13", "FR42", "FR43", "PT11"],
+    }, geometry=[
+        geo.box(7.4, 47.4, 7.8, 47.6), geo.box(7.6, 47.6, 8.0, 47.9),
+        geo.box(6.5, 47.8, 6.8, 48.0), geo.box(7.3, 47.3, 7.46, 47.47), geo.box(-8.9, 41.0, -8.0, 42.0),
+    ], crs="epsg:4326")
+
+
+def test_clip():
+    # Buffer (LV95) around a point in Basel, only reaching into the German zone
+    buffer = geo.Point(2611000, 1267000).buffer(10000.0)
+    bounds = gpd.GeoSeries([buffer], crs="epsg:2056").to_crs("epsg:4326").total_bounds
+
+    df_zones = create_zones()
+    df_clipped = data.spatial.nuts.clip(df_zones, "NUTS_ID", buffer, bounds)
+
+    assert list(df_clipped["NUTS_ID"]) == ["CH03", "DE13", "FR42", "FR43", "PT11"]
+    assert list(df_clipped.geometry.geom_type) == ["Polygon", "Polygon", "Point", "Point", "Point"]
+
+    # All zones end up in LV95, the points lie in their zones
+    df_projected = df_zones.to_crs("epsg:2056")
+
+    for index in range(5):
+        assert df_projected.geometry.iloc[index].intersects(df_clipped.geometry.iloc[index])
+
+    assert np.isclose(df_clipped.geometry.iloc[0].area, df_projected.geometry.iloc[0].area)
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from synthesis.population.spatial.secondary.problems import LOCATION_FIELDS, find_assignment_problems
+
+
+def test_find_assignment_problems():
+    df_trips = pd.DataFrame.from_records([
+        (1, 0, "home", "shop", "walk", 600.0),
+        (1, 1, "shop", "work", "pt", 1200.0),
+        (1, 2, "work", "home", "pt", 1500.0),
+        (2, 0, "home", "leisure", "car", 900.0),
+        (2, 1, "leisure", "education", "bike", 300.0),
+    ], columns=["person_id", "trip_index", "preceding_purpose", "following_purpose", "mode", "travel_time"])
+
+    df_locations = pd.DataFrame.from_records([
+        (1, 100.0, 200.0, 300.0, 400.0, np.nan, np.nan),
+        (2, 500.0, 600.0, np.nan, np.nan, 700.0, 800.0),
+    ], columns=LOCATION_FIELDS)
+
+    problems = list(find_assignment_problems(df_trips, df_locations))
+
+    # The direct trip from work to home has no variable activity
+    assert [problem["person_id"] for problem in problems] == [1, 2]
+    assert [problem["purposes"] for problem in problems] == [["shop"], ["leisure"]]
+
+    assert np.array_equal(problems[0]["origin"], [[100.0, 200.0]])
+    assert np.array_equal(problems[0]["destination"], [[300.0, 400.0]])
+    assert np.array_equal(problems[1]["origin"], [[500.0, 600.0]])
+    assert np.array_equal(problems[1]["destination"], [[700.0, 800.0]])
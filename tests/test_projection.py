@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import data.spatial.projection
+
+
+class Context:
+    def __init__(self, fast):
+        self.fast = fast
+
+    def config(self, name):
+        assert name == "fast_projection"
+        return self.fast
+
+
+def test_transform_coordinates():
+    x, y = [600000.0, 700000.0, np.nan], [200000.0, 100000.0, 150000.0]
+
+    exact_x, exact_y = data.spatial.projection.transform_coordinates(x, y)
+    fast_x, fast_y = data.spatial.projection.transform_coordinates(x, y, fast=True)
+
+    # The origin of LV03 is mapped exactly, elsewhere the approximation deviates by less than 1.5m
+    assert np.allclose([exact_x[0], exact_y[0]], [2600000.0, 1200000.0], atol=0.01)
+    assert np.all(np.abs(exact_x[:2] - fast_x[:2]) < 1.5) and np.all(np.abs(exact_y[:2] - fast_y[:2]) < 1.5)
+
+    assert np.isnan(exact_x[2]) and np.isnan(exact_y[2])
+    assert np.isnan(fast_x[2]) and np.isnan(fast_y[2])
+
+
+def test_transform():
+    df = pd.DataFrame({
+        "origin_x": [600000.0, np.nan], "origin_y": [200000.0, np.nan],
+        "destination_x": [610000.0, 620000.0], "destination_y": [210000.0, 220000.0],
+    })
+
+    df = data.spatial.projection.transform(Context(True), df, [
+        (("origin_x", "origin_y"), ("origin_x", "origin_y")),
+        (("destination_x", "destination_y"), ("destination_lv95_x", "destination_lv95_y")),
+    ])
+
+    np.testing.assert_array_equal(df["origin_x"], [2600000.0, np.nan])
+    np.testing.assert_array_equal(df["destination_lv95_x"], [2610000.0, 2620000.0])
+    np.testing.assert_array_equal(df["destination_lv95_y"], [1210000.0, 1220000.0])
+    np.testing.assert_array_equal(df["destination_x"], [610000.0, 620000.0])
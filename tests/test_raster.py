@@ -0,0 +1,88 @@
+import contextlib
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely.geometry as geo
+
+import data.spatial.raster
+import data.spatial.utils
+
+
+class Context:
+    def __init__(self, resolution, cache_path=None):
+        self.resolution = resolution
+        self.cache_path = cache_path
+
+    def config(self, name):
+        return dict(spatial_raster_resolution=self.resolution, raw_cache_path=self.cache_path, threads=1)[name]
+
+    @contextlib.contextmanager
+    def progress(self, label=None, total=None):
+        yield Progress()
+
+
+class Progress:
+    def update(self, count=1):
+        pass
+
+
+def create_zones():
+    # Overlapping zones, a zone with a hole, a multi polygon and a concave zone spanning several tiles
+    return np.array([
+        geo.box(0.0, 0.0, 100.0, 100.0), geo.box(50.0, 50.0, 150.0, 150.0),
+        geo.Polygon(geo.box(200.0, 0.0, 300.0, 100.0).exterior.coords,
+                    [geo.box(220.0, 20.0, 280.0, 80.0).exterior.coords]),
+        geo.MultiPolygon([geo.box(0.0, 200.0, 30.0, 230.0), geo.box(40.0, 200.0, 70.0, 230.0)]),
+        geo.Polygon([(100.0, 200.0), (400.0, 200.0), (400.0, 500.0), (380.0, 500.0), (380.0, 220.0), (100.0, 230.0)]),
+    ], dtype=object)
+
+
+def lookup_brute_force(geometries, coordinates):
+    indices = np.full((len(coordinates),), -1, dtype=int)
+
+    for point_index, (x, y) in enumerate(coordinates):
+        for index, geometry in enumerate(geometries):
+            if geometry.contains(geo.Point(x, y)):
+                indices[point_index] = index
+                break
+
+    return indices
+
+
+def test_raster_lookup():
+    geometries = create_zones()
+    coordinates = np.random.RandomState(0).uniform(-20.0, 420.0, size=(20000, 2))
+    expected = lookup_brute_force(geometries, coordinates)
+
+    raster = data.spatial.raster.RasterIndex.build(geometries, 2.0)
+    indices = raster.lookup(coordinates[:, 0], coordinates[:, 1])
+
+    # Points that are resolved by the raster are resolved exactly, few points need a test
+    f = indices != data.spatial.raster.BOUNDARY
+    assert np.array_equal(indices[f], expected[f])
+    assert np.count_nonzero(~f) < 0.1 * len(coordinates)
+    assert set(indices[f]) == {-1, 0, 1, 2, 3, 4}
+
+    # Tiles in the interior of the large zones are stored as one value
+    assert len(raster.blocks) < raster.tile_labels.size
+
+    # The lookup refines the boundary cells exactly
+    df_zones = gpd.GeoDataFrame(geometry=list(geometries))
+    x, y = coordinates[:, 0], coordinates[:, 1]
+
+    assert np.array_equal(data.spatial.utils.lookup(Context(2.0), df_zones, x, y), expected)
+    assert np.array_equal(data.spatial.utils.lookup(Context(None), df_zones, x, y), expected)
+
+
+def test_raster_cache(tmpdir):
+    geometries = create_zones()
+    context = Context(5.0, str(tmpdir))
+
+    first = data.spatial.raster.get_raster(context, geometries)
+    second = data.spatial.raster.get_raster(context, geometries)
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    coordinates = np.random.RandomState(1).uniform(-20.0, 420.0, size=(1000, 2))
+    assert np.array_equal(first.lookup(coordinates[:, 0], coordinates[:, 1]),
+                          second.lookup(coordinates[:, 0], coordinates[:, 1]))
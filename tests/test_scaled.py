@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from data.statpop.scaled import scale_to_cantons
+
+
+def test_scale_to_cantons():
+    random = np.random.RandomState(0)
+
+    df_controls = pd.DataFrame({
+        "home_municipality_id": np.repeat([101, 102, 103, 201, 202], 3),
+        "canton_id": np.repeat([1, 1, 1, 2, 2], 3),
+        "household_size_class_projection": np.tile([0, 1, 2], 5),
+        "weight": random.uniform(50.0, 200.0, 15),
+    })
+
+    df_canton_controls = pd.DataFrame({
+        "canton_id": np.repeat([1, 2], 3),
+        "household_size_class_projection": np.tile([0, 1, 2], 2),
+        "weight": [900.0, 700.0, 400.0, 500.0, 300.0, 200.0],
+    })
+
+    df_result = scale_to_cantons(df_controls.copy(), df_canton_controls)
+
+    # The municipality controls add up to the canton controls by household size class
+    df_margins = df_result.groupby(["canton_id", "household_size_class_projection"])["weight"].sum().reset_index()
+    assert np.allclose(df_margins["weight"].values, df_canton_controls["weight"].values, rtol=1e-6)
+
+    # The municipalities keep their share of the canton
+    def get_shares(df):
+        df_totals = df.groupby(["canton_id", "home_municipality_id"])["weight"].sum().reset_index()
+        return (df_totals["weight"] / df_totals.groupby("canton_id")["weight"].transform("sum")).values
+
+    assert np.allclose(get_shares(df_result), get_shares(df_controls), rtol=1e-6)
+
+
+def test_scale_to_cantons_totals_only():
+    df_controls = pd.DataFrame({
+        "home_municipality_id": [101, 102, 201],
+        "canton_id": [1, 1, 2],
+        "weight": [10.0, 30.0, 5.0],
+    })
+
+    df_canton_controls = pd.DataFrame({
+        "canton_id": [1, 1, 2],
+        "household_size_class_projection": [0, 1, 0],
+        "weight": [60.0, 20.0, 20.0],
+    })
+
+    df_result = scale_to_cantons(df_controls, df_canton_controls)
+    assert np.allclose(df_result["weight"].values, [20.0, 60.0, 20.0])
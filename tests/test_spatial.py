@@ -0,0 +1,146 @@
+import os
+import pickle
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+import shapely.geometry as geo
+import shapely.vectorized
+
+import data.spatial.utils
+
+
+class Context:
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+
+    def config(self, name):
+        return dict(raw_cache_path=self.cache_path, threads=1)[name]
+
+
+def test_read_shapefile(tmpdir):
+    path = str(tmpdir.join("zones.shp"))
+
+    gpd.GeoDataFrame({"zone": ["a", "b"]}, geometry=[
+        geo.box(7.4, 47.4, 7.5, 47.5), geo.box(7.5, 47.4, 7.6, 47.5)
+    ], crs="epsg:4326").to_file(path)
+
+    cache_path = str(tmpdir.mkdir("cache"))
+    context = Context(cache_path)
+    df_expected = data.spatial.utils.read_shapefile(Context(), path)
+
+    df_first = data.spatial.utils.read_shapefile(context, path)
+    df_second = data.spatial.utils.read_shapefile(context, path)
+
+    assert len(os.listdir(cache_path)) == 1
+    assert df_second.crs == "epsg:2056" and list(df_second["zone"]) == ["a", "b"]
+    assert df_expected.geometry.geom_equals_exact(df_first.geometry, 1e-6).all()
+    assert df_expected.geometry.geom_equals_exact(df_second.geometry, 1e-6).all()
+
+    # Transformed layers are separate entries, keyed by the transform variant
+    for zone in ("a", "b"):
+        df = data.spatial.utils.read_shapefile(context, path, transform=lambda df: df[df["zone"] == zone],
+                                               transform_variant=zone)
+        assert list(df["zone"]) == [zone]
+
+    assert len(os.listdir(cache_path)) == 3
+
+
+def test_to_gpd():
+    df = pd.DataFrame({"id": [1, 2], "x": [2600000.0, 2601000.0], "y": [1200000.0, 1201000.0]})
+
+    df_points = data.spatial.utils.to_gpd(Context(), df)
+    assert df_points.crs == "epsg:2056" and list(df_points["id"]) == [1, 2]
+    assert np.array_equal(df_points.geometry.x, df["x"]) and np.array_equal(df_points.geometry.y, df["y"])
+
+    # Other coordinate systems are projected to LV95
+    df = pd.DataFrame({"lon": [7.43864], "lat": [46.95108]})
+    df_points = data.spatial.utils.to_gpd(Context(), df, x="lon", y="lat", crs="epsg:4326")
+
+    assert df_points.crs == "epsg:2056"
+    assert abs(df_points.geometry.x[0] - 2600000.0) < 10.0 and abs(df_points.geometry.y[0] - 1200000.0) < 10.0
+
+
+def create_zones():
+    # Overlapping boxes, a box with a hole and a concave polygon
+    return [
+        geo.box(0.0, 0.0, 10.0, 10.0), geo.box(5.0, 5.0, 15.0, 15.0),
+        geo.Polygon(geo.box(20.0, 0.0, 30.0, 10.0).exterior.coords, [geo.box(22.0, 2.0, 28.0, 8.0).exterior.coords]),
+        geo.Polygon([(0.0, 20.0), (10.0, 20.0), (10.0, 30.0), (8.0, 30.0), (8.0, 22.0), (0.0, 22.0)]),
+    ]
+
+
+def lookup_brute_force(geometries, coordinates):
+    indices = np.full((len(coordinates),), -1, dtype=int)
+
+    for point_index, (x, y) in enumerate(coordinates):
+        for index, geometry in enumerate(geometries):
+            if geometry.contains(geo.Point(x, y)):
+                indices[point_index] = index
+                break
+
+    return indices
+
+
+@pytest.mark.parametrize("shapely_1", [False, True])
+def test_zone_tree(shapely_1, monkeypatch):
+    if shapely_1:
+        monkeypatch.delattr(shapely, "STRtree", raising=False)
+
+    geometries = create_zones()
+    coordinates = np.random.RandomState(0).uniform(-2.0, 32.0, size=(2000, 2))
+
+    tree = data.spatial.utils.ZoneTree(geometries)
+    expected = lookup_brute_force(geometries, coordinates)
+
+    assert np.array_equal(tree.lookup(coordinates), expected)
+    assert set(expected) == {-1, 0, 1, 2, 3}
+    assert isinstance(tree.get_tree(), np.ndarray) == shapely_1
+
+    # The index is not pickled and rebuilt on first use
+    tree = pickle.loads(pickle.dumps(tree))
+    assert tree.tree is None
+    assert np.array_equal(tree.lookup(coordinates[:100]), expected[:100])
+    assert len(tree.lookup(np.zeros((0, 2)))) == 0
+
+
+@pytest.mark.parametrize("shapely_1", [False, True])
+def test_polygon_sampler(shapely_1, monkeypatch):
+    if shapely_1:
+        monkeypatch.delattr(shapely, "constrained_delaunay_triangles", raising=False)
+
+    geometries = create_zones()
+    sampler = data.spatial.utils.PolygonSampler(geometries)
+
+    random = np.random.RandomState(0)
+    indices = np.repeat([2, 3], 20000)
+    points = sampler.sample(indices, random)
+
+    # All points lie in their polygon
+    for index in (2, 3):
+        f = indices == index
+        assert shapely.vectorized.contains(geometries[index], points[f, 0], points[f, 1]).all()
+
+    # The points are uniformly distributed, the share in any part matches its area
+    for index, part in [(2, geo.box(20.0, 0.0, 30.0, 2.0)), (3, geo.box(8.0, 22.0, 10.0, 30.0))]:
+        f = indices == index
+        share = np.mean(shapely.vectorized.contains(part, points[f, 0], points[f, 1]))
+        assert abs(share - part.intersection(geometries[index]).area / geometries[index].area) < 0.01
+
+    # Without constrained triangulation, the triangles in the hole need the exact test
+    assert np.all(sampler.get_triangles(2)[2]) == hasattr(shapely, "constrained_delaunay_triangles")
+
+
+def test_deduplicate():
+    x = np.array([1.0, 2.0, 1.0, np.nan, 1.0, np.nan, 2.0])
+    y = np.array([5.0, 5.0, 5.0, np.nan, 6.0, np.nan, 5.0])
+
+    unique_x, unique_y, inverse = data.spatial.utils.deduplicate(x, y)
+
+    # Missing coordinates form one location of their own
+    assert len(unique_x) == 4
+    np.testing.assert_array_equal(unique_x[inverse], x)
+    np.testing.assert_array_equal(unique_y[inverse], y)
+    assert np.array_equal(inverse, [0, 1, 0, 2, 3, 2, 1])
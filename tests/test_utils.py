@@ -0,0 +1,128 @@
+import contextlib
+import gc
+import io
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data.constants as c
+import data.utils
+
+
+def test_dense_lookup():
+    lookup = data.utils.DenseLookup([5, 2, 9])
+    assert np.array_equal(lookup([2, 9, 5, 3, 100, -1, np.nan]), [1, 2, 0, -1, -1, -1, -1])
+
+
+def test_dense_mapping():
+    # 1 -> 2 -> 3 is resolved to 1 -> 3, the second mapping of 4 is ignored
+    mapping = data.utils.DenseMapping([1, 2, 4, 4, 6], [2, 3, 5, 7, 6])
+
+    result = mapping([1, 2, 4, 6, 8, np.nan])
+    assert np.array_equal(result[:4], [3, 3, 5, 6])
+    assert np.all(np.isnan(result[4:]))
+
+
+def test_get_mapping_is_cached_per_data_frame():
+    df = pd.DataFrame({"deprecated_id": [1, 2], "id": [10, 20]})
+
+    mapping = data.utils.get_mapping(df, "deprecated_id", "id")
+    assert data.utils.get_mapping(df, "deprecated_id", "id") is mapping
+    assert np.array_equal(mapping([2, 1]), [20, 10])
+
+    other = pd.DataFrame({"deprecated_id": [1, 2], "id": [30, 40]})
+    assert np.array_equal(data.utils.get_mapping(other, "deprecated_id", "id")([2, 1]), [40, 30])
+
+    # Entries do not keep their data frame alive
+    identifier = id(df)
+    del df, mapping
+    gc.collect()
+
+    assert identifier not in data.utils._mappings.entries
+
+
+def test_enforce_categories():
+    df = data.utils.enforce_categories(pd.DataFrame({
+        "mode": ["walk", None, "car"], "purpose": ["home", "work", "home"], "other": ["a", "b", "c"]
+    }))
+
+    assert list(df["mode"].cat.categories) == c.MODE_CATEGORIES
+    assert list(df["purpose"].cat.categories) == c.PURPOSE_CATEGORIES
+    assert df["mode"].isna()[1] and not isinstance(df["other"].dtype, pd.CategoricalDtype)
+
+    with pytest.raises(RuntimeError):
+        data.utils.enforce_categories(pd.DataFrame({"mode": ["walk", "hoverboard"]}))
+
+
+class Context:
+    def __init__(self, threads=1):
+        self.threads = threads
+
+    def config(self, name):
+        assert name == "threads"
+        return self.threads
+
+    @contextlib.contextmanager
+    def progress(self, total=None):
+        yield Progress()
+
+
+class Progress:
+    def update(self, count=1):
+        pass
+
+
+def test_read_csv():
+    f = io.StringIO("a;b;c;d\n1;2.5;x;3\n2;;y;4\n3;1.0;z;5\n")
+
+    df = data.utils.read_csv(Context(), f, {"a": int, "b": float, "d": np.int16, "c": str.upper},
+                             renames={"a": "id"}, chunk_size=2, filter=lambda df: df["id"] != 2)
+
+    assert list(df.columns) == ["id", "b", "d", "c"]
+    assert list(df["id"]) == [1, 3] and df["d"].dtype == np.int16
+    assert list(df["c"]) == ["X", "Z"] and np.array_equal(df["b"], [2.5, 1.0])
+
+
+def test_prefetch():
+    # All reads have to run at the same time to pass the barrier
+    barrier = threading.Barrier(3, timeout=10.0)
+
+    def read(value):
+        barrier.wait()
+        time.sleep(0.01 * value)
+        return value * 2
+
+    assert list(data.utils.prefetch(Context(threads=4), read, [3, 1, 2])) == [6, 2, 4]
+
+    # A single thread reads lazily in order
+    values = []
+    results = data.utils.prefetch(Context(), lambda value: values.append(value) or value, [1, 2])
+
+    assert next(results) == 1 and values == [1]
+    assert list(results) == [2] and values == [1, 2]
+
+
+def test_apply_dtype_policy():
+    df = data.utils.apply_dtype_policy(pd.DataFrame({
+        "person_id": np.array([1, 2, 3], dtype=np.int64),
+        "household_id": [1.0, np.nan, 2.0],  # Missing ids keep their type
+        "trip_id": [1, 2, 2 ** 40],  # Too large for int32
+        "departure_time": [3600.0, 7200.0, 86400.0 * 2],
+        "arrival_time": [3600.5, np.nan, 7200.0],
+        "travel_time": [1.0, 2.0, 2.0 ** 30],  # Too large for float32 seconds
+        "x": [2600000.123, 2600001.0, 2600002.0],  # Coordinates are not part of the policy
+    }))
+
+    assert df["person_id"].dtype == np.int32
+    assert df["household_id"].dtype == np.float64
+    assert df["trip_id"].dtype == np.int64
+    assert df["departure_time"].dtype == np.int32
+    assert df["arrival_time"].dtype == np.float32 and np.isnan(df["arrival_time"][1])
+    assert df["travel_time"].dtype == np.float64
+    assert df["x"].dtype == np.float64
+
+    assert np.array_equal(df["departure_time"], [3600, 7200, 172800])
+    assert df["arrival_time"][0] == 3600.5
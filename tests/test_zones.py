@@ -0,0 +1,37 @@
+import gc
+
+import numpy as np
+import pandas as pd
+
+import data.spatial.zones
+
+
+def create_zones():
+    return pd.DataFrame({
+        "zone_id": [0, 1, 2, 3, 4],
+        "zone_level": pd.Categorical(["country", "country", "municipality", "municipality", "nuts_2"]),
+        "zone_level_id": ["CH", "DE", 261, 1061, "DE11"],
+    })
+
+
+def test_zone_resolver():
+    resolver = data.spatial.zones.ZoneResolver(create_zones())
+
+    assert np.array_equal(resolver.resolve("municipality", [1061, 261, 5, np.nan]), [3, 2, -1, -1])
+    assert np.array_equal(resolver.resolve("country", ["DE", "FR", "CH"]), [1, -1, 0])
+    assert np.array_equal(resolver.resolve("nuts_2", ["DE11"]), [4])
+    assert np.array_equal(resolver.resolve("quarter", [1, 2]), [-1, -1])
+
+
+def test_get_resolver_is_cached_per_zone_table():
+    df_zones = create_zones()
+
+    resolver = data.spatial.zones.get_resolver(df_zones)
+    assert data.spatial.zones.get_resolver(df_zones) is resolver
+    assert data.spatial.zones.get_resolver(create_zones()) is not resolver
+
+    identifier = id(df_zones)
+    del df_zones, resolver
+    gc.collect()
+
+    assert identifier not in data.spatial.zones._resolvers.entries